@@ -0,0 +1,194 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+class Rejected(Exception):
+  """A request turned away before generation; `status` and `retry_after` shape the response"""
+
+  def __init__(self, reason, status, retry_after):
+    super().__init__(reason)
+    self.reason = reason
+    self.status = status
+    self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+  def __init__(self, capacity, now):
+    self.tokens = capacity
+    self.updated = now
+
+class ClientRateLimiter:
+  """Token bucket per client: `rate` requests per second with bursts of `burst`.
+
+  Buckets live in a bounded LRU; a client evicted from it simply starts
+  again with a full bucket. `api_keys` are the X-API-Key values clients may
+  be identified by; any other key is ignored (see `client_key`).
+  """
+
+  def __init__(self, rate, burst, max_clients=10000, api_keys=()):
+    self.rate = rate
+    self.burst = max(burst, 1)
+    self.api_keys = frozenset(api_keys)
+    self.max_clients = max_clients
+    self.buckets = OrderedDict()
+    self.lock = threading.Lock()
+
+  def check(self, client):
+    """Take one token for client; raises Rejected (429) when its bucket is empty"""
+    now = time.monotonic()
+    with self.lock:
+      bucket = self.buckets.get(client)
+      if bucket is None:
+        bucket = self.buckets[client] = TokenBucket(self.burst, now)
+        while len(self.buckets) > self.max_clients:
+          self.buckets.popitem(last=False)
+      else:
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        self.buckets.move_to_end(client)
+      if bucket.tokens >= 1:
+        bucket.tokens -= 1
+        return
+      wait = (1 - bucket.tokens) / self.rate
+    raise Rejected('rate_limited', 429, wait)
+
+class Waiter:
+  """A queued request, woken from a thread (`event`) or an event loop (`future`)"""
+
+  def __init__(self, loop=None):
+    self.granted = False
+    self.loop = loop
+    self.future = loop.create_future() if loop else None
+    self.event = None if loop else threading.Event()
+
+  def grant(self):
+    self.granted = True
+    if self.loop:
+      self.loop.call_soon_threadsafe(self._resolve)
+    else:
+      self.event.set()
+
+  def _resolve(self):
+    if not self.future.done():
+      self.future.set_result(True)
+
+class AdmissionController:
+  """Caps concurrent generations, with a bounded FIFO queue in front.
+
+  `acquire` (from a thread) or `aacquire` (from an event loop) returns the
+  seconds spent queued once a slot is free. A request is rejected with 503
+  right away when the queue is full, or once it has waited `queue_timeout`
+  seconds. Every admitted request must call `release`, which hands its slot
+  straight to the oldest waiter. Retry-After is estimated from the average
+  time a slot is held. `on_change(active, queued)` is called whenever either
+  count changes.
+  """
+
+  def __init__(self, max_concurrent, max_queue, queue_timeout, on_change=None):
+    self.max_concurrent = max_concurrent
+    self.max_queue = max_queue
+    self.queue_timeout = queue_timeout
+    self.active = 0
+    self.waiters = deque()
+    self.lock = threading.Lock()
+    self.hold_seconds = 1.0
+    self.on_change = on_change
+
+  @property
+  def queue_depth(self):
+    return len(self.waiters)
+
+  def _changed(self):
+    if self.on_change:
+      self.on_change(self.active, len(self.waiters))
+
+  def retry_after(self):
+    return self.hold_seconds * (len(self.waiters) + 1) / self.max_concurrent
+
+  def _enter(self, waiter):
+    """Take a free slot (True) or queue waiter (False); caller holds the lock"""
+    if self.active < self.max_concurrent and not self.waiters:
+      self.active += 1
+      self._changed()
+      return True
+    if len(self.waiters) >= self.max_queue:
+      raise Rejected('queue_full', 503, self.retry_after())
+    self.waiters.append(waiter)
+    self._changed()
+    return False
+
+  def _give_up(self, waiter):
+    """Leave the queue after a timeout, unless a slot arrived meanwhile"""
+    with self.lock:
+      if waiter.granted:
+        return False
+      self.waiters.remove(waiter)
+      self._changed()
+      return True
+
+  def acquire(self):
+    start = time.monotonic()
+    waiter = Waiter()
+    with self.lock:
+      if self._enter(waiter):
+        return 0.0
+    if not waiter.event.wait(self.queue_timeout) and self._give_up(waiter):
+      raise Rejected('queue_timeout', 503, self.retry_after())
+    return time.monotonic() - start
+
+  async def aacquire(self):
+    start = time.monotonic()
+    waiter = Waiter(asyncio.get_running_loop())
+    with self.lock:
+      if self._enter(waiter):
+        return 0.0
+    try:
+      await asyncio.wait_for(waiter.future, self.queue_timeout)
+    except asyncio.TimeoutError:
+      if self._give_up(waiter):
+        raise Rejected('queue_timeout', 503, self.retry_after())
+    except asyncio.CancelledError:
+      # The slot may already be ours; pass it on rather than leak it
+      if not self._give_up(waiter):
+        self.release()
+      raise
+    return time.monotonic() - start
+
+  def release(self, held_seconds=None):
+    with self.lock:
+      if held_seconds is not None:
+        self.hold_seconds += 0.1 * (held_seconds - self.hold_seconds)
+      if self.waiters:
+        self.waiters.popleft().grant()
+      else:
+        self.active -= 1
+      self._changed()
+
+def client_key(api_key, remote_addr, api_keys=()):
+  """Rate limit key: the caller's API key when it is one of `api_keys`, else its address.
+
+  X-API-Key is not authenticated, so an arbitrary key would let a client
+  rotate its way to a fresh bucket on every request.
+  """
+  if api_key and api_key in api_keys:
+    return f"key:{api_key}"
+  return f"addr:{remote_addr or 'unknown'}"
+
+def admission_from_env(on_change=None):
+  """(AdmissionController or None, ClientRateLimiter or None) from the ADMISSION_* / RATE_LIMIT_* variables"""
+  max_concurrent = int(os.getenv('ADMISSION_MAX_CONCURRENT', '32'))
+  controller = AdmissionController(
+    max_concurrent,
+    max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', '64')),
+    queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', '10')),
+    on_change=on_change,
+  ) if max_concurrent > 0 else None
+  rate = float(os.getenv('RATE_LIMIT_PER_SECOND', '0'))
+  limiter = ClientRateLimiter(
+    rate,
+    burst=int(os.getenv('RATE_LIMIT_BURST', '10')),
+    api_keys=[key.strip() for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()],
+  ) if rate > 0 else None
+  return controller, limiter
@@ -1,41 +1,83 @@
 import os
+import threading
 import time
-import json
 import logging
 import uuid
 from datetime import datetime
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+from werkzeug.serving import WSGIRequestHandler
 from dotenv import load_dotenv
-from google import genai
 from google.genai import types
+from knowledge_base import KNOWLEDGE_BASE, parse_sections, knowledge_base_version
+from context_cache import ContextCache, is_cache_error
+from response_cache import ResponseCache, conversation_key
+from token_usage import TokenCounter, TokenUsage, estimate_tokens, usage_from_metadata
+from pricing import calculate_cost, get_pricing
+from retrieval import BM25Index, build_query
+from faq_matcher import FaqMatcher
+from logging_setup import RequestLog, configure_from_env, request_verbosity
+from ledger import LEDGER_SCHEMA_VERSION, ledger_from_env
+from upstream import create_upstream
+from prompt_registry import PromptRegistry
+from context_window import ContextWindow, MESSAGE_OVERHEAD_TOKENS
+from summarizer import ConversationSummarizer
+from conversation_store import ConversationNotFound, conversation_store_from_env
+from coalescing import RequestCoalescer
+from admission import Rejected, admission_from_env, client_key
+from resilience import resilience_from_env
+from cascade import Escalation, ModelCascade, ResponseJudge, cascade_models_from_env
+from batch import parse_batch, read_frames, run_batch
+from sse import CONTENT_TYPE as SSE_CONTENT_TYPE, HEADERS as SSE_HEADERS, EventStream
+from metrics_registry import CONTENT_TYPE as METRICS_CONTENT_TYPE, TOKEN_BUCKETS, MetricsRegistry
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-  level=logging.INFO,
-  format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-  handlers=[
-    logging.FileHandler('chat_app.log'),
-    logging.StreamHandler()
-  ]
-)
+# Configure logging: records go through a queue to a background writer that
+# batches writes to chat_app.log and stdout
+configure_from_env()
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
-
-# Configure Gemini API
-client = genai.Client(api_key=os.getenv('GOOGLE_API_KEY'))
-model_name = 'gemini-flash-lite-latest'
+# Default per-request log verbosity ('summary' or 'debug'). A request can
+# override it with the X-Log-Verbosity header only when it also sends
+# LOG_DEBUG_KEY as X-Log-Debug-Key; with no key set the header is ignored.
+LOG_VERBOSITY = os.getenv('LOG_VERBOSITY', 'summary').lower()
+LOG_DEBUG_KEY = os.getenv('LOG_DEBUG_KEY', '')
 
-# Pricing information for Gemini Flash (as of 2024)
-PRICING_PER_TOKEN = {
-  'input': 0.0001 / 1000,    # $.10 per 1M tokens
-  'output': 0.0004 / 1000    # $.40 per 1M tokens
-}
+app = Flask(__name__)
+CORS(app, expose_headers=['X-Conversation-Id', 'Retry-After', 'X-Batch-Id'])
+
+# Configure the model API. GEMINI_BACKEND=fake streams canned answers from
+# fake_gemini.py (tuned with FAKE_GEMINI_* variables) for offline load tests.
+# CASSETTE_RECORD=true saves every completed stream to the cassette file at
+# CASSETTE_PATH, and GEMINI_BACKEND=replay streams those recordings back
+# with their original timing, scaled by CASSETTE_TIME_SCALE.
+upstream = create_upstream(
+  os.getenv('GEMINI_BACKEND', 'gemini'),
+  api_key=os.getenv('GOOGLE_API_KEY'),
+  record=os.getenv('CASSETTE_RECORD', 'false').lower() == 'true',
+)
+client = upstream.client
+
+# Model tiers, cheapest first (CASCADE_MODELS, e.g.
+# "gemini-flash-lite-latest,gemini-flash-latest"). model_name is the first
+# tier, the one most requests are served from.
+cascade_models = cascade_models_from_env('gemini-flash-lite-latest')
+model_name = cascade_models[0]
+
+# Offline token counting for streams that report no usage_metadata; the
+# tokenizer loads in the background from startup
+token_counter = TokenCounter(model_name)
+token_counter.warm()
+
+# Conversation window: the most recent turns that fit CONTEXT_WINDOW_TOKENS,
+# with single messages over CONTEXT_MAX_MESSAGE_TOKENS cut down. Messages are
+# measured with the heuristic estimate, which needs no tokenizer on the
+# request path.
+CONTEXT_WINDOW_TOKENS = int(os.getenv('CONTEXT_WINDOW_TOKENS', '2000'))
+CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv('CONTEXT_MAX_MESSAGE_TOKENS', '0')) or None
+context_window = ContextWindow(estimate_tokens, CONTEXT_WINDOW_TOKENS, CONTEXT_MAX_MESSAGE_TOKENS)
 
 # Safety Settings
 safety_settings = [
@@ -45,24 +87,878 @@ safety_settings = [
   types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF")
 ]
 
-def format_conversation_for_gemini(messages):
-  """Format the last 5 messages for Gemini API"""
-  formatted_messages = []
+# Knowledge base retrieval: sections are parsed and indexed once at startup.
+# RETRIEVAL_TOP_K=0 sends the whole knowledge base on every request.
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '4'))
+kb_sections = parse_sections(KNOWLEDGE_BASE)
+kb_index = BM25Index(kb_sections)
+
+# FAQ fast path: a question that restates a knowledge base heading (cosine
+# similarity of at least FAQ_MATCH_THRESHOLD, clearly ahead of the next best)
+# is answered with that section's text, without calling Gemini.
+# FAQ_FAST_PATH_ENABLED=false sends every question to the model.
+FAQ_FAST_PATH_ENABLED = os.getenv('FAQ_FAST_PATH_ENABLED', 'true').lower() == 'true'
+FAQ_MATCH_THRESHOLD = float(os.getenv('FAQ_MATCH_THRESHOLD', '0.75'))
+faq_matcher = FaqMatcher(kb_sections, threshold=FAQ_MATCH_THRESHOLD) if FAQ_FAST_PATH_ENABLED else None
+
+# Prompts, message Contents and the generation config are built once and
+# shared by every request
+prompts = PromptRegistry(kb_sections, {
+  'temperature': 0.7,
+  'top_p': 0.8,
+  'max_output_tokens': 2048,
+  'safety_settings': safety_settings,
+})
+
+def retrieve_sections(messages):
+  """Return the knowledge base sections relevant to the conversation, in document order"""
+  if RETRIEVAL_TOP_K <= 0:
+    return kb_sections
+  results = kb_index.search(build_query(messages), top_k=RETRIEVAL_TOP_K)
+  if not results:
+    # Nothing to go on ("thanks!", "what note?"): send the whole knowledge base
+    return kb_sections
+  return sorted((section for section, _ in results), key=lambda section: section.index)
+
+# Context caching: the instructions plus the full knowledge base are registered
+# once as a cached prefix and referenced by name, instead of being resent on
+# every request. Requests fall back to the retrieved prompt inline whenever the
+# cache is unavailable; retrieval is skipped while it is in use.
+CONTEXT_CACHE_ENABLED = os.getenv('CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv('CONTEXT_CACHE_TTL_SECONDS', '3600'))
+kb_version = knowledge_base_version()
+
+def build_cached_prefix():
+  """Contents registered as the cached prompt prefix"""
+  return [prompts.full_prompt_content]
+
+context_cache = ContextCache(
+  upstream.cache_backend,
+  build_cached_prefix,
+  kb_version,
+  ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+) if CONTEXT_CACHE_ENABLED else None
+
+# Response cache for repeated questions, keyed on the normalized conversation
+# window. RESPONSE_CACHE_SIZE=0 disables it.
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+response_cache = ResponseCache(
+  max_entries=RESPONSE_CACHE_SIZE,
+  ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+  version=kb_version,
+) if RESPONSE_CACHE_SIZE > 0 else None
+
+# Concurrent requests for the same conversation window share one upstream
+# stream: the first one calls the model and the others replay its chunks.
+# COALESCE_REQUESTS=false gives every request its own stream.
+COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', 'true').lower() == 'true'
+coalescer = RequestCoalescer() if COALESCE_REQUESTS else None
+
+def reload_knowledge_base(text=KNOWLEDGE_BASE):
+  """Re-parse the knowledge base and rebuild the index, prompts and caches derived from it"""
+  global kb_sections, kb_index, kb_version, faq_matcher
+  sections = parse_sections(text)
+  kb_index = BM25Index(sections)
+  if faq_matcher:
+    faq_matcher = FaqMatcher(sections, threshold=FAQ_MATCH_THRESHOLD)
+  kb_sections = sections
+  prompts.reload(sections)
+  kb_version = knowledge_base_version(text)
+  if context_cache:
+    context_cache.set_version(build_cached_prefix, kb_version)
+  if response_cache:
+    response_cache.set_version(kb_version)
+  logger.info("Knowledge base reloaded: %d sections, version %s", len(sections), kb_version)
+
+# Structured per-request ledger (JSONL, rotated); LEDGER_PATH= disables it
+request_ledger = ledger_from_env()
+
+# Server-side conversation histories, so a client holding a conversation_id
+# only sends the new turn (in memory, plus SQLite with CONVERSATION_DB_PATH).
+# CONVERSATION_STORE_SIZE=0 disables it.
+conversation_store = conversation_store_from_env()
+
+def resolve_conversation(data):
+  """(conversation_id, messages, incremental) for a /chat request body.
+
+  A body with `messages` is the full-history format and is used as sent. A
+  body with only `message` continues the stored conversation named by
+  `conversation_id`, or starts a new one. Raises ConversationNotFound for an
+  unknown or expired id, so the client can resend the full history.
+  """
+  messages = data.get('messages') or []
+  conversation_id = data.get('conversation_id')
+  if messages:
+    if conversation_store is None:
+      return None, messages, False
+    return conversation_id or conversation_store.new_id(), messages, False
+  
+  message = data.get('message')
+  if isinstance(message, dict):
+    message = message.get('content')
+  if not message:
+    return conversation_id, [], False
+  
+  if conversation_id:
+    if conversation_store is None:
+      raise ConversationNotFound(conversation_id)
+    history = conversation_store.get(conversation_id)
+  else:
+    history = []
+    conversation_id = conversation_store.new_id() if conversation_store else None
+  return conversation_id, history + [{'role': 'user', 'content': message}], True
+
+# Prometheus-style metrics exported on /metrics. When several worker processes
+# serve the app, point METRICS_MULTIPROC_DIR at a shared directory so each
+# scrape aggregates all of them.
+registry = MetricsRegistry(multiprocess_dir=os.getenv('METRICS_MULTIPROC_DIR') or None)
+REQUESTS_TOTAL = registry.counter('chat_requests_total', 'Finished /chat requests by outcome', ['outcome'])
+STREAMS_IN_FLIGHT = registry.gauge('chat_streams_in_flight', 'Streaming /chat responses currently open')
+REQUEST_LATENCY = registry.histogram('chat_request_latency_seconds', 'Total /chat latency', ['cached'])
+AI_LATENCY = registry.histogram('chat_ai_latency_seconds', 'Upstream generation latency', ['model'])
+FIRST_CHUNK_LATENCY = registry.histogram('chat_time_to_first_chunk_seconds', 'Time from request start to the first content chunk', ['model'])
+UPSTREAM_CONNECT_LATENCY = registry.histogram('chat_upstream_connect_seconds', 'Time from the upstream call to its first response', ['model'])
+MAX_CHUNK_GAP = registry.histogram('chat_max_chunk_gap_seconds', 'Longest gap between consecutive content chunks of a response', ['model'])
+FLUSH_TIME = registry.histogram('chat_flush_seconds', 'Time spent writing frames to the client per response', ['model'])
+CONTEXT_TOKENS = registry.histogram('chat_context_tokens', 'Estimated conversation tokens sent per request', buckets=TOKEN_BUCKETS)
+OUTPUT_TOKENS = registry.histogram('chat_output_tokens', 'Output tokens per generated response', ['model'], buckets=TOKEN_BUCKETS)
+TOKENS_TOTAL = registry.counter('chat_tokens_total', 'Tokens processed by kind (input, cached_input, output, thinking, summary_input, summary_output)', ['model', 'kind'])
+COST_TOTAL = registry.counter('chat_cost_usd_total', 'Cumulative generation cost in USD', ['model'])
+FAQ_LOOKUPS = registry.counter('chat_faq_lookups_total', 'FAQ fast-path lookups by result (hit rate = hit / all)', ['result'])
+COALESCED_TOTAL = registry.counter('chat_coalesced_requests_total', 'Requests that joined an identical in-flight upstream stream')
+GENERATIONS_ACTIVE = registry.gauge('chat_generations_active', 'Generations holding an admission slot')
+ADMISSION_QUEUE_DEPTH = registry.gauge('chat_admission_queue_depth', 'Requests waiting for an admission slot')
+ADMISSION_WAIT = registry.histogram('chat_admission_wait_seconds', 'Time admitted requests spent queued for a slot')
+
+# Admission control: at most ADMISSION_MAX_CONCURRENT generations run at once
+# (0 disables the cap) and up to ADMISSION_MAX_QUEUE more wait for a slot for
+# ADMISSION_QUEUE_TIMEOUT_SECONDS before a 503. With RATE_LIMIT_PER_SECOND set
+# (default 0, off) each client (its X-API-Key header if listed in
+# RATE_LIMIT_API_KEYS, else its remote address) is also rate limited to that many requests with bursts of RATE_LIMIT_BURST, or gets a
+# 429. Rejections carry Retry-After and are counted in chat_requests_total by
+# reason.
+def record_admission(active, queued):
+  GENERATIONS_ACTIVE.set(active)
+  ADMISSION_QUEUE_DEPTH.set(queued)
+
+admission, rate_limiter = admission_from_env(on_change=record_admission)
+
+UPSTREAM_EVENTS = registry.counter('chat_upstream_events_total', 'Upstream retries, first-chunk timeouts, hedges, fallbacks and circuit changes', ['event', 'model'])
+CIRCUIT_OPEN = registry.gauge('chat_circuit_open', 'Whether the circuit breaker of a model is open', ['model'])
+
+# Upstream resilience: a call that sends nothing within
+# UPSTREAM_FIRST_CHUNK_TIMEOUT_SECONDS, or fails before its first chunk, is
+# retried up to UPSTREAM_MAX_RETRIES times with jittered backoff. With
+# UPSTREAM_HEDGE_PERCENTILE (e.g. 95) a second call starts once the first is
+# slower than that percentile of recent first-chunk times. After
+# BREAKER_FAILURE_THRESHOLD failures in a row the model's circuit opens for
+# BREAKER_RESET_SECONDS and calls go to UPSTREAM_FALLBACK_MODEL.
+def record_upstream_event(event, model):
+  UPSTREAM_EVENTS.inc(event=event, model=model)
+  if event in ('circuit_open', 'circuit_closed'):
+    CIRCUIT_OPEN.set(int(event == 'circuit_open'), model=model)
+    logger.warning("Circuit for %s is now %s", model, event.split('_')[1])
+
+resilience = {model: resilience_from_env(model, on_event=record_upstream_event) for model in cascade_models}
+
+# Model cascade: with more than one tier, each answer is judged while its
+# first CASCADE_JUDGE_CHARS characters are buffered and again when it ends.
+# Refusals, "I don't know", safety blocks, failures and answers shorter than
+# CASCADE_MIN_CHARS are retried on the next tier.
+CASCADE_JUDGE_CHARS = int(os.getenv('CASCADE_JUDGE_CHARS', '160'))
+CASCADE_MIN_CHARS = int(os.getenv('CASCADE_MIN_CHARS', '20'))
+ESCALATIONS_TOTAL = registry.counter('chat_cascade_escalations_total', 'Answers rejected by the cascade judge, by tier model and reason', ['model', 'reason'])
+cascade = ModelCascade(
+  cascade_models,
+  ResponseJudge(min_chars=CASCADE_MIN_CHARS),
+  judge_chars=CASCADE_JUDGE_CHARS,
+) if len(cascade_models) > 1 else None
+
+# /chat/batch answers up to BATCH_MAX_ITEMS conversations per request,
+# BATCH_CONCURRENCY at a time (a batch may ask for fewer). Each item that
+# calls upstream still takes an admission slot like any other generation.
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
+# /chat streams text/event-stream frames with event ids. Idle streams get a
+# heartbeat comment every SSE_HEARTBEAT_SECONDS (0 disables). With
+# SSE_COALESCE_CHARS set, answer text after the first chunk is held back and
+# sent once that many characters are waiting or SSE_COALESCE_MS has passed.
+# On this server idle ticks come from waiting on a coalesced shared stream;
+# with COALESCE_REQUESTS=false frames go out only as chunks arrive.
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_COALESCE_CHARS = int(os.getenv('SSE_COALESCE_CHARS', '0'))
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '50'))
+
+def rejection_body(rejected):
+  """JSON body and headers of a 429/503 rejection"""
+  messages = {
+    'rate_limited': 'Too many requests from this client',
+    'queue_full': 'Server is at capacity',
+    'queue_timeout': 'Server is at capacity',
+  }
+  body = {'error': messages.get(rejected.reason, str(rejected)), 'code': rejected.reason, 'retry_after': rejected.retry_after}
+  return body, {'Retry-After': str(rejected.retry_after)}
+
+# Rolling summaries of the turns older than the conversation window, built in
+# the background after a response completes and sent as one message at the
+# start of the window. SUMMARY_MAX_TOKENS of the window budget is reserved
+# for it.
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'false').lower() == 'true'
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '200'))
+
+def record_summary_usage(usage_metadata):
+  usage = usage_from_metadata(usage_metadata)
+  if usage is None:
+    return
+  TOKENS_TOTAL.inc(usage.prompt_tokens, model=model_name, kind='summary_input')
+  TOKENS_TOTAL.inc(usage.output_tokens, model=model_name, kind='summary_output')
+  COST_TOTAL.inc(calculate_cost(model_name, usage), model=model_name)
+
+summarizer = ConversationSummarizer(
+  client,
+  model_name,
+  max_tokens=SUMMARY_MAX_TOKENS,
+  on_usage=record_summary_usage,
+) if SUMMARY_ENABLED else None
+
+def replay_cached_response(chat_request):
+  """Stream a cached answer in the same SSE format as a live generation"""
+  cached_response = chat_request.cached_response
+  start_time = chat_request.start_time
+  for text in cached_response.chunks:
+    if chat_request.first_chunk_time is None:
+      chat_request.first_chunk_time = time.time()
+    frame = chat_request.stream.content(text)
+    if frame:
+      yield frame
+  
+  latency = time.time() - start_time
+  metrics = {
+    'type': 'metrics',
+    'input_tokens': 0,
+    'cached_input_tokens': 0,
+    'uncached_input_tokens': 0,
+    'output_tokens': 0,
+    'thinking_tokens': 0,
+    'total_tokens': 0,
+    'cost': 0,
+    'latency': round(latency, 4),
+    'ai_latency': 0,
+    'ttft': round(chat_request.first_chunk_time - start_time, 4) if chat_request.first_chunk_time else None,
+    'chunk_count': len(cached_response.chunks),
+    'cached': True,
+    'cache_age_s': round(time.time() - cached_response.created_at, 1),
+    'original_latency': cached_response.metrics.get('latency'),
+    'conversation_id': chat_request.conversation_id,
+    'tokens_per_second': 0
+  }
+  yield chat_request.stream.event(metrics)
+  yield chat_request.stream.done()
+  
+  chat_request.log.info("Served from response cache in %.2fms", latency * 1000)
+  chat_request.chunk_count = len(cached_response.chunks)
+  chat_request.remember(''.join(cached_response.chunks))
+  chat_request.record('ok')
+
+def stream_faq_answer(chat_request):
+  """Stream the matched FAQ answer in the same SSE format as a live generation"""
+  section, score = chat_request.faq_match
+  chunks = faq_matcher.answers[section.index]
+  start_time = chat_request.start_time
+  for text in chunks:
+    if chat_request.first_chunk_time is None:
+      chat_request.first_chunk_time = time.time()
+    frame = chat_request.stream.content(text)
+    if frame:
+      yield frame
   
-  for msg in messages:
-    role = "user" if msg["role"] == "user" else "model"
-    formatted_messages.append(types.Content(
-      role=role,
-      parts=[types.Part.from_text(text=msg["content"])]
-    ))
+  latency = time.time() - start_time
+  metrics = {
+    'type': 'metrics',
+    'input_tokens': 0,
+    'cached_input_tokens': 0,
+    'uncached_input_tokens': 0,
+    'output_tokens': 0,
+    'thinking_tokens': 0,
+    'total_tokens': 0,
+    'cost': 0,
+    'latency': round(latency, 4),
+    'ai_latency': 0,
+    'ttft': round(chat_request.first_chunk_time - start_time, 4) if chat_request.first_chunk_time else None,
+    'chunk_count': len(chunks),
+    'cached': False,
+    'fast_path': True,
+    'faq_heading': section.heading,
+    'faq_score': round(score, 3),
+    'conversation_id': chat_request.conversation_id,
+    'tokens_per_second': 0
+  }
+  yield chat_request.stream.event(metrics)
+  yield chat_request.stream.done()
   
-  return formatted_messages
+  chat_request.log.info("Answered from FAQ section %d (score %.2f) in %.2fms", section.index, score, latency * 1000)
+  chat_request.chunk_count = len(chunks)
+  chat_request.remember(section.body)
+  chat_request.record('ok')
 
-def calculate_cost(input_tokens, output_tokens):
-  """Calculate the cost based on token usage"""
-  input_cost = input_tokens * PRICING_PER_TOKEN['input']
-  output_cost = output_tokens * PRICING_PER_TOKEN['output']
-  return input_cost + output_cost
+def format_conversation_for_gemini(messages):
+  """Format the conversation window for Gemini API, reusing already converted messages"""
+  return prompts.format_conversation(messages)
+
+class ChatRequest:
+  """State of one /chat request, shared by the Flask and ASGI servers.
+
+  `prepare` runs everything before the upstream call, `record_chunk` is fed
+  each streamed chunk and `finish` computes and logs the final metrics.
+  """
+
+  def __init__(self, request_id, messages, start_time, log=None, conversation_id=None, incremental=False):
+    self.request_id = request_id
+    self.log = log or RequestLog(logger, request_id, LOG_VERBOSITY)
+    self.messages = messages
+    self.conversation_id = conversation_id
+    self.incremental = incremental
+    self.start_time = start_time
+    self.cached_response = None
+    self.faq_match = None
+    self.coalesced = False
+    self.model = model_name
+    self.stream = EventStream(SSE_COALESCE_CHARS, SSE_COALESCE_MS / 1000, SSE_HEARTBEAT_SECONDS)
+    self.escalations = []
+    self.chunks = []
+    self.full_response = ""
+    self.chunk_count = 0
+    self.usage = None
+    self.metrics = None
+    self.cache_name = None
+    self.relevant_sections = None
+    self.retrieval_ms = 0.0
+    self.ai_start_time = None
+    self.first_chunk_time = None
+    self.connect_time = None
+    self.last_chunk_time = None
+    self.max_chunk_gap = 0.0
+    self.total_chunk_gap = 0.0
+    self.flush_seconds = 0.0
+    self.queue_seconds = 0.0
+    self.admitted_at = None
+    self.streaming = False
+
+  def prepare(self):
+    log = self.log
+    messages = self.messages
+    
+    # Log conversation summary (debug verbosity only; it touches every message)
+    if log.verbose:
+      conversation_summary = []
+      for i, msg in enumerate(messages):
+        role = msg.get('role', 'unknown')
+        content_preview = msg.get('content', '')[:100] + '...' if len(msg.get('content', '')) > 100 else msg.get('content', '')
+        conversation_summary.append(f"{role}: {content_preview}")
+      
+      log.detail("Conversation summary: %s", ' | '.join(conversation_summary))
+    
+    # Keep the most recent turns that fit the token budget, led by a summary
+    # of the older ones when summarization is enabled
+    reserve = SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS if summarizer else 0
+    self.window = context_window.select(messages, reserve=reserve)
+    self.dropped_messages = messages[:self.window.start]
+    self.summary = summarizer.lookup(self.dropped_messages) if summarizer and self.dropped_messages else None
+    self.recent_messages = self.window.messages
+    self.context_tokens = self.window.tokens
+    if self.summary:
+      summary_message = summarizer.as_message(self.summary)
+      self.recent_messages = [summary_message] + self.recent_messages
+      self.context_tokens += context_window.message_tokens(summary_message)
+    log.detail(
+      "Using %d recent messages (%d tokens, %d dropped, %d truncated, summary of %d)",
+      len(self.window.messages), self.context_tokens, self.window.dropped, self.window.truncated,
+      self.summary.covered if self.summary else 0,
+    )
+    
+    # Answer questions that restate an FAQ heading without calling the model
+    latest = messages[-1] if messages else {}
+    if faq_matcher and latest.get('role', 'user') == 'user':
+      self.faq_match = faq_matcher.match(latest.get('content', ''))
+      FAQ_LOOKUPS.inc(result='hit' if self.faq_match else 'miss')
+      if self.faq_match:
+        log.detail("FAQ fast path: %s (score %.2f)", self.faq_match[0].heading, self.faq_match[1])
+        return
+    
+    # Serve repeated questions straight from the response cache; the same key
+    # lets identical concurrent requests share an upstream stream
+    self.cache_key = conversation_key(self.recent_messages, model_name, kb_version) if response_cache or coalescer else None
+    self.cached_response = response_cache.get(self.cache_key) if response_cache else None
+    if self.cached_response:
+      log.detail("Response cache hit")
+      return
+    
+    # Format conversation for Gemini
+    self.formatted_messages = format_conversation_for_gemini(self.recent_messages)
+    
+    # Reference the cached prompt prefix when one is available. It already
+    # holds the whole knowledge base, so retrieval only runs for requests
+    # that send their prompt inline.
+    self.cache_name = context_cache.get(model_name) if context_cache else None
+    log.detail("Context cache: %s", self.cache_name or 'not used, sending prompt inline')
+    if not self.cache_name:
+      self.retrieve()
+
+    # Log AI generation start
+    self.ai_start_time = time.time()
+    log.detail("Starting AI generation with model: %s", model_name)
+    log.detail("Generation config - Temperature: 0.7, Max tokens: 2048")
+
+  def admitted(self, queue_seconds):
+    """Note that the request got an admission slot after queue_seconds"""
+    self.queue_seconds = queue_seconds
+    self.admitted_at = time.time()
+    # The upstream call starts now: keep the queue wait out of the AI timings
+    self.ai_start_time = self.admitted_at
+    ADMISSION_WAIT.observe(queue_seconds)
+    if queue_seconds:
+      self.log.detail("Admitted after %.2fs in the queue", queue_seconds)
+
+  def release_slot(self):
+    """Give the admission slot back; safe to call more than once"""
+    if self.admitted_at is None:
+      return
+    admission.release(time.time() - self.admitted_at)
+    self.admitted_at = None
+
+  def use_model(self, model):
+    """Account the generation to the model that answered"""
+    if model != self.model:
+      if model not in cascade_models:
+        self.log.warning("Answering with fallback model %s", model)
+      self.model = model
+    if model != model_name:
+      # The cached prefix belongs to the primary model
+      self.cache_name = None
+
+  def escalate(self, model, reason, text, usage_metadata):
+    """Account for a tier answer the cascade discarded before escalating"""
+    usage = usage_from_metadata(usage_metadata) or token_counter.usage(
+      [self.system_prompt] + [msg["content"] for msg in self.recent_messages], text,
+    )
+    self.escalations.append(Escalation(model, reason, usage, calculate_cost(model, usage)))
+    self.log.info("Escalating past %s (%s)", model, reason)
+
+  def cached_request(self):
+    """Arguments for generate_content_stream referencing the cached prefix"""
+    return {
+      'model': model_name,
+      'contents': self.formatted_messages,
+      'config': prompts.cached_config(self.cache_name),
+    }
+
+  def retrieve(self):
+    """Build the inline system prompt from the sections relevant to the conversation"""
+    if self.relevant_sections is not None:
+      return
+    retrieval_start_time = time.time()
+    self.relevant_sections = retrieve_sections(self.recent_messages)
+    self.system_prompt, self.system_content = prompts.system_prompt(self.relevant_sections)
+    self.retrieval_ms = (time.time() - retrieval_start_time) * 1000
+    self.log.detail(
+      "Retrieved %d/%d knowledge base sections in %.2fms", len(self.relevant_sections), len(kb_sections), self.retrieval_ms,
+    )
+
+  def inline_request(self, model=model_name):
+    """Arguments for generate_content_stream with the system prompt inline"""
+    self.retrieve()
+    return {
+      'model': model,
+      'contents': [self.system_content] + self.formatted_messages,
+      'config': prompts.config,
+    }
+
+  def drop_context_cache(self, error):
+    """Stop using a cached prefix the upstream reports as missing or expired"""
+    self.log.warning("Cached content %s unavailable, retrying inline: %s", self.cache_name, error)
+    context_cache.invalidate(model_name, self.cache_name)
+    self.cache_name = None
+
+  def mark_connected(self):
+    """Note when the upstream stream opened, before its first chunk.
+
+    Only the async SDK returns the stream once the response headers are in;
+    the sync one sends the request on the first read, so Flask requests
+    report no connect time rather than a copy of TTFT.
+    """
+    if self.connect_time is None:
+      self.connect_time = time.time()
+
+  def record_chunk(self, chunk):
+    """Account for a streamed chunk; returns the SSE text to write (empty while it is held back), or None if it has no text"""
+    now = time.time()
+    self.usage = chunk.usage_metadata or self.usage
+    if not chunk.text:
+      return None
+    if self.first_chunk_time is None:
+      self.first_chunk_time = now
+    else:
+      gap = now - self.last_chunk_time
+      self.max_chunk_gap = max(self.max_chunk_gap, gap)
+      self.total_chunk_gap += gap
+    self.last_chunk_time = now
+    self.full_response += chunk.text
+    self.chunks.append(chunk.text)
+    self.chunk_count += 1
+    return self.stream.content(chunk.text)
+
+  def record_flush(self, seconds):
+    """Add time the server spent handing a frame to the client"""
+    self.flush_seconds += seconds
+
+  def stream_timings(self):
+    """Connect, first-chunk, inter-chunk gap and flush timings, in seconds"""
+    gaps = self.chunk_count - 1
+    return {
+      'connect': self.connect_time - self.ai_start_time if self.connect_time and self.ai_start_time else None,
+      'ttft': self.first_chunk_time - self.start_time if self.first_chunk_time else None,
+      'max_gap': self.max_chunk_gap,
+      'mean_gap': self.total_chunk_gap / gaps if gaps > 0 else 0.0,
+      'flush': self.flush_seconds,
+    }
+
+  def finish(self):
+    """Compute, log and cache the metrics for a completed generation"""
+    log = self.log
+    full_response = self.full_response
+    chunk_count = self.chunk_count
+    usage = self.usage
+    cache_name = self.cache_name
+    
+    # Calculate metrics
+    end_time = time.time()
+    ai_end_time = time.time()
+    total_latency = end_time - self.start_time
+    ai_latency = ai_end_time - self.ai_start_time
+    
+    # Token usage as reported by the stream, or counted locally if it is
+    # missing. A coalesced request made no upstream call of its own: the
+    # request that led the shared stream accounts for it.
+    usage = TokenUsage(source='coalesced') if self.coalesced else usage_from_metadata(self.usage)
+    if usage is None:
+      prompt_text = prompts.full_prompt if cache_name else self.system_prompt
+      usage = token_counter.usage(
+        [prompt_text] + [msg["content"] for msg in self.recent_messages],
+        full_response,
+        cached_text=prompts.full_prompt if cache_name else None,
+      )
+    
+    # Cached tokens are billed at the cached rate, thinking tokens as output.
+    # Answers the cascade discarded on cheaper tiers were paid for too.
+    served_cost = calculate_cost(self.model, usage)
+    escalation_cost = sum(escalation.cost for escalation in self.escalations)
+    cost = served_cost + escalation_cost
+    output_tokens_per_second = usage.output_tokens / ai_latency if ai_latency > 0 else 0.0
+    timings = self.stream_timings()
+    
+    # Log performance metrics: one summary line, step-by-step detail in debug verbosity
+    log.info(
+      "Completed in %.2fs (AI %.2fs, TTFT %s) - model %s, %d chunks, tokens in %d (%d cached) / out %d (+%d thinking) [%s], cost $%.6f",
+      total_latency, ai_latency, _format_seconds(timings['ttft']), self.model, chunk_count,
+      usage.prompt_tokens, usage.cached_tokens, usage.candidate_tokens, usage.thinking_tokens, usage.source, cost,
+    )
+    if log.verbose:
+      log.detail(
+        "Stream timing - connect %s, max gap %.3fs, mean gap %.3fs, flush %.2fms",
+        _format_seconds(timings['connect']), timings['max_gap'], timings['mean_gap'], timings['flush'] * 1000,
+      )
+      log.detail("Response length: %d characters", len(full_response))
+      log.detail("Response preview: %s...", full_response[:200])
+      log.detail("Output tokens per second: %.2f", output_tokens_per_second)
+    
+    # Send metrics
+    metrics = {
+      'type': 'metrics',
+      'model': self.model,
+      'tier': cascade_models.index(self.model) if self.model in cascade_models else None,
+      'escalations': [{'model': e.model, 'reason': e.reason} for e in self.escalations],
+      'escalation_cost': round(escalation_cost, 6),
+      'input_tokens': usage.prompt_tokens,
+      'cached_input_tokens': usage.cached_tokens,
+      'uncached_input_tokens': usage.uncached_prompt_tokens,
+      'output_tokens': usage.candidate_tokens,
+      'thinking_tokens': usage.thinking_tokens,
+      'total_tokens': usage.total_tokens,
+      'token_source': usage.source,
+      'cost': round(cost, 6),
+      'latency': round(total_latency, 2),
+      'ai_latency': round(ai_latency, 2),
+      'ttft': _round_or_none(timings['ttft'], 3),
+      'connect_latency': _round_or_none(timings['connect'], 3),
+      'max_chunk_gap': round(timings['max_gap'], 3),
+      'mean_chunk_gap': round(timings['mean_gap'], 3),
+      'flush_ms': round(timings['flush'] * 1000, 2),
+      'queue_ms': round(self.queue_seconds * 1000, 1),
+      'chunk_count': chunk_count,
+      'sse_frames': self.stream.frames,
+      'cached': False,
+      'coalesced': self.coalesced,
+      'context_cache': bool(cache_name),
+      'context_tokens': self.context_tokens,
+      'context_budget': context_window.budget,
+      'context_messages': len(self.window.messages),
+      'context_dropped': self.window.dropped,
+      'context_truncated': self.window.truncated,
+      'summary_covers': self.summary.covered if self.summary else 0,
+      'conversation_id': self.conversation_id,
+      'kb_sections_used': len(kb_sections) if cache_name else len(self.relevant_sections),
+      'kb_sections_total': len(kb_sections),
+      'retrieval_ms': round(self.retrieval_ms, 2),
+      'tokens_per_second': round(output_tokens_per_second, 2)
+    }
+    
+    if response_cache and full_response and not self.coalesced:
+      response_cache.put(self.cache_key, self.chunks, metrics)
+    
+    # Fold the turns that fell out of the window into the rolling summary
+    if summarizer and self.dropped_messages:
+      summarizer.schedule(self.dropped_messages)
+    
+    self.remember(full_response)
+    
+    self.metrics = metrics
+    self.served_cost = served_cost
+    self.ai_latency = ai_latency
+    self.usage_counts = usage
+    self.record('ok')
+    return metrics
+
+  def remember(self, answer):
+    """Store the answered turn in the conversation store"""
+    if conversation_store is None or not self.conversation_id or not answer:
+      return
+    answer_message = {'role': 'assistant', 'content': answer}
+    if self.incremental:
+      conversation_store.append(self.conversation_id, [self.messages[-1], answer_message])
+    else:
+      conversation_store.put(self.conversation_id, self.messages + [answer_message])
+
+  def record(self, status, error=None):
+    """Record the finished request in the metrics registry and the ledger"""
+    total_latency = time.time() - self.start_time
+    cached = bool(self.cached_response)
+    if status == 'ok' and (cached or self.faq_match):
+      REQUESTS_TOTAL.inc(outcome='cache_hit' if cached else 'faq_hit')
+    else:
+      REQUESTS_TOTAL.inc(outcome=status)
+    REQUEST_LATENCY.observe(total_latency, cached='faq' if self.faq_match else str(cached).lower())
+    timings = self.stream_timings()
+    if timings['ttft'] is not None:
+      FIRST_CHUNK_LATENCY.observe(timings['ttft'], model=self.model)
+    if timings['connect'] is not None:
+      UPSTREAM_CONNECT_LATENCY.observe(timings['connect'], model=self.model)
+    if self.metrics:
+      usage = self.usage_counts
+      AI_LATENCY.observe(self.ai_latency, model=self.model)
+      MAX_CHUNK_GAP.observe(timings['max_gap'], model=self.model)
+      FLUSH_TIME.observe(timings['flush'], model=self.model)
+      OUTPUT_TOKENS.observe(usage.output_tokens, model=self.model)
+      CONTEXT_TOKENS.observe(self.context_tokens)
+      TOKENS_TOTAL.inc(usage.uncached_prompt_tokens, model=self.model, kind='input')
+      TOKENS_TOTAL.inc(usage.cached_tokens, model=self.model, kind='cached_input')
+      TOKENS_TOTAL.inc(usage.candidate_tokens, model=self.model, kind='output')
+      TOKENS_TOTAL.inc(usage.thinking_tokens, model=self.model, kind='thinking')
+      COST_TOTAL.inc(self.served_cost, model=self.model)
+    for escalation in self.escalations:
+      ESCALATIONS_TOTAL.inc(model=escalation.model, reason=escalation.reason)
+      TOKENS_TOTAL.inc(escalation.usage.uncached_prompt_tokens, model=escalation.model, kind='input')
+      TOKENS_TOTAL.inc(escalation.usage.cached_tokens, model=escalation.model, kind='cached_input')
+      TOKENS_TOTAL.inc(escalation.usage.candidate_tokens, model=escalation.model, kind='output')
+      TOKENS_TOTAL.inc(escalation.usage.thinking_tokens, model=escalation.model, kind='thinking')
+      COST_TOTAL.inc(escalation.cost, model=escalation.model)
+    
+    if request_ledger is None:
+      return
+    entry = {
+      'v': LEDGER_SCHEMA_VERSION,
+      'ts': round(self.start_time, 3),
+      'id': self.request_id,
+      'model': self.model,
+      'status': status,
+      'cache': 'off' if response_cache is None else ('hit' if self.cached_response else 'miss'),
+      'msgs': len(self.messages),
+      'chunks': self.chunk_count,
+      'total_ms': round(total_latency * 1000, 1),
+    }
+    if self.conversation_id:
+      entry['conv'] = self.conversation_id
+    if timings['ttft'] is not None:
+      entry['ttft_ms'] = round(timings['ttft'] * 1000, 1)
+    if timings['connect'] is not None:
+      entry['connect_ms'] = round(timings['connect'] * 1000, 1)
+    if self.faq_match:
+      entry['faq'] = round(self.faq_match[1], 3)
+    if self.escalations:
+      entry['tier'] = cascade_models.index(self.model) if self.model in cascade_models else None
+      entry['esc'] = [escalation.reason for escalation in self.escalations]
+    if self.queue_seconds:
+      entry['queue_ms'] = round(self.queue_seconds * 1000, 1)
+    if self.metrics:
+      usage = self.usage_counts
+      entry.update({
+        'ai_ms': round(self.ai_latency * 1000, 1),
+        'max_gap_ms': round(timings['max_gap'] * 1000, 1),
+        'mean_gap_ms': round(timings['mean_gap'] * 1000, 1),
+        'flush_ms': round(timings['flush'] * 1000, 2),
+        'retrieval_ms': round(self.retrieval_ms, 2),
+        'in_tok': usage.prompt_tokens,
+        'cached_tok': usage.cached_tokens,
+        'out_tok': usage.candidate_tokens,
+        'think_tok': usage.thinking_tokens,
+        'tok_src': usage.source,
+        'cost': self.metrics['cost'],
+        'coalesced': self.coalesced,
+        'ctx_cache': self.metrics['context_cache'],
+        'kb': self.metrics['kb_sections_used'],
+        'ctx_tok': self.context_tokens,
+        'ctx_dropped': self.window.dropped,
+        'summary': self.metrics['summary_covers'],
+      })
+    if error is not None:
+      entry['error'] = type(error).__name__
+    request_ledger.append(entry)
+
+  def error_event(self, error):
+    self.log.error("Error during AI generation: %s", error, exc_info=True)
+    self.record('error', error)
+    return self.stream.event({'type': 'error', 'error': str(error)})
+
+def _round_or_none(value, digits):
+  return round(value, digits) if value is not None else None
+
+def _format_seconds(value):
+  return f"{value:.2f}s" if value is not None else 'n/a'
+
+def stream_chunks(chat_request, model=model_name):
+  """Stream from the cached prefix, falling back to the inline prompt on a cache miss"""
+  if chat_request.cache_name and model == model_name:
+    received = False
+    try:
+      for chunk in client.models.generate_content_stream(**chat_request.cached_request()):
+        received = True
+        yield chunk
+      return
+    except Exception as e:
+      if received or not is_cache_error(e):
+        raise
+      chat_request.drop_context_cache(e)
+  
+  yield from client.models.generate_content_stream(**chat_request.inline_request(model))
+
+def resilient_chunks(chat_request, model=model_name):
+  """stream_chunks behind the first-chunk deadline, retries, hedging and model fallback"""
+  return resilience[model].stream(
+    lambda model: stream_chunks(chat_request, model),
+    on_start=chat_request.use_model,
+    log=chat_request.log,
+  )
+
+def cascade_chunks(chat_request):
+  """Chunks from the cheapest cascade tier whose answer passes the judge"""
+  if cascade is None:
+    return resilient_chunks(chat_request)
+  return cascade.stream(
+    lambda model: resilient_chunks(chat_request, model),
+    on_escalate=chat_request.escalate,
+  )
+
+def produce_shared(shared, chunks, release_slot):
+  """Publish an upstream stream to its subscribers until it ends or all of them leave"""
+  error = None
+  try:
+    for chunk in chunks:
+      if shared.cancelled and coalescer.abandon(shared):
+        break
+      shared.publish(chunk)
+  except Exception as e:
+    error = e
+  finally:
+    chunks.close()
+    release_slot()
+    # Release before closing so requests retrying after a failure start afresh
+    coalescer.release(shared)
+    shared.close(error)
+
+def admit(chat_request):
+  """Wait for a generation slot; raises Rejected when saturated"""
+  if admission:
+    chat_request.admitted(admission.acquire())
+
+def join_upstream(chat_request):
+  """The shared stream answering the request, or None when it is not coalesced.
+
+  Only a request that calls upstream itself waits for an admission slot:
+  one that is not coalesced, or the leader of a new shared stream, whose
+  producer thread then holds the slot until the upstream call ends.
+  Followers of an in-flight stream take no slot. A leader turned away
+  closes its stream with the Rejected error, so followers that joined
+  meanwhile try again.
+  """
+  if coalescer is None or chat_request.cache_key is None:
+    admit(chat_request)
+    return None
+  shared, leader = coalescer.join(chat_request.cache_key)
+  chat_request.coalesced = not leader
+  if not leader:
+    COALESCED_TOTAL.inc()
+    chat_request.log.detail("Joined an identical in-flight request (%d chunks so far)", len(shared.chunks))
+    return shared
+  try:
+    admit(chat_request)
+  except Rejected as e:
+    coalescer.release(shared)
+    shared.unsubscribe()
+    shared.close(e)
+    raise
+  threading.Thread(target=produce_shared, args=(shared, cascade_chunks(chat_request), chat_request.release_slot), daemon=True).start()
+  return shared
+
+def coalesced_chunks(chat_request, shared, tick_seconds=None):
+  """stream_chunks, shared with concurrent requests for the same conversation window.
+
+  `shared` comes from join_upstream; without it the request calls upstream
+  itself and gives its slot back when the stream ends or is closed. The
+  first request leads: its upstream
+  stream runs in a producer thread that outlives the leader's client if
+  followers are still reading. Followers replay the chunks produced so far
+  and then follow live. A follower whose shared stream fails before its
+  first chunk joins again once, so one of the waiting requests leads a
+  fresh upstream call.
+
+  Shared streams also yield None every `tick_seconds` without a chunk (idle
+  ticks for heartbeats and coalesced text). A request reading upstream
+  directly blocks on it and gets no ticks; that would take a reader thread
+  per stream.
+  """
+  if shared is None:
+    try:
+      yield from cascade_chunks(chat_request)
+    finally:
+      # The upstream stream is closed by now
+      chat_request.release_slot()
+    return
+  for attempt in range(2):
+    if attempt:
+      shared = join_upstream(chat_request)
+    received = False
+    try:
+      for chunk in shared.iterate(tick_seconds):
+        received = received or chunk is not None
+        yield chunk
+      return
+    except Exception as e:
+      if not chat_request.coalesced or received or attempt:
+        raise
+      chat_request.log.warning("Shared upstream stream failed, retrying: %s", e)
+    finally:
+      shared.unsubscribe()
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -72,328 +968,171 @@ def chat():
   
   try:
     data = request.get_json()
-    messages = data.get('messages', [])
     
     # Log incoming request details
-    logger.info(f"[{request_id}] Chat request received - Messages count: {len(messages)}")
-    logger.info(f"[{request_id}] Request IP: {request.remote_addr}")
-    logger.info(f"[{request_id}] User-Agent: {request.headers.get('User-Agent', 'Unknown')}")
+    log = RequestLog(logger, request_id, request_verbosity(request.headers.get('X-Log-Verbosity'), LOG_VERBOSITY, request.headers.get('X-Log-Debug-Key'), LOG_DEBUG_KEY))
+    if rate_limiter:
+      try:
+        rate_limiter.check(client_key(request.headers.get('X-API-Key'), request.remote_addr, rate_limiter.api_keys))
+      except Rejected as e:
+        log.warning("Rate limited %s", request.remote_addr)
+        REQUESTS_TOTAL.inc(outcome=e.reason)
+        body, rejection_headers = rejection_body(e)
+        return jsonify(body), e.status, rejection_headers
+    try:
+      conversation_id, messages, incremental = resolve_conversation(data)
+    except ConversationNotFound:
+      log.warning("Unknown or expired conversation_id %s", data.get('conversation_id'))
+      REQUESTS_TOTAL.inc(outcome='conversation_not_found')
+      return jsonify({'error': 'Unknown or expired conversation_id; resend the full history', 'code': 'conversation_not_found'}), 404
+    log.detail("Chat request received - Messages count: %d (conversation %s)", len(messages), conversation_id)
+    log.detail("Request IP: %s", request.remote_addr)
+    log.detail("User-Agent: %s", request.headers.get('User-Agent', 'Unknown'))
     
     if not messages:
-      logger.warning(f"[{request_id}] No messages provided in request")
+      log.warning("No messages provided in request")
+      REQUESTS_TOTAL.inc(outcome='bad_request')
       return jsonify({'error': 'No messages provided'}), 400
     
-    # Log conversation summary
-    conversation_summary = []
-    for i, msg in enumerate(messages):
-      role = msg.get('role', 'unknown')
-      content_preview = msg.get('content', '')[:100] + '...' if len(msg.get('content', '')) > 100 else msg.get('content', '')
-      conversation_summary.append(f"{role}: {content_preview}")
+    chat_request = ChatRequest(request_id, messages, start_time, log, conversation_id, incremental)
+    chat_request.prepare()
+    headers = dict(SSE_HEADERS, **({'X-Conversation-Id': conversation_id} if conversation_id else {}))
     
-    logger.info(f"[{request_id}] Conversation summary: {' | '.join(conversation_summary)}")
+    if chat_request.cached_response:
+      return Response(replay_cached_response(chat_request), content_type=SSE_CONTENT_TYPE, headers=headers)
+    if chat_request.faq_match:
+      return Response(stream_faq_answer(chat_request), content_type=SSE_CONTENT_TYPE, headers=headers)
     
-    # Take only the last 5 messages
-    recent_messages = messages[-5:] if len(messages) > 5 else messages
-    logger.info(f"[{request_id}] Using {len(recent_messages)} recent messages (truncated from {len(messages)} total)")
-    
-    # Format conversation for Gemini
-    formatted_messages = format_conversation_for_gemini(recent_messages)
-    
-    # Create system prompt for HR specialist
-    system_prompt = """You are Optum's Retirement Specialist, an AI assistant designed to help employees with retirement questions and concerns. You should:
-1. Provide accurate, concise, and helpful information about retirement policies, benefits, and procedures.  **Focus on the Philippine market.**
-2. Be professional, empathetic, and supportive.  Do not expand the explanation beyond 100 words.  Wait for the user to ask for more information.
-3. Guide employees to the right resources when needed
-4. Use the information in the KNOWLEDGE_BASE to answer questions.
-
-<KNOWLEDGE_BASE>
-
-## Optum Retirement FAQ
-
-### How often can I use the Individual Retirement Account online service?
-
-You can use and access your Individual Retirement Account anytime at your convenience. Contributions will be posted twice a month (15th and 30th) within twenty business days from deduction, and Gain/(Loss) shall be posted once a month.
-
-### Will I receive paper statements?
-
-Employees will no longer receive paper statements. All information can already be viewed anytime through the portal.
-
-### How can I confirm that a contribution was made?
-
-View the Account Activity tab to see the Contribution transactions pertaining to your account.
-
-### How can I confirm that an Accumulated Gain/Loss from the Fund was posted to my account?
-
-View the Account Activity tab to see the Gain/Loss transactions pertaining to your account.
-
-### What if there is a discrepancy in the contributions or I have other questions?
-
-If there are any questions on the posted amounts, you can coordinate directly with the Employee Center.
-
-### Can I change my information in the Retirement Fund Account online?
-
-Employees can only input their contact numbers and addresses. To change any other information, kindly raise a ticket through Employee Center.
-
-### For former employees, when will I receive my retirement benefit?
-
-TAT is 60 business days from last working day (LWD). If beyond 60 business days, former employees may follow up their retirement benefit status via Employee Center.
-
-### Retirement Withdrawal – when will I receive it / follow-up? How much will I get?
-
-You will get 100% of your Employee Voluntary Contributions including earnings and losses, while the corresponding Employer Matching contributions will be forfeited as per the retirement policy. TAT is 60 business days from the final withdrawal date.
-
-### Opted for Employee Voluntary Contributions but can’t see it on my payslip.
-
-If you enroll between 1st – 31st of the month, the employee voluntary contributions will be deducted on the 15th payroll of the following month and the same will be reflected onyour payslip. If you nominated 5%, 7.5% or 10% of your employee voluntary contributions but didn’t see on your payslip, please reach out to Employee Center.
-
-### How to enroll / renew?
-
-Log in to the retirement portal (*ogs.zalamea.ph*), go to the “Enrollment” tab so you can nominate 5%, 7.5%, or 10% of your monthly basic salary. The same process is being followed for the renewal which happens every March of the year. We also have the detailed User Guide uploaded on the portal under “Resources” tab.
-
-### Understanding vested balance, account activity, why is there a negative amount on Zalamea website?
-
-Contributions are being invested. An investment can have gains and potential losses.
-
-### Less than 5 years tenure would like to know if employee would get 100% of his/her retirement benefit if EE choose to resign.
-
-An employee who resigns with less than 5 years of tenure will only be eligible to his/her employee voluntary contributions, if any. If the employee has past service contributions in his/her account, this will also be vested to the employee from 5 years of service and up in line with the vesting schedule.
-
-### When will I be eligible for tax exemption?
-
-Employees will be eligible for tax exemption once he reached the age of 50 and 10 years of service under the same company.
-
-### When will I be eligible for retirement?
-
-Employees who reached the age of 60 are eligible for Normal Retirement while for those employees who will go beyond this age, but not beyond 65 years old, will be eligible for Late Retirement, given that the employee has served the company for at least five years.
-
-Additionally, employees with at least five years of service are eligible for Early Retirement.
-
-### Can I separate from the company before my Early/Normal/Late Retirement Date?
-
-Employees can separate from the company before they reach their Early / Normal / Late Retirement Date. However, employees who separate before said days are only entitled to their Employee Voluntary Balances, if any.
-
-### Are my retirement benefit subject to the applicable Regulatory Benefit?
-
-Yes. In cases where the employee’s Total Employer benefit is lower than the applicable Regulatory Benefit, the company shall cover the difference.
-
-### I was hired at age 65 or older, will I be eligible for any of the company’s retirement benefit?
-
-No. Employees hired at age 65 or older are no longer eligible for the company’s retirement plan hence retirement benefits do not apply.
-
-Note that 65 years old is the mandatory retirement age.
-
-### I already reached the age of 65 but has not yet reached the 5 years of service, what benefits will I be eligible to?
-
-Employees are still entitled to retirement pay based on company guidelines, and the computation will follow the formula prescribed under the Labor Code.
-
-### Can I cancel my voluntary withdrawal request?
-
-Yes. Employees are given ten (10) days to retract their withdrawal request.
-
-### When can I request another voluntary withdrawal after my previous one?
-
-Employees can request for another withdrawal after the completion of their one-year resting period### Optum Retirement Plan Member Loan Program*### How does an employee apply for the Member Loan?
-
-An employee who is currently participating in the Voluntary Contributions of the Retirement Fund will have to log in to the retirement portal and navigate to the Loan tab to apply for the Member Loan.
-
-### Who are eligible to apply for the Member Loan?
-
-Employees who are regular and are currently participating in the Voluntary Contributions of the Retirement Fund are eligible to apply for the Member Loan.
-
-### How much can an employee borrow from the fund?
-
-Employees can borrow up to 100% of their Voluntary Contributions \+ Earnings/Losses, provided the loan's monthly amortization does not exceed 30% of their monthly basic salary plus interest. Additionally, the loan amount must be in increments of 1,000 or divisible by 1,000. For example, if an employee's total Voluntary Contributions is PHP24,012.87, they can borrow PHP24,000. If the total Voluntary Contributions is PHP58,000.12, they can borrow PHP58,000.
-
-### When will the borrowed amount be received and how?
-
-The borrowed amount will be credited to the employee-borrower's Payroll account on the 15th business day after loan approval. Note that this does not follow the regular payroll crediting schedule of the 15th and 30th. BPI will credit the amount according to the bank's standard turnaround time.
-
-  
-
-For non-BPI accounts, an additional PHP500.00 fee will be charged by BPI on the loan proceeds.
-
-### How will employee/borrower know if the loan is approved?
-
-An email notification will be sent by the loan administrator to the employee-borrower’s Optum email regarding the loan status and approval.
-
-### How can employee-borrower check the status of his / her loan application?
-
-Loan status will be regularly shared via email by the loan administrator. Employee-borrower may check the status of the loan application by logging in to the retirement portal and navigate to the Loan tab.
-
-### Can an employee request to expedite the loan process?
-
-All loan applications are processed efficiently in batches, adhering to the standard turnaround time for signature routing to the Retirement Committee and the bank’s established process for crediting. This ensures a smooth and consistent experience for everyone involved.
-
-### Will the Member Loan balance reflect on the employee’s payslip?*### the Member Loan balance will reflect on the employee-borrower’s payslip.*### Is the Member Loan interest rate fixed?
-
-Yes, the loan interest rate is fixed and set below the market rate. It remains fixed for the entire tenure of the loan. Additionally, interest rates will be reviewed annually.
-
-### What are the advantages of taking a loan with interest instead of withdrawing my voluntary contributions from the fund?
-
-Applying for a loan from the retirement fund will allow you to choose the amount you wish to borrow (up to 100% of your voluntary contributions, in increments of 1,000) and your Company Matching contributions remain intact.
-
-### Are there any documentary requirements for applying for the member loan?
-
-Yes, there is one required document: the Promissory Note (PN). Employees need to print, read, agree to, sign, and upload this document when applying for the member loan. Important: Ensure the PN is clearly signed to avoid disapproval of your loan application. You can download the PN from the Loans tab of the retirement portal.
-
-### What file types will the tool accept for the soft copy of the Promissory Note?
-
-The tool accepts the following file types for the uploading of Promissory Note: 'jpeg', 'jpg', 'png', 'doc', 'docx', 'xls', 'xlsx', 'csv', 'pdf', 'ppt', 'pptx' and up to 25MB file size only.
-
-### How many months can employee-borrower pay for the loaned amount?
-
-Employee-borrower can choose from the four term options to pay for the loaned amount: 6, 12, 18 and 24 months. In case where the term of the loan will exceed the employee's normal retirement age, the maximum loan term shall be adjusted accordingly. As a result, this amount will be deducted from the salary on a semi-monthly basis.
-
-### How can employee-borrower pay for the borrowed amount?
-
-Repayment will be set against the employee-borrowers’ salary and will be made through equal semi-monthly salary deductions.
-
-### When will salary deductions for the payment of the loan start?
-
-The salary deduction shall commence on the 2nd payroll date from the date of receipt by the employee-borrower of the loan and will continue with each subsequent payroll.
-
-### Can employee-borrower pay off the loan balance in full? If yes, how?
-
-Yes, after employee-borrower has paid at least 3 months or 6 semi-monthly installments. Full loan balance pay-off can only be requested via salary deduction by submitting an online case via Employee Center.
-
-### Can borrower-employee stop voluntary contributions while there is an existing member loan?
-
-While employee-borrower has an existing member loan, employee-borrower will not be able to opt out of the Voluntary Contributions.
-
-### Can borrower-employee change the percentage of voluntary contributions while there is an existing member loan?
-
-Yes, the employee-borrower who has an existing member loan can change the percentage of voluntary contributions to a lower or higher percentage but not zero (0).
-
-### Can borrower-employee withdraw voluntary contributions from the fund while there is an existing member loan?
-
-While an employee-borrower has an existing loan, voluntary contributions will remain in the fund, continuing to earn returns and receive company matching until the loan term ends. This means voluntary contributions cannot be withdrawn while the loan is active.
-
-### Can the employee-borrower renew his/her loan? If yes, when?
-
-Yes, employee-borrower may renew his/her loan after paying at least 50% of the principal loan balance and this can be applied again through ### retirement tool. The current loan balance shall be deducted from the renewed loan proceeds.*### After employee-borrower fully pays the loan over the selected term, when can employee- borrower apply again for the member loan?
-
-Employees who successfully complete their loan payments over the selected term can re- apply for a new loan immediately after the final payment is posted on the retirement portal.
-
-### When can employees start applying for the member loan?
-
-The Retirement Plan Member Loan Program will be available to all employees who are currently participating in the Voluntary Contributions starting April 1, 2025.
-
-### If a loan application is disapproved can an employee reapply?
-
-If a loan application is disapproved the employee can promptly submit a new application through the retirement portal. Please ensure that the uploaded Promissory Note is accurate, signed, and clearly legible for a smoother process.
-
-### What are the reasons for a loan to be disapproved?
-
-The only reason for loan disapproval is an issue found with the uploaded Promissory Note.
-
-### What if an employee changes their mind about borrowing money from the fund? Can they still cancel the loan application?
-
-If the loan application status in the retirement portal is "Saved," the employee can cancel the loan by clicking the trash icon. However, if the status is "For Approval," the employee must submit a cancellation request to the Employee Center.
-
-### What happens if the employee/borrower resigns immediately or absconds 1 month after receiving the loan amount?
-
-The loan balance will be deducted from the employee’s retirement benefit, offsetting the Voluntary Contributions. Any remaining amount will be recovered from the final pay. If insufficient, the final pay will remain negative.
-
-</KNOWLEDGE_BASE>
-"""
-
-    # Log AI generation start
-    ai_start_time = time.time()
-    logger.info(f"[{request_id}] Starting AI generation with model: {model_name}")
+    # Wait for a generation slot, or turn the request away fast when saturated
+    try:
+      shared = join_upstream(chat_request)
+    except Rejected as e:
+      log.warning("Rejected (%s), retry after %ds", e.reason, e.retry_after)
+      chat_request.record(e.reason)
+      body, rejection_headers = rejection_body(e)
+      return jsonify(body), e.status, rejection_headers
     
     # Generate response with streaming
+    stream = chat_request.stream
+    chunks = coalesced_chunks(chat_request, shared, stream.tick_seconds)
+    
     def generate():
+      chat_request.streaming = True
+      STREAMS_IN_FLIGHT.inc()
       try:
-        # Add system prompt to the conversation
-        system_content = types.Content(
-          role="user",
-          parts=[types.Part.from_text(text=system_prompt)]
-        )
-        full_conversation = [system_content] + formatted_messages
-        
-        # Create generation config
-        generate_content_config = types.GenerateContentConfig(
-          temperature=0.7,
-          top_p=0.8,
-          max_output_tokens=2048,
-          safety_settings=safety_settings,
-        )
-        
-        logger.info(f"[{request_id}] Generation config - Temperature: 0.7, Max tokens: 2048")
-        
-        # Generate streaming response
-        full_response = ""
-        input_tokens = 0
-        output_tokens = 0
-        chunk_count = 0
-        
-        logger.info(f"[{request_id}] Starting streaming response generation")
-        
-        for chunk in client.models.generate_content_stream(
-          model=model_name,
-          contents=full_conversation,
-          config=generate_content_config,
-        ):
-          if chunk.text:
-            full_response += chunk.text
-            chunk_count += 1
-            yield f"data: {json.dumps({'type': 'content', 'content': chunk.text})}\n\n"
-        
-        # Calculate metrics
-        end_time = time.time()
-        ai_end_time = time.time()
-        total_latency = end_time - start_time
-        ai_latency = ai_end_time - ai_start_time
-        
-        # Estimate token usage (rough approximation)
-        input_tokens = len(system_prompt.split()) + sum(len(msg["content"].split()) for msg in recent_messages)
-        output_tokens = len(full_response.split())
-        
-        cost = calculate_cost(input_tokens, output_tokens)
+        log.detail("Starting streaming response generation")
         
-        # Log detailed performance metrics
-        logger.info(f"[{request_id}] AI generation completed - Chunks received: {chunk_count}")
-        logger.info(f"[{request_id}] Response length: {len(full_response)} characters")
-        logger.info(f"[{request_id}] Response preview: {full_response[:200]}...")
-        logger.info(f"[{request_id}] Performance metrics:")
-        logger.info(f"[{request_id}]   - Total latency: {total_latency:.2f}s")
-        logger.info(f"[{request_id}]   - AI generation latency: {ai_latency:.2f}s")
-        logger.info(f"[{request_id}]   - Input tokens (estimated): {input_tokens}")
-        logger.info(f"[{request_id}]   - Output tokens (estimated): {output_tokens}")
-        logger.info(f"[{request_id}]   - Total tokens: {input_tokens + output_tokens}")
-        logger.info(f"[{request_id}]   - Estimated cost: ${cost:.6f}")
-        logger.info(f"[{request_id}]   - Tokens per second: {(input_tokens + output_tokens) / ai_latency:.2f}")
+        # None items are idle ticks: due coalesced text or a heartbeat
+        for chunk in chunks:
+          frame = stream.tick() if chunk is None else chat_request.record_chunk(chunk)
+          if frame:
+            # The generator resumes once the server has written the frame
+            flush_start = time.time()
+            yield frame
+            chat_request.record_flush(time.time() - flush_start)
         
-        # Send metrics
-        metrics = {
-          'type': 'metrics',
-          'input_tokens': input_tokens,
-          'output_tokens': output_tokens,
-          'total_tokens': input_tokens + output_tokens,
-          'cost': round(cost, 6),
-          'latency': round(total_latency, 2),
-          'ai_latency': round(ai_latency, 2),
-          'chunk_count': chunk_count,
-          'tokens_per_second': round((input_tokens + output_tokens) / ai_latency, 2)
-        }
+        yield stream.event(chat_request.finish())
+        yield stream.done()
         
-        yield f"data: {json.dumps(metrics)}\n\n"
-        yield "data: [DONE]\n\n"
-        
-        logger.info(f"[{request_id}] Request completed successfully")
+        log.detail("Request completed successfully")
         
+      except GeneratorExit:
+        log.info("Client disconnected, stopping generation")
+        chat_request.record('disconnected')
+        raise
+      
       except Exception as e:
-        logger.error(f"[{request_id}] Error during AI generation: {str(e)}", exc_info=True)
-        error_data = {'type': 'error', 'error': str(e)}
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield chat_request.error_event(e)
+      
+      finally:
+        # The slot goes back once the upstream stream is closed (see coalesced_chunks)
+        chunks.close()
+        STREAMS_IN_FLIGHT.dec()
+    
+    def release_unstarted():
+      # The client went away before the response started streaming
+      if shared is None and not chat_request.streaming:
+        chat_request.release_slot()
     
-    return Response(generate(), mimetype='text/plain')
+    response = Response(generate(), content_type=SSE_CONTENT_TYPE, headers=headers)
+    response.call_on_close(release_unstarted)
+    return response
     
   except Exception as e:
-    logger.error(f"[{request_id}] Error in chat endpoint: {str(e)}", exc_info=True)
-    logger.error(f"[{request_id}] Request data: {data if 'data' in locals() else 'No data available'}")
+    REQUESTS_TOTAL.inc(outcome='server_error')
+    logger.error("[%s] Error in chat endpoint: %s", request_id, e, exc_info=True)
+    logger.error("[%s] Request data: %s", request_id, data if 'data' in locals() else 'No data available')
     return jsonify({'error': str(e)}), 500
 
+def batch_frames(chat_request):
+  """SSE frames answering a prepared batch item, as /chat would stream them"""
+  if chat_request.cached_response:
+    yield from replay_cached_response(chat_request)
+    return
+  if chat_request.faq_match:
+    yield from stream_faq_answer(chat_request)
+    return
+  try:
+    shared = join_upstream(chat_request)
+  except Rejected as e:
+    chat_request.record(e.reason)
+    raise
+  chunks = coalesced_chunks(chat_request, shared)
+  try:
+    for chunk in chunks:
+      frame = chat_request.record_chunk(chunk)
+      if frame:
+        yield frame
+    yield chat_request.stream.event(chat_request.finish())
+  except Exception as e:
+    yield chat_request.error_event(e)
+  finally:
+    chunks.close()
+
+def answer_batch_item(batch_id, item, verbosity):
+  """Run one batch item through the /chat pipeline; returns its result line"""
+  request_id = f"{batch_id}-{item.index}"
+  log = RequestLog(logger, request_id, verbosity)
+  result = {'type': 'result', 'index': item.index, 'id': item.id, 'status': 'ok'}
+  try:
+    chat_request = ChatRequest(request_id, item.messages, time.time(), log)
+    chat_request.prepare()
+    return read_frames(batch_frames(chat_request), result)
+  except Rejected as e:
+    log.warning("Batch item rejected (%s)", e.reason)
+    result.update(status=e.reason, error=str(e))
+  except Exception as e:
+    REQUESTS_TOTAL.inc(outcome='server_error')
+    log.error("Error answering batch item: %s", e, exc_info=True)
+    result.update(status='error', error=str(e))
+  return result
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+  batch_id = str(uuid.uuid4())[:8]
+  verbosity = request_verbosity(request.headers.get('X-Log-Verbosity'), LOG_VERBOSITY, request.headers.get('X-Log-Debug-Key'), LOG_DEBUG_KEY)
+  log = RequestLog(logger, batch_id, verbosity)
+  if rate_limiter:
+    try:
+      rate_limiter.check(client_key(request.headers.get('X-API-Key'), request.remote_addr, rate_limiter.api_keys))
+    except Rejected as e:
+      log.warning("Rate limited %s", request.remote_addr)
+      REQUESTS_TOTAL.inc(outcome=e.reason)
+      body, rejection_headers = rejection_body(e)
+      return jsonify(body), e.status, rejection_headers
+  try:
+    items, concurrency = parse_batch(request.get_json(silent=True), BATCH_MAX_ITEMS, BATCH_CONCURRENCY)
+  except ValueError as e:
+    REQUESTS_TOTAL.inc(outcome='bad_request')
+    return jsonify({'error': str(e)}), 400
+  log.info("Batch of %d items, concurrency %d", len(items), concurrency)
+  lines = run_batch(items, lambda item: answer_batch_item(batch_id, item, verbosity), concurrency)
+  return Response(lines, mimetype='application/x-ndjson', headers={'X-Batch-Id': batch_id})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+  return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health():
   logger.info("Health check requested")
@@ -401,6 +1140,11 @@ def health():
 
 if __name__ == '__main__':
   logger.info("Starting Optum HR Chat Application")
-  logger.info(f"Model: {model_name}")
-  logger.info(f"Pricing - Input: ${PRICING_PER_TOKEN['input']:.6f}/token, Output: ${PRICING_PER_TOKEN['output']:.6f}/token")
+  logger.info("Model: %s (%s upstream)", model_name, upstream.name)
+  logger.info("Knowledge base: %d sections indexed, top-k: %d", len(kb_sections), RETRIEVAL_TOP_K)
+  logger.info("Log verbosity: %s", LOG_VERBOSITY)
+  pricing = get_pricing(model_name)
+  logger.info("Pricing - Input: $%.9f/token, Cached input: $%.9f/token, Output: $%.9f/token", pricing.input, pricing.cached_input, pricing.output)
+  # HTTP/1.1 keeps client connections alive between turns (streams are sent chunked)
+  WSGIRequestHandler.protocol_version = "HTTP/1.1"
   app.run(debug=False, host='localhost', port=6000)
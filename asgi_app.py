@@ -0,0 +1,451 @@
+import asyncio
+import json
+import time
+import uuid
+
+import app as chat_backend
+from context_cache import is_cache_error
+from admission import Rejected, client_key
+from batch import arun_batch, parse_batch, read_frames
+from sse import awith_ticks
+from conversation_store import ConversationNotFound
+from logging_setup import RequestLog, request_verbosity
+
+logger = chat_backend.logger
+
+# Mirrors flask_cors defaults used by the Flask app
+CORS_HEADERS = [
+  (b'access-control-allow-origin', b'*'),
+  (b'access-control-expose-headers', b'X-Conversation-Id, Retry-After, X-Batch-Id'),
+]
+
+async def read_body(receive):
+  """Read the full request body"""
+  body = b''
+  while True:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      return None
+    body += message.get('body', b'')
+    if not message.get('more_body', False):
+      return body
+
+async def send_json(send, status, payload, extra_headers=None):
+  body = json.dumps(payload).encode('utf-8')
+  await send({
+    'type': 'http.response.start',
+    'status': status,
+    'headers': [
+      (b'content-type', b'application/json'),
+      (b'content-length', str(len(body)).encode()),
+    ] + CORS_HEADERS + [
+      (name.lower().encode(), value.encode()) for name, value in (extra_headers or {}).items()
+    ],
+  })
+  await send({'type': 'http.response.body', 'body': body})
+
+async def astream_chunks(chat_request, model=None):
+  """Async twin of app.stream_chunks using `client.aio`"""
+  client = chat_backend.client
+  model = model or chat_backend.model_name
+  if chat_request.cache_name and model == chat_backend.model_name:
+    received = False
+    try:
+      stream = await client.aio.models.generate_content_stream(**chat_request.cached_request())
+      chat_request.mark_connected()
+      async for chunk in stream:
+        received = True
+        yield chunk
+      return
+    except Exception as e:
+      if received or not is_cache_error(e):
+        raise
+      chat_request.drop_context_cache(e)
+
+  stream = await client.aio.models.generate_content_stream(**chat_request.inline_request(model))
+  chat_request.mark_connected()
+  async for chunk in stream:
+    yield chunk
+
+def aresilient_chunks(chat_request, model=None):
+  """Async twin of app.resilient_chunks"""
+  return chat_backend.resilience[model or chat_backend.model_name].astream(
+    lambda model: astream_chunks(chat_request, model),
+    on_start=chat_request.use_model,
+    log=chat_request.log,
+  )
+
+def acascade_chunks(chat_request):
+  """Async twin of app.cascade_chunks"""
+  if chat_backend.cascade is None:
+    return aresilient_chunks(chat_request)
+  return chat_backend.cascade.astream(
+    lambda model: aresilient_chunks(chat_request, model),
+    on_escalate=chat_request.escalate,
+  )
+
+# Producer tasks of shared streams, referenced until they finish
+producers = set()
+
+async def aproduce_shared(shared, chunks, release_slot):
+  """Async twin of app.produce_shared, run as a task on the event loop"""
+  coalescer = chat_backend.coalescer
+  error = None
+  try:
+    async for chunk in chunks:
+      if shared.cancelled and coalescer.abandon(shared):
+        break
+      shared.publish(chunk)
+  except Exception as e:
+    error = e
+  finally:
+    await chunks.aclose()
+    release_slot()
+    coalescer.release(shared)
+    shared.close(error)
+
+async def aadmit(chat_request):
+  """Async twin of app.admit"""
+  if chat_backend.admission:
+    chat_request.admitted(await chat_backend.admission.aacquire())
+
+async def ajoin_upstream(chat_request):
+  """Async twin of app.join_upstream"""
+  coalescer = chat_backend.coalescer
+  if coalescer is None or chat_request.cache_key is None:
+    await aadmit(chat_request)
+    return None
+  shared, leader = coalescer.join(chat_request.cache_key)
+  chat_request.coalesced = not leader
+  if not leader:
+    chat_backend.COALESCED_TOTAL.inc()
+    chat_request.log.detail("Joined an identical in-flight request (%d chunks so far)", len(shared.chunks))
+    return shared
+  try:
+    await aadmit(chat_request)
+  except (Rejected, asyncio.CancelledError) as e:
+    coalescer.release(shared)
+    shared.unsubscribe()
+    shared.close(e if isinstance(e, Rejected) else RuntimeError('Leading request was cancelled'))
+    raise
+  task = asyncio.create_task(aproduce_shared(shared, acascade_chunks(chat_request), chat_request.release_slot))
+  producers.add(task)
+  task.add_done_callback(producers.discard)
+  return shared
+
+async def acoalesced_chunks(chat_request, shared):
+  """Async twin of app.coalesced_chunks"""
+  if shared is None:
+    async for chunk in acascade_chunks(chat_request):
+      yield chunk
+    return
+  for attempt in range(2):
+    if attempt:
+      shared = await ajoin_upstream(chat_request)
+    received = False
+    chunks = shared.aiterate()
+    try:
+      async for chunk in chunks:
+        received = True
+        yield chunk
+      return
+    except Exception as e:
+      if not chat_request.coalesced or received or attempt:
+        raise
+      chat_request.log.warning("Shared upstream stream failed, retrying: %s", e)
+    finally:
+      await chunks.aclose()
+      shared.unsubscribe()
+
+async def watch_disconnect(receive, disconnected):
+  """Set `disconnected` once the client goes away"""
+  while True:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      disconnected.set()
+      return
+
+async def chat(scope, receive, send):
+  # Generate unique request ID for tracking
+  request_id = str(uuid.uuid4())[:8]
+  start_time = time.time()
+  data = None
+
+  try:
+    body = await read_body(receive)
+    if body is None:
+      return
+    data = json.loads(body or b'null') or {}
+
+    # Log incoming request details
+    headers = dict(scope.get('headers', []))
+    client_addr = scope.get('client') or ('unknown', 0)
+    verbosity = request_verbosity(
+      headers.get(b'x-log-verbosity', b'').decode('latin-1'), chat_backend.LOG_VERBOSITY,
+      headers.get(b'x-log-debug-key', b'').decode('latin-1'), chat_backend.LOG_DEBUG_KEY,
+    )
+    log = RequestLog(logger, request_id, verbosity)
+    if chat_backend.rate_limiter:
+      try:
+        chat_backend.rate_limiter.check(client_key(
+          headers.get(b'x-api-key', b'').decode('latin-1'), client_addr[0], chat_backend.rate_limiter.api_keys,
+        ))
+      except Rejected as e:
+        log.warning("Rate limited %s", client_addr[0])
+        chat_backend.REQUESTS_TOTAL.inc(outcome=e.reason)
+        await send_json(send, e.status, *chat_backend.rejection_body(e))
+        return
+    try:
+      conversation_id, messages, incremental = await asyncio.to_thread(chat_backend.resolve_conversation, data)
+    except ConversationNotFound:
+      log.warning("Unknown or expired conversation_id %s", data.get('conversation_id'))
+      chat_backend.REQUESTS_TOTAL.inc(outcome='conversation_not_found')
+      await send_json(send, 404, {'error': 'Unknown or expired conversation_id; resend the full history', 'code': 'conversation_not_found'})
+      return
+    log.detail("Chat request received - Messages count: %d (conversation %s)", len(messages), conversation_id)
+    log.detail("Request IP: %s", client_addr[0])
+    log.detail("User-Agent: %s", headers.get(b'user-agent', b'Unknown').decode('latin-1'))
+
+    if not messages:
+      log.warning("No messages provided in request")
+      chat_backend.REQUESTS_TOTAL.inc(outcome='bad_request')
+      await send_json(send, 400, {'error': 'No messages provided'})
+      return
+
+    chat_request = chat_backend.ChatRequest(request_id, messages, start_time, log, conversation_id, incremental)
+    # prepare() may create or refresh the context cache, so keep it off the loop
+    await asyncio.to_thread(chat_request.prepare)
+
+  except Exception as e:
+    chat_backend.REQUESTS_TOTAL.inc(outcome='server_error')
+    logger.error("[%s] Error in chat endpoint: %s", request_id, e, exc_info=True)
+    logger.error("[%s] Request data: %s", request_id, data if data is not None else 'No data available')
+    await send_json(send, 500, {'error': str(e)})
+    return
+
+  response_start = {
+    'type': 'http.response.start',
+    'status': 200,
+    'headers': [(b'content-type', chat_backend.SSE_CONTENT_TYPE.encode())] + [
+      (name.lower().encode(), value.encode()) for name, value in chat_backend.SSE_HEADERS.items()
+    ] + CORS_HEADERS + (
+      [(b'x-conversation-id', conversation_id.encode())] if conversation_id else []
+    ),
+  }
+
+  async def send_frame(frame):
+    await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+
+  if chat_request.cached_response or chat_request.faq_match:
+    replay = chat_backend.replay_cached_response if chat_request.cached_response else chat_backend.stream_faq_answer
+    await send(response_start)
+    # The replay ends by storing the turn, a SQLite write with CONVERSATION_DB_PATH
+    for frame in await asyncio.to_thread(list, replay(chat_request)):
+      await send_frame(frame)
+    await send({'type': 'http.response.body', 'body': b''})
+    return
+
+  # Wait for a generation slot, or turn the request away fast when saturated
+  try:
+    shared = await ajoin_upstream(chat_request)
+  except Rejected as e:
+    log.warning("Rejected (%s), retry after %ds", e.reason, e.retry_after)
+    chat_request.record(e.reason)
+    await send_json(send, e.status, *chat_backend.rejection_body(e))
+    return
+
+  disconnected = asyncio.Event()
+  watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+  chat_backend.STREAMS_IN_FLIGHT.inc()
+  try:
+    await send(response_start)
+    log.detail("Starting streaming response generation")
+
+    stream = chat_request.stream
+    # None items are idle ticks: due coalesced text or a heartbeat
+    chunks = awith_ticks(acoalesced_chunks(chat_request, shared), stream.tick_seconds)
+    try:
+      async for chunk in chunks:
+        if disconnected.is_set():
+          log.info("Client disconnected, stopping generation")
+          chat_request.record('disconnected')
+          return
+        frame = stream.tick() if chunk is None else chat_request.record_chunk(chunk)
+        if frame:
+          flush_start = time.time()
+          await send_frame(frame)
+          chat_request.record_flush(time.time() - flush_start)
+    finally:
+      await chunks.aclose()
+
+    # finish() stores the turn, a SQLite write with CONVERSATION_DB_PATH
+    await send_frame(stream.event(await asyncio.to_thread(chat_request.finish)))
+    await send_frame(stream.done())
+
+    log.detail("Request completed successfully")
+
+  except Exception as e:
+    await send_frame(chat_request.error_event(e))
+
+  finally:
+    # A shared stream's producer gives its own slot back
+    if shared is None:
+      chat_request.release_slot()
+    chat_backend.STREAMS_IN_FLIGHT.dec()
+    watcher.cancel()
+    if not disconnected.is_set():
+      await send({'type': 'http.response.body', 'body': b''})
+
+async def abatch_frames(chat_request):
+  """Async twin of app.batch_frames"""
+  if chat_request.cached_response or chat_request.faq_match:
+    replay = chat_backend.replay_cached_response if chat_request.cached_response else chat_backend.stream_faq_answer
+    for frame in await asyncio.to_thread(list, replay(chat_request)):
+      yield frame
+    return
+  try:
+    shared = await ajoin_upstream(chat_request)
+  except Rejected as e:
+    chat_request.record(e.reason)
+    raise
+  chunks = acoalesced_chunks(chat_request, shared)
+  try:
+    async for chunk in chunks:
+      frame = chat_request.record_chunk(chunk)
+      if frame:
+        yield frame
+    yield chat_request.stream.event(await asyncio.to_thread(chat_request.finish))
+  except Exception as e:
+    yield chat_request.error_event(e)
+  finally:
+    await chunks.aclose()
+    if shared is None:
+      chat_request.release_slot()
+
+async def aanswer_batch_item(batch_id, item, verbosity):
+  """Async twin of app.answer_batch_item"""
+  request_id = f"{batch_id}-{item.index}"
+  log = RequestLog(logger, request_id, verbosity)
+  result = {'type': 'result', 'index': item.index, 'id': item.id, 'status': 'ok'}
+  try:
+    chat_request = chat_backend.ChatRequest(request_id, item.messages, time.time(), log)
+    await asyncio.to_thread(chat_request.prepare)
+    return read_frames([frame async for frame in abatch_frames(chat_request)], result)
+  except Rejected as e:
+    log.warning("Batch item rejected (%s)", e.reason)
+    result.update(status=e.reason, error=str(e))
+  except Exception as e:
+    chat_backend.REQUESTS_TOTAL.inc(outcome='server_error')
+    log.error("Error answering batch item: %s", e, exc_info=True)
+    result.update(status='error', error=str(e))
+  return result
+
+async def chat_batch(scope, receive, send):
+  batch_id = str(uuid.uuid4())[:8]
+  body = await read_body(receive)
+  if body is None:
+    return
+  headers = dict(scope.get('headers', []))
+  client_addr = scope.get('client') or ('unknown', 0)
+  verbosity = request_verbosity(
+    headers.get(b'x-log-verbosity', b'').decode('latin-1'), chat_backend.LOG_VERBOSITY,
+    headers.get(b'x-log-debug-key', b'').decode('latin-1'), chat_backend.LOG_DEBUG_KEY,
+  )
+  log = RequestLog(logger, batch_id, verbosity)
+  if chat_backend.rate_limiter:
+    try:
+      chat_backend.rate_limiter.check(client_key(
+        headers.get(b'x-api-key', b'').decode('latin-1'), client_addr[0], chat_backend.rate_limiter.api_keys,
+      ))
+    except Rejected as e:
+      log.warning("Rate limited %s", client_addr[0])
+      chat_backend.REQUESTS_TOTAL.inc(outcome=e.reason)
+      await send_json(send, e.status, *chat_backend.rejection_body(e))
+      return
+  try:
+    items, concurrency = parse_batch(json.loads(body or b'null'), chat_backend.BATCH_MAX_ITEMS, chat_backend.BATCH_CONCURRENCY)
+  except ValueError as e:
+    chat_backend.REQUESTS_TOTAL.inc(outcome='bad_request')
+    await send_json(send, 400, {'error': str(e)})
+    return
+  log.info("Batch of %d items, concurrency %d", len(items), concurrency)
+
+  disconnected = asyncio.Event()
+  watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+  lines = arun_batch(items, lambda item: aanswer_batch_item(batch_id, item, verbosity), concurrency)
+  try:
+    await send({
+      'type': 'http.response.start',
+      'status': 200,
+      'headers': [(b'content-type', b'application/x-ndjson'), (b'x-batch-id', batch_id.encode())] + CORS_HEADERS,
+    })
+    async for line in lines:
+      if disconnected.is_set():
+        log.info("Client disconnected, cancelling the rest of the batch")
+        return
+      await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+  finally:
+    await lines.aclose()
+    watcher.cancel()
+    if not disconnected.is_set():
+      await send({'type': 'http.response.body', 'body': b''})
+
+async def metrics(scope, receive, send):
+  body = chat_backend.registry.render().encode('utf-8')
+  await send({
+    'type': 'http.response.start',
+    'status': 200,
+    'headers': [(b'content-type', chat_backend.METRICS_CONTENT_TYPE.encode())],
+  })
+  await send({'type': 'http.response.body', 'body': body})
+
+async def health(scope, receive, send):
+  logger.info("Health check requested")
+  await send_json(send, 200, {'status': 'healthy'})
+
+async def lifespan(scope, receive, send):
+  while True:
+    message = await receive()
+    if message['type'] == 'lifespan.startup':
+      logger.info("Starting Optum HR Chat Application (ASGI)")
+      await send({'type': 'lifespan.startup.complete'})
+    elif message['type'] == 'lifespan.shutdown':
+      await send({'type': 'lifespan.shutdown.complete'})
+      return
+
+ROUTES = {
+  ('POST', '/chat'): chat,
+  ('POST', '/chat/batch'): chat_batch,
+  ('GET', '/health'): health,
+  ('GET', '/metrics'): metrics,
+}
+
+async def app(scope, receive, send):
+  """ASGI entry point serving the same /chat and /health contract as app.py"""
+  if scope['type'] == 'lifespan':
+    await lifespan(scope, receive, send)
+    return
+  if scope['type'] != 'http':
+    return
+
+  handler = ROUTES.get((scope['method'], scope['path']))
+  if handler is None:
+    if scope['method'] == 'OPTIONS':
+      await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': CORS_HEADERS + [
+          (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+          (b'access-control-allow-headers', b'content-type, x-api-key, x-log-verbosity, x-log-debug-key'),
+        ],
+      })
+      await send({'type': 'http.response.body', 'body': b''})
+      return
+    await send_json(send, 404, {'error': 'Not found'})
+    return
+
+  await handler(scope, receive, send)
+
+if __name__ == '__main__':
+  import uvicorn
+  uvicorn.run(app, host='localhost', port=6000, log_level='warning')
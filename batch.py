@@ -0,0 +1,158 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+class BatchItem:
+  """One conversation of a /chat/batch request"""
+
+  def __init__(self, index, item_id, messages):
+    self.index = index
+    self.id = item_id
+    self.messages = messages
+
+def parse_batch(data, max_items, max_concurrency):
+  """(BatchItems, concurrency) from a /chat/batch body; raises ValueError when it is malformed.
+
+  `items` holds /chat-style bodies (`{"messages": [...]}` or
+  `{"message": "..."}`, each with an optional `id`) or plain question strings.
+  `concurrency` may lower, but not raise, max_concurrency.
+  """
+  data = data if isinstance(data, dict) else {}
+  items = data.get('items')
+  if not isinstance(items, list) or not items:
+    raise ValueError('items must be a non-empty list')
+  if len(items) > max_items:
+    raise ValueError(f'at most {max_items} items per batch')
+  parsed = []
+  for index, item in enumerate(items):
+    if isinstance(item, str):
+      item = {'message': item}
+    if not isinstance(item, dict):
+      raise ValueError(f'item {index} must be an object or a string')
+    messages = item.get('messages')
+    if not messages:
+      message = item.get('message')
+      if isinstance(message, dict):
+        message = message.get('content')
+      messages = [{'role': 'user', 'content': message}] if message else []
+    if not isinstance(messages, list) or not messages:
+      raise ValueError(f'item {index} has no messages')
+    parsed.append(BatchItem(index, item.get('id', index), messages))
+  try:
+    concurrency = int(data.get('concurrency') or max_concurrency)
+  except (TypeError, ValueError):
+    raise ValueError('concurrency must be an integer')
+  return parsed, max(1, min(concurrency, max_concurrency, len(parsed)))
+
+def read_frames(frames, result):
+  """Fold a request's SSE output into its result: answer, metrics or error"""
+  answer = []
+  for frame in frames:
+    for line in frame.split('\n'):
+      if not line.startswith('data: {'):
+        continue
+      event = json.loads(line[6:])
+      kind = event.pop('type', None)
+      if kind == 'content':
+        answer.append(event['content'])
+      elif kind == 'metrics':
+        result['metrics'] = event
+      elif kind == 'error':
+        result['status'] = 'error'
+        result['error'] = event['error']
+  result['answer'] = ''.join(answer)
+  return result
+
+def percentile(values, q):
+  values = sorted(values)
+  return values[int(q * (len(values) - 1))] if values else None
+
+class BatchSummary:
+  """Aggregate of a batch's item results: outcomes, latency percentiles, tokens and cost"""
+
+  def __init__(self):
+    self.start = time.time()
+    self.items = 0
+    self.statuses = Counter()
+    self.latencies = []
+    self.ttfts = []
+    self.tokens = Counter()
+    self.cost = 0.0
+    self.served = Counter()
+
+  def add(self, result):
+    self.items += 1
+    self.statuses[result['status']] += 1
+    metrics = result.get('metrics')
+    if result['status'] != 'ok' or not metrics:
+      return
+    self.latencies.append(metrics['latency'])
+    if metrics.get('ttft') is not None:
+      self.ttfts.append(metrics['ttft'])
+    for kind in ('input', 'cached_input', 'output', 'thinking'):
+      self.tokens[kind] += metrics.get(f'{kind}_tokens', 0)
+    self.cost += metrics.get('cost', 0)
+    if metrics.get('cached'):
+      self.served['response_cache'] += 1
+    elif metrics.get('fast_path'):
+      self.served['faq'] += 1
+    else:
+      self.served[metrics.get('model', 'unknown')] += 1
+
+  def as_dict(self):
+    return {
+      'type': 'summary',
+      'items': self.items,
+      'ok': self.statuses['ok'],
+      'errors': {status: n for status, n in self.statuses.items() if status != 'ok'},
+      'wall_s': round(time.time() - self.start, 3),
+      'latency': {f'p{int(q * 100)}': percentile(self.latencies, q) for q in (0.5, 0.9, 0.99)},
+      'ttft': {f'p{int(q * 100)}': percentile(self.ttfts, q) for q in (0.5, 0.9, 0.99)},
+      'latency_sum_s': round(sum(self.latencies), 3),
+      'tokens': dict(self.tokens, total=sum(self.tokens.values())),
+      'cost': round(self.cost, 6),
+      'served_by': dict(self.served),
+    }
+
+def ndjson(payload):
+  return json.dumps(payload) + '\n'
+
+def run_batch(items, run_item, concurrency):
+  """NDJSON lines: each item's result as it finishes, then the summary.
+
+  run_item(item) answers one item on a pool of `concurrency` threads. If the
+  consumer stops early, items that have not started are cancelled.
+  """
+  summary = BatchSummary()
+  executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+  try:
+    futures = [executor.submit(run_item, item) for item in items]
+    for future in as_completed(futures):
+      result = future.result()
+      summary.add(result)
+      yield ndjson(result)
+    yield ndjson(summary.as_dict())
+  finally:
+    executor.shutdown(wait=False, cancel_futures=True)
+
+async def arun_batch(items, arun_item, concurrency):
+  """Async twin of `run_batch`: at most `concurrency` items run on the event loop at once"""
+  summary = BatchSummary()
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def bounded(item):
+    async with semaphore:
+      return await arun_item(item)
+
+  tasks = [asyncio.ensure_future(bounded(item)) for item in items]
+  try:
+    for next_result in asyncio.as_completed(tasks):
+      result = await next_result
+      summary.add(result)
+      yield ndjson(result)
+    yield ndjson(summary.as_dict())
+  finally:
+    for task in tasks:
+      task.cancel()
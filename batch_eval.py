@@ -0,0 +1,103 @@
+"""Ask a list of questions through /chat/batch and report the results.
+
+Questions come from a file (or - for stdin): either plain text, one question
+per line, or JSONL with one /chat body per line (`{"message": ...}` or
+`{"messages": [...]}`, optionally with an `id`). The server answers them
+concurrently and streams each result back as it finishes.
+
+  # re-ask the QA questions after a knowledge base update
+  python batch_eval.py questions.txt --output answers.jsonl
+
+  # a server on another port, four at a time, summary as JSON
+  python batch_eval.py questions.jsonl --url http://localhost:6001 --concurrency 4 --json
+
+Each result line (answer, metrics or error) is written to --output as it
+arrives; the summary reports latency percentiles, tokens and cost.
+"""
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+def read_items(path):
+  """Batch items from a plain-text or JSONL questions file"""
+  handle = sys.stdin if path == '-' else open(path, encoding='utf-8')
+  with handle:
+    lines = [line.strip() for line in handle if line.strip()]
+  return [json.loads(line) if line.startswith('{') else line for line in lines]
+
+def run(url, items, concurrency, timeout):
+  """POST the batch and yield its NDJSON lines as they arrive"""
+  body = {'items': items}
+  if concurrency:
+    body['concurrency'] = concurrency
+  request = urllib.request.Request(
+    url.rstrip('/') + '/chat/batch',
+    data=json.dumps(body).encode('utf-8'),
+    headers={'Content-Type': 'application/json'},
+  )
+  with urllib.request.urlopen(request, timeout=timeout) as response:
+    for line in response:
+      if line.strip():
+        yield json.loads(line)
+
+def print_result(result):
+  metrics = result.get('metrics') or {}
+  latency = f"{metrics['latency']:.2f}s" if 'latency' in metrics else '-'
+  detail = result.get('error') or result.get('answer', '').replace('\n', ' ')
+  print(f"[{result['status']}] {result['id']} {latency} {detail[:100]}", file=sys.stderr)
+
+def print_summary(summary):
+  print(f"items {summary['items']}, ok {summary['ok']} {summary['errors'] or ''}")
+  print(f"wall {summary['wall_s']:.2f}s (sum of latencies {summary['latency_sum_s']:.2f}s)")
+  for name in ('ttft', 'latency'):
+    values = summary[name]
+    print(f"{name:<8} " + '  '.join(f"{q} {v:.3f}s" for q, v in values.items() if v is not None))
+  tokens = summary['tokens']
+  print(f"tokens {tokens.get('total', 0)} (in {tokens.get('input', 0)}, cached {tokens.get('cached_input', 0)}, "
+        f"out {tokens.get('output', 0)}), cost ${summary['cost']:.6f}")
+  print(f"served by {summary['served_by']}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('questions', help='questions file (plain text or JSONL), or - for stdin')
+  parser.add_argument('--url', default='http://localhost:6000', help='base URL of the chat server')
+  parser.add_argument('--concurrency', type=int, default=None, help='items answered at once (capped by the server)')
+  parser.add_argument('--output', help='write every result line to this JSONL file')
+  parser.add_argument('--timeout', type=float, default=300.0, help='seconds to wait for the next result')
+  parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+  args = parser.parse_args()
+
+  items = read_items(args.questions)
+  if not items:
+    parser.error('no questions found')
+
+  output = open(args.output, 'w', encoding='utf-8') if args.output else None
+  summary = None
+  try:
+    for line in run(args.url, items, args.concurrency, args.timeout):
+      if line.get('type') == 'summary':
+        summary = line
+        continue
+      print_result(line)
+      if output:
+        output.write(json.dumps(line) + '\n')
+        output.flush()
+  except urllib.error.HTTPError as e:
+    sys.exit(f"batch failed: HTTP {e.code} {e.read().decode('utf-8', 'replace')}")
+  finally:
+    if output:
+      output.close()
+
+  if summary is None:
+    sys.exit('batch ended without a summary')
+  if args.json:
+    print(json.dumps(summary, indent=2))
+  else:
+    print_summary(summary)
+  if summary['ok'] < summary['items']:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,121 @@
+"""Per-request allocation profile of building the Gemini request.
+
+Compares the original construction, which built the system prompt string,
+its Content, the GenerateContentConfig and a Content per message on every
+request, against the shared PromptRegistry objects used by ChatRequest.
+Memory is measured with tracemalloc:
+
+  peak KiB     peak traced memory above the baseline while building one request
+  held KiB     memory still referenced per request while its arguments are alive
+               (what every in-flight stream holds on to)
+  us/request   wall time per request
+
+Conversations are multi-turn and drawn from a small pool, as with real
+follow-up questions that resend earlier turns.
+
+  python benchmarks/allocation_profile.py --requests 500
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+os.environ['CONTEXT_CACHE_ENABLED'] = 'false'
+os.environ['RESPONSE_CACHE_SIZE'] = '0'
+os.environ['LEDGER_PATH'] = ''
+
+import app
+from google.genai import types
+from knowledge_base import build_system_prompt
+
+QUESTIONS = [
+  "Who can apply for the Member Loan?",
+  "How do I change my voluntary contribution percentage?",
+  "When can I withdraw from the retirement fund?",
+  "What happens to my retirement fund if I resign?",
+  "Where do I download the Promissory Note?",
+]
+ANSWER = "You can find this in the Loan tab of the retirement portal."
+
+def conversation(i):
+  """A 1-3 turn conversation; the pool repeats so turns are seen again"""
+  messages = []
+  for turn in range(i % 3 + 1):
+    messages.append({'role': 'user', 'content': QUESTIONS[(i + turn) % len(QUESTIONS)]})
+    messages.append({'role': 'assistant', 'content': ANSWER})
+  return messages[:-1]
+
+def original_request(messages):
+  """The per-request construction used before the prompt registry"""
+  recent_messages = messages[-5:]
+  formatted_messages = [
+    types.Content(role="user" if msg["role"] == "user" else "model", parts=[types.Part.from_text(text=msg["content"])])
+    for msg in recent_messages
+  ]
+  system_prompt = build_system_prompt(app.retrieve_sections(recent_messages))
+  system_content = types.Content(role="user", parts=[types.Part.from_text(text=system_prompt)])
+  config = types.GenerateContentConfig(
+    temperature=0.7,
+    top_p=0.8,
+    max_output_tokens=2048,
+    safety_settings=app.safety_settings,
+  )
+  return {'model': app.model_name, 'contents': [system_content] + formatted_messages, 'config': config}
+
+def registry_request(messages):
+  """The same steps as ChatRequest.prepare and inline_request, on shared objects"""
+  recent_messages = messages[-5:]
+  formatted_messages = app.format_conversation_for_gemini(recent_messages)
+  _, system_content = app.prompts.system_prompt(app.retrieve_sections(recent_messages))
+  return {'model': app.model_name, 'contents': [system_content] + formatted_messages, 'config': app.prompts.config}
+
+def profile(build, requests):
+  # Warm up once so one-time construction is not charged to requests
+  for i in range(len(QUESTIONS) * 3):
+    build(conversation(i))
+
+  start = time.perf_counter()
+  for i in range(requests):
+    build(conversation(i))
+  elapsed = time.perf_counter() - start
+
+  tracemalloc.start()
+  peaks = []
+  for i in range(min(requests, 200)):
+    messages = conversation(i)
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    build(messages)
+    peaks.append(tracemalloc.get_traced_memory()[1] - base)
+
+  held = []
+  base = tracemalloc.get_traced_memory()[0]
+  for i in range(requests):
+    held.append(build(conversation(i)))
+  held_bytes = tracemalloc.get_traced_memory()[0] - base
+  tracemalloc.stop()
+
+  return {
+    'peak_kib': sum(peaks) / len(peaks) / 1024,
+    'held_kib': held_bytes / requests / 1024,
+    'us': elapsed / requests * 1e6,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--requests', type=int, default=500)
+  args = parser.parse_args()
+  logging.disable(logging.CRITICAL)
+
+  print(f"{'build':<10} {'peak KiB':>9} {'held KiB':>9} {'us/request':>11}")
+  for name, build in (('original', original_request), ('registry', registry_request)):
+    r = profile(build, args.requests)
+    print(f"{name:<10} {r['peak_kib']:>9.1f} {r['held_kib']:>9.1f} {r['us']:>11.1f}")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,275 @@
+"""Drive /chat at a target concurrency or request rate and report latency.
+
+Either point it at a running server with --url, or let it start one with
+--serve flask|asgi against the offline fake upstream (GEMINI_BACKEND=fake),
+so the run needs no API key and is reproducible with --seed.
+
+  # 50 concurrent users for 30 seconds against a local fake-backed ASGI server
+  python benchmarks/load_test.py --serve asgi --concurrency 50 --duration 30
+
+  # open loop at 20 requests/s with lognormal TTFT and 2% upstream errors
+  python benchmarks/load_test.py --serve flask --rps 20 --duration 30 \\
+      --ttft lognormal:0.6,0.5 --error-rate 0.02 --seed 7
+
+  # 5% of upstream calls stall; the first-chunk deadline and retries recover them
+  python benchmarks/load_test.py --serve asgi --rps 20 --duration 30 \\
+      --stall-rate 0.05 --stall-seconds 30 --seed 7
+
+  # an already running server
+  python benchmarks/load_test.py --url http://localhost:6000 --concurrency 10 --requests 200
+
+TTFT is measured client-side, from sending the request to the first content
+frame. Errors are counted by kind: HTTP status, error events in the stream,
+timeouts and connection failures.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+  "Who can apply for the Member Loan?",
+  "How do I change my voluntary contribution percentage?",
+  "When can I withdraw from the retirement fund?",
+  "What happens to my retirement fund if I resign?",
+  "How is the retirement benefit computed?",
+  "Where do I download the Promissory Note?",
+  "Can I have two loans at the same time?",
+  "How long does loan processing take?",
+]
+
+class RequestFailed(Exception):
+  def __init__(self, kind):
+    super().__init__(kind)
+    self.kind = kind
+
+def start_server(args):
+  """Start app.py or asgi_app.py on the fake upstream; returns (process, port)"""
+  env = dict(
+    os.environ,
+    GEMINI_BACKEND='fake',
+    FAKE_GEMINI_TTFT=args.ttft,
+    FAKE_GEMINI_CHUNK_INTERVAL=str(args.chunk_interval),
+    FAKE_GEMINI_WORDS_PER_CHUNK=str(args.words_per_chunk),
+    FAKE_GEMINI_ERROR_RATE=str(args.error_rate),
+    FAKE_GEMINI_STALL_RATE=str(args.stall_rate),
+    FAKE_GEMINI_STALL_SECONDS=str(args.stall_seconds),
+    LOG_FILE=os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'chat_app.log'),
+    LEDGER_PATH='',
+    # Every request comes from this one address
+    RATE_LIMIT_PER_SECOND='0',
+  )
+  if args.tokens_per_second:
+    env['FAKE_GEMINI_TOKENS_PER_SECOND'] = str(args.tokens_per_second)
+  if args.seed is not None:
+    env['FAKE_GEMINI_SEED'] = str(args.seed)
+  # The questions repeat, so by default every request makes its own upstream
+  # call: no cached answers, no FAQ fast path, no joining an identical stream
+  if not args.response_cache:
+    env['RESPONSE_CACHE_SIZE'] = '0'
+  if not args.faq_fast_path:
+    env['FAQ_FAST_PATH_ENABLED'] = 'false'
+  if not args.coalesce:
+    env['COALESCE_REQUESTS'] = 'false'
+
+  port = args.port
+  if args.serve == 'flask':
+    code = f"import app; from werkzeug.serving import run_simple; run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+  else:
+    code = f"import uvicorn, asgi_app; uvicorn.run(asgi_app.app, host='127.0.0.1', port={port}, log_level='warning', backlog=4096)"
+  process = subprocess.Popen(
+    [sys.executable, '-c', code], cwd=ROOT, env=env,
+    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+  )
+  deadline = time.time() + 15
+  while time.time() < deadline:
+    try:
+      with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+        if response.status == 200:
+          return process, port
+    except OSError:
+      time.sleep(0.2)
+  process.kill()
+  raise RuntimeError(f'{args.serve} server did not start on port {port}')
+
+async def one_request(host, port, question, timeout):
+  """POST one /chat request and read it to [DONE]; returns (ttft, latency)"""
+  body = json.dumps({'messages': [{'role': 'user', 'content': question}]}).encode()
+  request = (
+    f'POST /chat HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n'
+    f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+  ).encode() + body
+
+  start = time.perf_counter()
+  try:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+  except asyncio.TimeoutError:
+    raise RequestFailed('timeout')
+  except OSError:
+    raise RequestFailed('connection')
+
+  try:
+    writer.write(request)
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    status = int(head.split(b' ', 2)[1])
+    if status != 200:
+      raise RequestFailed(f'http_{status}')
+
+    ttft = None
+    tail = b''
+    while True:
+      data = await asyncio.wait_for(reader.read(65536), timeout)
+      if not data:
+        raise RequestFailed('truncated')
+      tail = tail[-64:] + data
+      if ttft is None and b'"type": "content"' in tail:
+        ttft = time.perf_counter() - start
+      if b'"type": "error"' in tail:
+        raise RequestFailed('error_event')
+      if b'data: [DONE]' in tail:
+        return ttft, time.perf_counter() - start
+  except asyncio.TimeoutError:
+    raise RequestFailed('timeout')
+  except (OSError, asyncio.IncompleteReadError):
+    raise RequestFailed('connection')
+  finally:
+    writer.close()
+
+async def run_load(host, port, args):
+  """Closed loop (--concurrency workers) or open loop (--rps arrivals)"""
+  questions = itertools.cycle(QUESTIONS)
+  results = []
+  in_flight = set()
+  deadline = time.perf_counter() + args.duration if args.duration else None
+  counter = itertools.count()
+
+  def more():
+    if args.requests and next(counter) >= args.requests:
+      return False
+    return deadline is None or time.perf_counter() < deadline
+
+  async def timed(question):
+    try:
+      ttft, latency = await one_request(host, port, question, args.timeout)
+      results.append(('ok', ttft, latency))
+    except RequestFailed as e:
+      results.append((e.kind, None, None))
+
+  start = time.perf_counter()
+  if args.rps:
+    interval = 1 / args.rps
+    next_send = start
+    while more():
+      now = time.perf_counter()
+      if next_send > now:
+        await asyncio.sleep(next_send - now)
+      next_send += interval
+      if len(in_flight) >= args.max_in_flight:
+        results.append(('client_overload', None, None))
+        continue
+      task = asyncio.create_task(timed(next(questions)))
+      in_flight.add(task)
+      task.add_done_callback(in_flight.discard)
+    if in_flight:
+      await asyncio.wait(in_flight)
+  else:
+    async def worker():
+      while more():
+        await timed(next(questions))
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+  return results, time.perf_counter() - start
+
+def percentile(values, q):
+  values = sorted(values)
+  return values[int(q * (len(values) - 1))] if values else float('nan')
+
+def summarize(results, wall):
+  ok = [r for r in results if r[0] == 'ok']
+  ttfts = [r[1] for r in ok if r[1] is not None]
+  latencies = [r[2] for r in ok]
+  errors = Counter(r[0] for r in results if r[0] != 'ok')
+  return {
+    'requests': len(results),
+    'ok': len(ok),
+    'error_rate': (len(results) - len(ok)) / len(results) if results else 0.0,
+    'errors': dict(errors),
+    'wall_s': wall,
+    'throughput_rps': len(ok) / wall if wall > 0 else 0.0,
+    'ttft': {f'p{int(q * 100)}': percentile(ttfts, q) for q in (0.5, 0.9, 0.99)},
+    'latency': {f'p{int(q * 100)}': percentile(latencies, q) for q in (0.5, 0.9, 0.99)},
+  }
+
+def print_summary(summary):
+  print(f"requests {summary['requests']}, ok {summary['ok']}, "
+        f"error rate {summary['error_rate']:.2%} {summary['errors'] or ''}")
+  print(f"throughput {summary['throughput_rps']:.1f} req/s over {summary['wall_s']:.1f}s")
+  for name in ('ttft', 'latency'):
+    values = summary[name]
+    print(f"{name:<8} " + '  '.join(f"{q} {v:.3f}s" for q, v in values.items()))
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  target = parser.add_mutually_exclusive_group(required=True)
+  target.add_argument('--url', help='base URL of a running server')
+  target.add_argument('--serve', choices=['flask', 'asgi'], help='start a server on the fake upstream')
+  load = parser.add_mutually_exclusive_group()
+  load.add_argument('--concurrency', type=int, default=10, help='closed loop: concurrent users (default 10)')
+  load.add_argument('--rps', type=float, help='open loop: requests started per second')
+  parser.add_argument('--duration', type=float, default=None, help='seconds to run (default: until --requests)')
+  parser.add_argument('--requests', type=int, default=None, help='total requests to send')
+  parser.add_argument('--max-in-flight', type=int, default=2000, help='open-loop cap on outstanding requests')
+  parser.add_argument('--timeout', type=float, default=30.0)
+  parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+
+  fake = parser.add_argument_group('fake upstream (with --serve)')
+  fake.add_argument('--ttft', default='0.5', help='TTFT seconds or distribution, e.g. lognormal:0.5,0.4')
+  fake.add_argument('--chunk-interval', type=float, default=0.05)
+  fake.add_argument('--words-per-chunk', type=int, default=3)
+  fake.add_argument('--tokens-per-second', type=float, default=None, help='pace chunks by token rate instead')
+  fake.add_argument('--error-rate', type=float, default=0.0)
+  fake.add_argument('--stall-rate', type=float, default=0.0, help='fraction of calls that hang before the first chunk')
+  fake.add_argument('--stall-seconds', type=float, default=60.0)
+  fake.add_argument('--seed', type=int, default=None)
+  fake.add_argument('--response-cache', action='store_true', help='keep the response cache enabled')
+  fake.add_argument('--faq-fast-path', action='store_true', help='keep the FAQ fast path enabled')
+  fake.add_argument('--coalesce', action='store_true', help='keep request coalescing enabled')
+  fake.add_argument('--port', type=int, default=6200)
+  args = parser.parse_args()
+
+  if not args.duration and not args.requests:
+    args.requests = 100
+
+  process = None
+  if args.serve:
+    process, port = start_server(args)
+    host = '127.0.0.1'
+  else:
+    url = urllib.parse.urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+
+  try:
+    results, wall = asyncio.run(run_load(host, port, args))
+  finally:
+    if process is not None:
+      process.terminate()
+      process.wait()
+
+  summary = summarize(results, wall)
+  if args.json:
+    print(json.dumps(summary, indent=2))
+  else:
+    print_summary(summary)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,108 @@
+"""Measure the per-request logging overhead on the streaming path.
+
+Drives ChatRequest through prepare, the chunk loop and finish against a
+zero-latency fake upstream, so the time per request is almost entirely
+server-side work (including logging). Three setups are compared:
+
+  sync-debug     the old setup: FileHandler + StreamHandler, every step logged
+  queue-debug    queued batch writer, every step logged
+  queue-summary  queued batch writer, one summary line per request
+
+A `none` run with logging disabled is the baseline; the overhead column is
+each setup's mean time minus that baseline. Run-to-run noise is of the
+same order as the differences between setups, so compare within one run
+and repeat it before drawing conclusions.
+
+  python benchmarks/logging_benchmark.py --requests 2000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+os.environ['CONTEXT_CACHE_ENABLED'] = 'false'
+os.environ['RESPONSE_CACHE_SIZE'] = '0'
+os.environ['LEDGER_PATH'] = ''
+os.environ['LOG_FILE'] = os.path.join(tempfile.mkdtemp(prefix='bench-log-'), 'chat_app.log')
+
+import app
+import logging_setup
+from fake_gemini import FakeClient, FakeStreamProfile
+from logging_setup import RequestLog
+
+def configure(setup, log_file, devnull):
+  logging.disable(logging.NOTSET)
+  if setup == 'none':
+    logging_setup.shutdown_logging()
+    logging.disable(logging.CRITICAL)
+  elif setup == 'sync-debug':
+    logging_setup.shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+      root.removeHandler(handler)
+    formatter = logging.Formatter(logging_setup.LOG_FORMAT)
+    for handler in (logging.FileHandler(log_file), logging.StreamHandler(devnull)):
+      handler.setFormatter(formatter)
+      root.addHandler(handler)
+    root.setLevel(logging.INFO)
+  else:
+    logging_setup.configure_logging(log_file=log_file)
+
+def run(setup, requests, devnull):
+  verbosity = 'summary' if setup.endswith('summary') else 'debug'
+  log_file = os.path.join(tempfile.mkdtemp(prefix='bench-log-'), 'chat_app.log')
+  configure(setup, log_file, devnull)
+
+  per_request = []
+  wall_start = time.perf_counter()
+  for i in range(requests):
+    messages = [{'role': 'user', 'content': f'question {i}: how much can I borrow from the fund?'}]
+    start = time.perf_counter()
+    chat_request = app.ChatRequest(f'{i:08d}', messages, time.time(), RequestLog(app.logger, f'{i:08d}', verbosity))
+    chat_request.prepare()
+    for chunk in app.stream_chunks(chat_request):
+      chat_request.record_chunk(chunk)
+    chat_request.finish()
+    per_request.append(time.perf_counter() - start)
+  request_time = time.perf_counter() - wall_start
+  logging_setup.shutdown_logging()
+  drained_time = time.perf_counter() - wall_start
+
+  per_request.sort()
+  return {
+    'mean_us': sum(per_request) / len(per_request) * 1e6,
+    'p99_us': per_request[int(0.99 * (len(per_request) - 1))] * 1e6,
+    'requests_s': request_time,
+    'drained_s': drained_time,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--setups', nargs='+', default=['sync-debug', 'queue-debug', 'queue-summary'])
+  args = parser.parse_args()
+
+  app.client = FakeClient(FakeStreamProfile(ttft=0, chunk_interval=0))
+  stdout = sys.stdout
+  with open(os.devnull, 'w') as devnull:
+    results = {}
+    for setup in ['none'] + args.setups:
+      sys.stdout = devnull  # the queued writer also echoes to stdout
+      try:
+        results[setup] = run(setup, args.requests, devnull)
+      finally:
+        sys.stdout = stdout
+
+  baseline = results['none']['mean_us']
+  print(f"{'setup':<15} {'mean us/req':>12} {'overhead us':>12} {'p99 us/req':>11} {'requests s':>11} {'incl. drain s':>14}")
+  for setup, r in results.items():
+    print(f"{setup:<15} {r['mean_us']:>12.1f} {r['mean_us'] - baseline:>12.1f} {r['p99_us']:>11.1f} "
+          f"{r['requests_s']:>11.2f} {r['drained_s']:>14.2f}")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,194 @@
+"""Deterministic, network-free regression benchmark of the full server path.
+
+First record the upstream streams for the Streamlit example prompts into a
+cassette file, once, against Gemini (needs GOOGLE_API_KEY) or the fake:
+
+  python benchmarks/replay_benchmark.py record --backend gemini --cassette cassettes/examples.jsonl.gz
+
+Then replay them through a server with GEMINI_BACKEND=replay. Every prompt is
+sent --rounds times at --concurrency, and the run reports client-side TTFT and
+latency plus the server overhead: latency minus the recorded upstream time
+(scaled by --time-scale; 0 replays with no delays, so latency is all server).
+
+  python benchmarks/replay_benchmark.py replay --cassette cassettes/examples.jsonl.gz --save baseline.json
+  python benchmarks/replay_benchmark.py replay --cassette cassettes/examples.jsonl.gz --baseline baseline.json
+
+With --baseline the run exits 1 when p50 or p90 server overhead grew by more
+than --tolerance. Formatting, logging, the ledger, SSE framing and metrics all
+run as in production; the response cache and the FAQ fast path are off so
+every request reaches the (replayed) upstream.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from load_test import RequestFailed, one_request, percentile
+
+def example_prompts():
+  """EXAMPLE_PROMPTS from streamlit_app.py, read without importing Streamlit"""
+  with open(os.path.join(ROOT, 'streamlit_app.py'), encoding='utf-8') as handle:
+    tree = ast.parse(handle.read())
+  for node in tree.body:
+    if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'EXAMPLE_PROMPTS' for t in node.targets):
+      return ast.literal_eval(node.value)
+  raise RuntimeError('EXAMPLE_PROMPTS not found in streamlit_app.py')
+
+def start_server(serve, port, env):
+  """Start app.py or asgi_app.py with env added; returns the process once /health answers"""
+  workdir = tempfile.mkdtemp(prefix='replay-bench-')
+  env = dict(
+    os.environ,
+    CONTEXT_CACHE_ENABLED='false',
+    RESPONSE_CACHE_SIZE='0',
+    FAQ_FAST_PATH_ENABLED='false',
+    RATE_LIMIT_PER_SECOND='0',
+    LOG_FILE=os.path.join(workdir, 'chat_app.log'),
+    LEDGER_PATH=os.path.join(workdir, 'ledger', 'requests.jsonl'),
+    **env,
+  )
+  if serve == 'flask':
+    code = f"import app; from werkzeug.serving import run_simple; run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+  else:
+    code = f"import uvicorn, asgi_app; uvicorn.run(asgi_app.app, host='127.0.0.1', port={port}, log_level='warning')"
+  process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  deadline = time.time() + 15
+  while time.time() < deadline:
+    try:
+      with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+        if response.status == 200:
+          return process
+    except OSError:
+      time.sleep(0.2)
+  process.kill()
+  raise RuntimeError(f'{serve} server did not start on port {port}')
+
+def recorded_seconds(cassette_path):
+  """Recorded upstream time per prompt, summed over its streams (e.g. cascade tiers)"""
+  from cassettes import CassetteStore
+  seconds = defaultdict(float)
+  for cassette in CassetteStore(cassette_path).cassettes.values():
+    seconds[cassette.prompt] += sum(delay for delay, _ in cassette.chunks)
+  return seconds
+
+def record(args):
+  cassette = os.path.abspath(args.cassette)
+  env = {'GEMINI_BACKEND': args.backend, 'CASSETTE_RECORD': 'true', 'CASSETTE_PATH': cassette}
+  process = start_server(args.serve, args.port, env)
+  failed = 0
+  try:
+    for prompt in example_prompts():
+      try:
+        ttft, latency = asyncio.run(one_request('127.0.0.1', args.port, prompt, args.timeout))
+        print(f"recorded {latency:6.2f}s  {prompt}")
+      except RequestFailed as e:
+        failed += 1
+        print(f"failed ({e.kind})  {prompt}")
+  finally:
+    process.terminate()
+    process.wait()
+  print(f"cassette {cassette}")
+  return 1 if failed else 0
+
+async def replay_rounds(args, prompts, rounds):
+  semaphore = asyncio.Semaphore(args.concurrency)
+  results = []
+
+  async def timed(prompt):
+    async with semaphore:
+      try:
+        ttft, latency = await one_request('127.0.0.1', args.port, prompt, args.timeout)
+        results.append((prompt, ttft, latency))
+      except RequestFailed as e:
+        results.append((prompt, e.kind, None))
+
+  await asyncio.gather(*(timed(prompt) for _ in range(rounds) for prompt in prompts))
+  return results
+
+def summarize(results, upstream_seconds, time_scale):
+  ok = [r for r in results if r[2] is not None]
+  ttfts = [r[1] for r in ok if r[1] is not None]
+  latencies = [r[2] for r in ok]
+  overheads = [latency - upstream_seconds.get(' '.join(prompt.split()), 0.0) * time_scale for prompt, _, latency in ok]
+  return {
+    'requests': len(results),
+    'ok': len(ok),
+    'errors': sorted({r[1] for r in results if r[2] is None}),
+    'ttft': {f'p{int(q * 100)}': percentile(ttfts, q) for q in (0.5, 0.9, 0.99)},
+    'latency': {f'p{int(q * 100)}': percentile(latencies, q) for q in (0.5, 0.9, 0.99)},
+    'overhead': {f'p{int(q * 100)}': percentile(overheads, q) for q in (0.5, 0.9, 0.99)},
+  }
+
+def regressions(summary, baseline, tolerance):
+  """Overhead percentiles that grew by more than tolerance (plus 1ms of noise)"""
+  found = []
+  for q in ('p50', 'p90'):
+    now, before = summary['overhead'][q], baseline['overhead'][q]
+    if now > before * (1 + tolerance) + 0.001:
+      found.append(f"overhead {q} {before * 1000:.1f}ms -> {now * 1000:.1f}ms")
+  return found
+
+def replay(args):
+  cassette = os.path.abspath(args.cassette)
+  if not os.path.exists(cassette):
+    sys.exit(f"no cassette at {cassette}; run the record step first")
+  env = {'GEMINI_BACKEND': 'replay', 'CASSETTE_PATH': cassette, 'CASSETTE_TIME_SCALE': str(args.time_scale)}
+  process = start_server(args.serve, args.port, env)
+  try:
+    prompts = example_prompts()
+    asyncio.run(replay_rounds(args, prompts, 1))  # warm up
+    start = time.perf_counter()
+    results = asyncio.run(replay_rounds(args, prompts, args.rounds))
+    wall = time.perf_counter() - start
+  finally:
+    process.terminate()
+    process.wait()
+
+  summary = summarize(results, recorded_seconds(cassette), args.time_scale)
+  summary.update(server=args.serve, time_scale=args.time_scale, wall_s=wall)
+  print(f"{args.serve}: requests {summary['requests']}, ok {summary['ok']} {summary['errors'] or ''} in {wall:.2f}s")
+  for name in ('ttft', 'latency', 'overhead'):
+    print(f"{name:<9} " + '  '.join(f"{q} {v * 1000:.1f}ms" for q, v in summary[name].items()))
+  if args.save:
+    with open(args.save, 'w', encoding='utf-8') as handle:
+      json.dump(summary, handle, indent=2)
+
+  if summary['errors']:
+    return 1
+  if args.baseline:
+    with open(args.baseline, encoding='utf-8') as handle:
+      found = regressions(summary, json.load(handle), args.tolerance)
+    for line in found:
+      print(f"REGRESSION {line}")
+    return 1 if found else 0
+  return 0
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('mode', choices=['record', 'replay'])
+  parser.add_argument('--cassette', default=os.path.join(ROOT, 'cassettes', 'examples.jsonl.gz'))
+  parser.add_argument('--serve', choices=['flask', 'asgi'], default='asgi')
+  parser.add_argument('--port', type=int, default=6400)
+  parser.add_argument('--timeout', type=float, default=60.0)
+  parser.add_argument('--backend', choices=['gemini', 'fake'], default='gemini', help='record: upstream to record')
+  parser.add_argument('--rounds', type=int, default=20, help='replay: times each prompt is sent')
+  parser.add_argument('--concurrency', type=int, default=4, help='replay: requests in flight')
+  parser.add_argument('--time-scale', type=float, default=0.0, help='replay: recorded delays x this (1 = original timing)')
+  parser.add_argument('--save', help='replay: write the summary to this JSON file')
+  parser.add_argument('--baseline', help='replay: summary JSON to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='replay: allowed overhead growth (default 20%%)')
+  args = parser.parse_args()
+  sys.exit(record(args) if args.mode == 'record' else replay(args))
+
+if __name__ == '__main__':
+  main()
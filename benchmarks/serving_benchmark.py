@@ -0,0 +1,149 @@
+"""Compare concurrent-stream capacity of the Flask and ASGI servers.
+
+Each server runs in its own process against the offline fake upstream from
+fake_gemini.py, so the numbers measure the serving path rather than Gemini.
+For every concurrency level, that many /chat streams are opened at once and
+each is read to `[DONE]`.
+
+  python benchmarks/serving_benchmark.py --levels 50 200 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def serve(server, port, ttft, chunk_interval):
+  """Run one server in this process with the fake upstream installed"""
+  sys.path.insert(0, ROOT)
+  os.environ['GEMINI_BACKEND'] = 'fake'
+  os.environ['FAKE_GEMINI_TTFT'] = str(ttft)
+  os.environ['FAKE_GEMINI_CHUNK_INTERVAL'] = str(chunk_interval)
+  os.environ['CONTEXT_CACHE_ENABLED'] = 'false'
+  os.environ['RESPONSE_CACHE_SIZE'] = '0'
+  os.environ['LEDGER_PATH'] = ''
+  os.environ['ADMISSION_MAX_CONCURRENT'] = '0'
+  os.environ['RATE_LIMIT_PER_SECOND'] = '0'
+
+  import app
+
+  if server == 'flask':
+    from werkzeug.serving import run_simple
+    run_simple('127.0.0.1', port, app.app, threaded=True)
+  else:
+    import uvicorn
+    import asgi_app
+    uvicorn.run(asgi_app.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+def start_server(server, port, args):
+  workdir = tempfile.mkdtemp(prefix=f'bench-{server}-')  # keeps chat_app.log out of the repo
+  process = subprocess.Popen(
+    [sys.executable, os.path.abspath(__file__), '--serve', server, '--port', str(port),
+     '--ttft', str(args.ttft), '--chunk-interval', str(args.chunk_interval)],
+    cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+  )
+  deadline = time.time() + 15
+  while time.time() < deadline:
+    try:
+      with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+        if response.status == 200:
+          return process
+    except OSError:
+      time.sleep(0.2)
+  process.kill()
+  raise RuntimeError(f'{server} server did not start on port {port}')
+
+async def one_stream(port, i, timeout):
+  """POST one /chat request over a raw connection and read it to [DONE].
+
+  A hand-rolled client keeps the load generator's own CPU cost low: on small
+  machines a full HTTP client becomes the bottleneck before the server does.
+  """
+  body = json.dumps({'messages': [{'role': 'user', 'content': f'benchmark question {i} about the member loan'}]}).encode()
+  request = (
+    f'POST /chat HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: application/json\r\n'
+    f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+  ).encode() + body
+
+  start = time.perf_counter()
+  reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+  try:
+    writer.write(request)
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    status = int(head.split(b' ', 2)[1])
+    if status != 200:
+      raise RuntimeError(f'status {status}')
+
+    first_byte = None
+    tail = b''
+    while True:
+      data = await asyncio.wait_for(reader.read(65536), timeout)
+      if not data:
+        raise RuntimeError('stream ended without [DONE]')
+      if first_byte is None:
+        first_byte = time.perf_counter() - start
+      tail = tail[-64:] + data
+      if b'"type": "error"' in tail:
+        raise RuntimeError('error event')
+      if b'data: [DONE]' in tail:
+        return time.perf_counter() - start, first_byte
+  finally:
+    writer.close()
+
+def percentile(values, q):
+  values = sorted(values)
+  return values[int(q * (len(values) - 1))] if values else float('nan')
+
+async def run_level(port, concurrency, timeout):
+  start = time.perf_counter()
+  results = await asyncio.gather(
+    *(one_stream(port, i, timeout) for i in range(concurrency)), return_exceptions=True
+  )
+  wall = time.perf_counter() - start
+
+  ok = [r for r in results if not isinstance(r, BaseException)]
+  return {
+    'ok': len(ok),
+    'errors': len(results) - len(ok),
+    'wall': wall,
+    'p50': percentile([r[0] for r in ok], 0.50),
+    'p95': percentile([r[0] for r in ok], 0.95),
+    'ttfb_p95': percentile([r[1] for r in ok], 0.95),
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--levels', type=int, nargs='+', default=[50, 200, 500])
+  parser.add_argument('--servers', nargs='+', default=['flask', 'asgi'], choices=['flask', 'asgi'])
+  parser.add_argument('--ttft', type=float, default=0.5, help='fake upstream time to first chunk (s)')
+  parser.add_argument('--chunk-interval', type=float, default=0.05, help='fake upstream gap between chunks (s)')
+  parser.add_argument('--timeout', type=float, default=30.0)
+  parser.add_argument('--port', type=int, default=6100)
+  parser.add_argument('--serve', choices=['flask', 'asgi'], help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.serve:
+    serve(args.serve, args.port, args.ttft, args.chunk_interval)
+    return
+
+  print(f"{'server':<7} {'streams':>7} {'ok':>5} {'errors':>6} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'ttfb p95':>9}")
+  for offset, server in enumerate(args.servers):
+    port = args.port + offset
+    process = start_server(server, port, args)
+    try:
+      for level in args.levels:
+        r = asyncio.run(run_level(port, level, args.timeout))
+        print(f"{server:<7} {level:>7} {r['ok']:>5} {r['errors']:>6} {r['ok'] / r['wall']:>8.1f} "
+              f"{r['p50']:>7.2f} {r['p95']:>7.2f} {r['ttfb_p95']:>9.2f}")
+    finally:
+      process.terminate()
+      process.wait()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,228 @@
+"""Measure SSE framing cost and the effect of chunk coalescing.
+
+Three parts, each printed as a table:
+
+  encode    microseconds per chunk to frame answer text: the old
+            `data: json.dumps({...})` frames versus sse.EventStream, with and
+            without coalescing
+  policy    a simulated stream of small chunks (--words-per-chunk words every
+            --chunk-interval seconds) through each flush policy: frames and
+            bytes per answer, and how long text is held back on average and
+            at worst
+  serve     (with --serve flask|asgi) a real server on the fake upstream under
+            --concurrency streams per policy: client latency, frames read and
+            server CPU seconds per stream
+
+  python benchmarks/sse_benchmark.py
+  python benchmarks/sse_benchmark.py --serve asgi --concurrency 100 --words-per-chunk 1 --chunk-interval 0.01
+
+A policy is `chars/ms`: hold text until that many characters are waiting or
+the oldest has waited that many milliseconds (`off` sends every chunk).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sse import EventStream
+
+ANSWER = (
+  "Employees who are regular and currently participating in the Voluntary "
+  "Contributions of the Retirement Fund can apply for the Member Loan through "
+  "the Loan tab of the retirement portal. You will need to upload a signed "
+  "Promissory Note, which you can download from the same tab."
+)
+
+def parse_policy(spec):
+  """(chars, seconds) for a `chars/ms` policy, (0, 0) for `off`"""
+  if spec == 'off':
+    return 0, 0.0
+  chars, _, ms = spec.partition('/')
+  return int(chars), float(ms or 50) / 1000
+
+def answer_chunks(words_per_chunk):
+  words = ANSWER.split(' ')
+  return [' '.join(words[i:i + words_per_chunk]) + ' ' for i in range(0, len(words), words_per_chunk)]
+
+def old_frame(text):
+  return f"data: {json.dumps({'type': 'content', 'content': text})}\n\n"
+
+def bench_encode(chunks, policies, rounds):
+  rows = []
+  start = time.perf_counter()
+  for _ in range(rounds):
+    for text in chunks:
+      old_frame(text)
+  rows.append(('dict + json.dumps', (time.perf_counter() - start) / (rounds * len(chunks)) * 1e6, len(chunks)))
+  for spec in policies:
+    chars, seconds = parse_policy(spec)
+    frames = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+      stream = EventStream(chars, seconds)
+      for text in chunks:
+        stream.content(text)
+      stream.flush()
+      frames = stream.frames
+    rows.append((f'EventStream {spec}', (time.perf_counter() - start) / (rounds * len(chunks)) * 1e6, frames))
+  print(f"{'encode':<24} {'us/chunk':>9} {'frames':>7}")
+  for name, us, frames in rows:
+    print(f"{name:<24} {us:>9.2f} {frames:>7}")
+
+def simulate(chunks, chars, seconds, interval):
+  """Frames, bytes and hold times of one answer streamed at a fixed chunk interval"""
+  now = [0.0]
+  stream = EventStream(chars, seconds, clock=lambda: now[0])
+  held = []  # arrival times of text not yet written
+  holds = []
+  written = 0
+
+  def write(output):
+    nonlocal written
+    if output:
+      written += len(output.encode('utf-8'))
+      holds.extend(now[0] - arrived for arrived in held)
+      held.clear()
+
+  for i, text in enumerate(chunks):
+    if i:
+      # Idle ticks between arrivals, as the server's writer loop would call them
+      arrival = now[0] + interval
+      tick = stream.tick_seconds
+      while tick and now[0] + tick < arrival:
+        now[0] += tick
+        write(stream.tick())
+      now[0] = arrival
+    held.append(now[0])
+    write(stream.content(text))
+  write(stream.done())
+  return stream.frames, written, sum(holds) / len(holds), max(holds)
+
+def bench_policy(chunks, policies, interval):
+  print(f"{'policy':<10} {'frames':>7} {'bytes':>7} {'mean hold ms':>13} {'max hold ms':>12}")
+  for spec in policies:
+    chars, seconds = parse_policy(spec)
+    frames, written, mean_hold, max_hold = simulate(chunks, chars, seconds, interval)
+    print(f"{spec:<10} {frames:>7} {written:>7} {mean_hold * 1000:>13.1f} {max_hold * 1000:>12.1f}")
+
+def cpu_seconds(pid):
+  """User + system CPU time of a process (Linux), or None"""
+  try:
+    with open(f'/proc/{pid}/stat') as handle:
+      fields = handle.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+  except (OSError, IndexError, ValueError):
+    return None
+
+def start_server(serve, port, spec, args):
+  chars, seconds = parse_policy(spec)
+  workdir = tempfile.mkdtemp(prefix='sse-bench-')
+  env = dict(
+    os.environ,
+    GEMINI_BACKEND='fake',
+    FAKE_GEMINI_TTFT=str(args.ttft),
+    FAKE_GEMINI_CHUNK_INTERVAL=str(args.chunk_interval),
+    FAKE_GEMINI_WORDS_PER_CHUNK=str(args.words_per_chunk),
+    CONTEXT_CACHE_ENABLED='false',
+    RESPONSE_CACHE_SIZE='0',
+    FAQ_FAST_PATH_ENABLED='false',
+    ADMISSION_MAX_CONCURRENT='0',
+    RATE_LIMIT_PER_SECOND='0',
+    LEDGER_PATH='',
+    LOG_FILE=os.path.join(workdir, 'chat_app.log'),
+    SSE_COALESCE_CHARS=str(chars),
+    SSE_COALESCE_MS=str(seconds * 1000 or 50),
+  )
+  if serve == 'flask':
+    code = f"import app; from werkzeug.serving import run_simple; run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+  else:
+    code = f"import uvicorn, asgi_app; uvicorn.run(asgi_app.app, host='127.0.0.1', port={port}, log_level='warning', backlog=4096)"
+  process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  deadline = time.time() + 15
+  while time.time() < deadline:
+    try:
+      with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+        if response.status == 200:
+          return process
+    except OSError:
+      time.sleep(0.2)
+  process.kill()
+  raise RuntimeError(f'{serve} server did not start on port {port}')
+
+async def one_stream(port, i, timeout):
+  """Read one /chat stream to [DONE]; returns (latency, frames)"""
+  body = json.dumps({'messages': [{'role': 'user', 'content': f'sse benchmark question {i}'}]}).encode()
+  request = (
+    f'POST /chat HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: application/json\r\n'
+    f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+  ).encode() + body
+  start = time.perf_counter()
+  reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+  try:
+    writer.write(request)
+    received = b''
+    while b'data: [DONE]' not in received[-64:]:
+      data = await asyncio.wait_for(reader.read(65536), timeout)
+      if not data:
+        raise RuntimeError('stream ended without [DONE]')
+      received += data
+    return time.perf_counter() - start, received.count(b'\nid: ') + received.startswith(b'id: ')
+  finally:
+    writer.close()
+
+def bench_serve(policies, args):
+  print(f"{'server':<7} {'policy':<10} {'ok':>5} {'p50 s':>7} {'frames':>7} {'cpu ms/stream':>14}")
+  for offset, spec in enumerate(policies):
+    port = args.port + offset
+    process = start_server(args.serve, port, spec, args)
+    try:
+      # Warm up, then measure the server's CPU time across one round of streams
+      asyncio.run(one_stream(port, -1, args.timeout))
+      cpu_before = cpu_seconds(process.pid)
+
+      async def run():
+        return await asyncio.gather(*(one_stream(port, i, args.timeout) for i in range(args.concurrency)), return_exceptions=True)
+
+      results = asyncio.run(run())
+      cpu_after = cpu_seconds(process.pid)
+    finally:
+      process.terminate()
+      process.wait()
+    ok = sorted(r for r in results if not isinstance(r, BaseException))
+    latency = ok[len(ok) // 2][0] if ok else float('nan')
+    frames = sum(r[1] for r in ok) / len(ok) if ok else float('nan')
+    cpu = (cpu_after - cpu_before) / args.concurrency * 1000 if cpu_before is not None and cpu_after is not None else float('nan')
+    print(f"{args.serve:<7} {spec:<10} {len(ok):>5} {latency:>7.3f} {frames:>7.1f} {cpu:>14.2f}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--policies', nargs='+', default=['off', '32/50', '64/100', '128/200'])
+  parser.add_argument('--words-per-chunk', type=int, default=1, help='words per upstream chunk')
+  parser.add_argument('--chunk-interval', type=float, default=0.02, help='seconds between upstream chunks')
+  parser.add_argument('--rounds', type=int, default=2000, help='encode: answers framed per policy')
+  parser.add_argument('--serve', choices=['flask', 'asgi'], help='also measure a real server on the fake upstream')
+  parser.add_argument('--concurrency', type=int, default=50, help='serve: concurrent streams')
+  parser.add_argument('--ttft', type=float, default=0.1, help='serve: fake upstream time to first chunk (s)')
+  parser.add_argument('--timeout', type=float, default=60.0)
+  parser.add_argument('--port', type=int, default=6500)
+  args = parser.parse_args()
+
+  chunks = answer_chunks(args.words_per_chunk)
+  print(f"{len(chunks)} chunks of {args.words_per_chunk} word(s), {args.chunk_interval * 1000:.0f}ms apart\n")
+  bench_encode(chunks, args.policies, args.rounds)
+  print()
+  bench_policy(chunks, args.policies, args.chunk_interval)
+  if args.serve:
+    print()
+    bench_serve(args.policies, args)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,165 @@
+import os
+import re
+from collections import namedtuple
+
+# Answers that give up rather than answer: worth a stronger model
+REFUSAL_PATTERN = re.compile(
+  r"\b(?:i (?:do not|don't) know"
+  r"|i(?:'m| am) (?:not sure|unable to)"
+  r"|i (?:can't|cannot) (?:help|answer|provide|find)"
+  r"|i (?:do not|don't) have (?:that |enough |any )?(?:information|details)"
+  r"|(?:is|are) not (?:mentioned|covered|specified|included) in (?:the|my) (?:knowledge base|faq|information)"
+  r"|as an ai\b)",
+  re.IGNORECASE,
+)
+
+# Finish and block reasons that mean the model withheld its answer
+BLOCKED_REASONS = frozenset(('SAFETY', 'PROHIBITED_CONTENT', 'BLOCKLIST', 'SPII', 'RECITATION', 'JAILBREAK', 'MODEL_ARMOR'))
+
+# A tier answer the cascade discarded: why, and what it cost
+Escalation = namedtuple('Escalation', ['model', 'reason', 'usage', 'cost'])
+
+def _reason_name(reason):
+  return getattr(reason, 'name', None) or (str(reason) if reason else None)
+
+def is_blocked(chunk):
+  """Whether a streamed chunk reports a safety or policy block"""
+  feedback = getattr(chunk, 'prompt_feedback', None)
+  if feedback is not None and _reason_name(getattr(feedback, 'block_reason', None)) in BLOCKED_REASONS:
+    return True
+  for candidate in getattr(chunk, 'candidates', None) or ():
+    if _reason_name(getattr(candidate, 'finish_reason', None)) in BLOCKED_REASONS:
+      return True
+  return False
+
+class ResponseJudge:
+  """Cheap checks deciding whether a tier's answer is good enough to send.
+
+  `early` looks at the opening text while it is still buffered: refusals
+  and "I don't know" almost always come first. `final` judges a complete
+  answer, adding safety blocks and answers under `min_chars`.
+  """
+
+  def __init__(self, min_chars=20):
+    self.min_chars = min_chars
+
+  def early(self, text):
+    return 'refusal' if REFUSAL_PATTERN.search(text) else None
+
+  def final(self, text, blocked):
+    if blocked:
+      return 'safety_block'
+    if not text.strip():
+      return 'empty'
+    if len(text.strip()) < self.min_chars:
+      return 'too_short'
+    return self.early(text)
+
+class ModelCascade:
+  """Serves each request from the cheapest tier whose answer passes the judge.
+
+  Every tier but the last is buffered until `judge_chars` characters of
+  text have arrived (or the answer ends). If the judge rejects the opening
+  or the whole answer, or the tier fails before anything was sent, the
+  buffer is dropped and the next tier is asked. Once text has been sent
+  the tier is committed, so clients only ever see one answer. The last
+  tier streams straight through.
+  """
+
+  def __init__(self, models, judge=None, judge_chars=160):
+    self.models = list(models)
+    self.judge = judge or ResponseJudge()
+    self.judge_chars = judge_chars
+
+  def stream(self, open_tier, on_escalate=None):
+    """Chunks from the first acceptable tier; open_tier(model) streams one tier.
+
+    on_escalate(model, reason, text, usage_metadata) reports each rejected tier.
+    """
+    for tier, model in enumerate(self.models):
+      chunks = open_tier(model)
+      if tier == len(self.models) - 1:
+        yield from chunks
+        return
+
+      buffered, text, usage, blocked = [], '', None, False
+      reason = None
+      try:
+        for chunk in chunks:
+          blocked = blocked or is_blocked(chunk)
+          usage = chunk.usage_metadata or usage
+          if buffered is None:
+            yield chunk
+            continue
+          buffered.append(chunk)
+          text += chunk.text or ''
+          reason = self.judge.early(text)
+          if reason:
+            break
+          if len(text) >= self.judge_chars and not blocked:
+            yield from buffered
+            buffered = None
+        else:
+          if buffered is None:
+            return
+          reason = self.judge.final(text, blocked)
+          if not reason:
+            yield from buffered
+            return
+      except Exception:
+        if buffered is None:
+          raise
+        reason = 'error'
+      finally:
+        chunks.close()
+      if on_escalate:
+        on_escalate(model, reason, text, usage)
+
+  async def astream(self, open_tier, on_escalate=None):
+    """Async twin of `stream`"""
+    for tier, model in enumerate(self.models):
+      chunks = open_tier(model)
+      if tier == len(self.models) - 1:
+        async for chunk in chunks:
+          yield chunk
+        return
+
+      buffered, text, usage, blocked = [], '', None, False
+      reason = None
+      try:
+        async for chunk in chunks:
+          blocked = blocked or is_blocked(chunk)
+          usage = chunk.usage_metadata or usage
+          if buffered is None:
+            yield chunk
+            continue
+          buffered.append(chunk)
+          text += chunk.text or ''
+          reason = self.judge.early(text)
+          if reason:
+            break
+          if len(text) >= self.judge_chars and not blocked:
+            for buffered_chunk in buffered:
+              yield buffered_chunk
+            buffered = None
+        else:
+          if buffered is None:
+            return
+          reason = self.judge.final(text, blocked)
+          if not reason:
+            for buffered_chunk in buffered:
+              yield buffered_chunk
+            return
+      except Exception:
+        if buffered is None:
+          raise
+        reason = 'error'
+      finally:
+        await chunks.aclose()
+      if on_escalate:
+        on_escalate(model, reason, text, usage)
+
+def cascade_models_from_env(default_model):
+  """Model tiers from CASCADE_MODELS (cheapest first), or just default_model"""
+  models = [m.strip() for m in os.getenv('CASCADE_MODELS', '').split(',') if m.strip()]
+  return models or [default_model]
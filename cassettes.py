@@ -0,0 +1,234 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from google.genai import types
+
+from fake_gemini import FakeChunk, FakeModels
+
+# Where recordings are kept unless CASSETTE_PATH says otherwise
+DEFAULT_CASSETTE_PATH = 'cassettes/upstream.jsonl.gz'
+
+class CassetteMissing(LookupError):
+  """Replay found no recording for a request"""
+
+def _texts(contents):
+  """(role, text) pairs of a request's contents, whitespace-normalized"""
+  if isinstance(contents, str):
+    contents = [types.Content(role='user', parts=[types.Part.from_text(text=contents)])]
+  for content in contents or ():
+    text = ''.join(part.text or '' for part in (content.parts or ()))
+    yield content.role or 'user', ' '.join(text.split())
+
+def request_key(model, contents, config=None):
+  """Key of an upstream request: model, inline or cached prefix, and the normalized prompt.
+
+  A cached prefix is keyed by its presence rather than its name, which
+  changes every time the prefix is registered.
+  """
+  digest = hashlib.sha256(model.encode('utf-8'))
+  digest.update(b'\0cached' if getattr(config, 'cached_content', None) else b'\0inline')
+  for role, text in _texts(contents):
+    digest.update(f"\0{role}\0{text}".encode('utf-8'))
+  return digest.hexdigest()[:32]
+
+def _preview(contents, limit=120):
+  texts = [text for role, text in _texts(contents) if role == 'user']
+  return texts[-1][:limit] if texts else ''
+
+class Cassette:
+  """One recorded stream: each chunk's text and its delay after the previous one (the first after the call)"""
+
+  def __init__(self, key, model, prompt, chunks, usage=None):
+    self.key = key
+    self.model = model
+    self.prompt = prompt
+    self.chunks = chunks
+    self.usage = usage
+
+  @classmethod
+  def from_dict(cls, record):
+    return cls(record['key'], record['model'], record.get('prompt', ''), [tuple(c) for c in record['chunks']], record.get('usage'))
+
+  def as_dict(self):
+    return {'key': self.key, 'model': self.model, 'prompt': self.prompt, 'chunks': self.chunks, 'usage': self.usage}
+
+  def replay(self, time_scale=1.0):
+    """(delay in seconds, chunk) pairs, with usage_metadata on the last chunk"""
+    usage = types.GenerateContentResponseUsageMetadata(**self.usage) if self.usage else None
+    last = len(self.chunks) - 1
+    return [
+      (delay * time_scale, FakeChunk(text, usage if i == last else None))
+      for i, (delay, text) in enumerate(self.chunks)
+    ]
+
+class Recorder:
+  """Collects a live stream's chunks and timing into a Cassette"""
+
+  def __init__(self, key, model, contents):
+    self.key = key
+    self.model = model
+    self.prompt = _preview(contents)
+    self.chunks = []
+    self.usage = None
+    self.last = time.monotonic()
+
+  def add(self, chunk):
+    now = time.monotonic()
+    self.chunks.append((round(now - self.last, 4), chunk.text or ''))
+    self.last = now
+    if chunk.usage_metadata is not None:
+      self.usage = chunk.usage_metadata.model_dump(mode='json', exclude_none=True)
+
+  def cassette(self):
+    return Cassette(self.key, self.model, self.prompt, self.chunks, self.usage)
+
+class CassetteStore:
+  """Recorded upstream streams in one JSONL file, gzipped when the path ends in .gz.
+
+  Recordings are appended as streams complete; a later recording of the
+  same request replaces an earlier one when the file is loaded.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.cassettes = {}
+    self.lock = threading.Lock()
+    if os.path.exists(path):
+      with self._open('rt') as handle:
+        for line in handle:
+          if line.strip():
+            cassette = Cassette.from_dict(json.loads(line))
+            self.cassettes[cassette.key] = cassette
+
+  def _open(self, mode):
+    if self.path.endswith('.gz'):
+      return gzip.open(self.path, mode, encoding='utf-8')
+    return open(self.path, mode, encoding='utf-8')
+
+  def __len__(self):
+    return len(self.cassettes)
+
+  def get(self, key):
+    return self.cassettes.get(key)
+
+  def save(self, cassette):
+    line = json.dumps(cassette.as_dict(), separators=(',', ':')) + '\n'
+    with self.lock:
+      self.cassettes[cassette.key] = cassette
+      directory = os.path.dirname(self.path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      with self._open('at') as handle:
+        handle.write(line)
+
+class RecordingModels:
+  """Wraps a `client.models` and saves every completed stream to the store"""
+
+  def __init__(self, models, store):
+    self.models = models
+    self.store = store
+
+  def generate_content(self, model, contents, config=None):
+    recorder = Recorder(request_key(model, contents, config), model, contents)
+    response = self.models.generate_content(model=model, contents=contents, config=config)
+    recorder.add(response)
+    self.store.save(recorder.cassette())
+    return response
+
+  def generate_content_stream(self, model, contents, config=None):
+    recorder = Recorder(request_key(model, contents, config), model, contents)
+    return self._record(recorder, self.models.generate_content_stream(model=model, contents=contents, config=config))
+
+  def _record(self, recorder, stream):
+    for chunk in stream:
+      recorder.add(chunk)
+      yield chunk
+    self.store.save(recorder.cassette())
+
+class RecordingAsyncModels(RecordingModels):
+  """Wraps a `client.aio.models`"""
+
+  async def generate_content_stream(self, model, contents, config=None):
+    recorder = Recorder(request_key(model, contents, config), model, contents)
+    stream = await self.models.generate_content_stream(model=model, contents=contents, config=config)
+    return self._arecord(recorder, stream)
+
+  async def _arecord(self, recorder, stream):
+    async for chunk in stream:
+      recorder.add(chunk)
+      yield chunk
+    self.store.save(recorder.cassette())
+
+class RecordingAio:
+  def __init__(self, aio, store):
+    self.models = RecordingAsyncModels(aio.models, store)
+
+class RecordingClient:
+  """A client that records its upstream streams; everything else passes through"""
+
+  def __init__(self, client, store):
+    self.client = client
+    self.models = RecordingModels(client.models, store)
+    self.aio = RecordingAio(client.aio, store)
+
+  def __getattr__(self, name):
+    return getattr(self.client, name)
+
+class ReplayModels(FakeModels):
+  """Blocking `client.models` that streams recordings back instead of calling upstream"""
+
+  def __init__(self, store, time_scale=1.0, cache_backend=None):
+    super().__init__(None, cache_backend)
+    self.store = store
+    self.time_scale = time_scale
+
+  def lookup(self, model, contents, config):
+    self.resolve_cached(config)
+    cassette = self.store.get(request_key(model, contents, config))
+    if cassette is None:
+      raise CassetteMissing(f"No recording for {model} request {_preview(contents)!r}")
+    return cassette.replay(self.time_scale)
+
+  def generate_content(self, model, contents, config=None):
+    chunks = self.lookup(model, contents, config)
+    time.sleep(sum(delay for delay, _ in chunks))
+    text = ''.join(chunk.text for _, chunk in chunks)
+    return FakeChunk(text, chunks[-1][1].usage_metadata if chunks else None)
+
+  def generate_content_stream(self, model, contents, config=None):
+    chunks = self.lookup(model, contents, config)
+    for delay, chunk in chunks:
+      if delay:
+        time.sleep(delay)
+      yield chunk
+
+class ReplayAsyncModels(ReplayModels):
+  """Asyncio `client.aio.models` counterpart of ReplayModels"""
+
+  async def generate_content_stream(self, model, contents, config=None):
+    chunks = self.lookup(model, contents, config)
+
+    async def stream():
+      for delay, chunk in chunks:
+        if delay:
+          await asyncio.sleep(delay)
+        yield chunk
+
+    return stream()
+
+class ReplayAio:
+  def __init__(self, store, time_scale, cache_backend):
+    self.models = ReplayAsyncModels(store, time_scale, cache_backend)
+
+class ReplayClient:
+  """Offline `genai.Client` stand-in serving recorded streams with original or scaled timing"""
+
+  def __init__(self, store, time_scale=1.0, cache_backend=None):
+    self.store = store
+    self.models = ReplayModels(store, time_scale, cache_backend)
+    self.aio = ReplayAio(store, time_scale, cache_backend)
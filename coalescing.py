@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+class SharedStream:
+  """One upstream stream fanned out to every request with the same key.
+
+  A producer publishes chunks and then closes the stream, with an error if
+  the upstream failed. Each subscriber first replays the chunks already
+  produced and then waits for live ones, from a thread (`iterate`) or from
+  an event loop (`aiterate`). Once every subscriber has left, `cancelled`
+  tells the producer it may stop reading from upstream (see
+  RequestCoalescer.abandon).
+  """
+
+  def __init__(self, key):
+    self.key = key
+    self.chunks = []
+    self.done = False
+    self.error = None
+    self.subscribers = 0
+    self.condition = threading.Condition()
+    self.async_waiters = set()
+
+  @property
+  def cancelled(self):
+    return self.subscribers == 0
+
+  def subscribe(self):
+    with self.condition:
+      self.subscribers += 1
+
+  def unsubscribe(self):
+    with self.condition:
+      self.subscribers -= 1
+
+  def publish(self, chunk):
+    with self.condition:
+      self.chunks.append(chunk)
+      self._wake()
+
+  def close(self, error=None):
+    with self.condition:
+      self.done = True
+      self.error = error
+      self._wake()
+
+  def _wake(self):
+    self.condition.notify_all()
+    for loop, event in list(self.async_waiters):
+      loop.call_soon_threadsafe(event.set)
+
+  def iterate(self, idle_seconds=None):
+    """Yield every chunk; raises the producer's error at the end.
+
+    With `idle_seconds`, also yields None whenever that long passes without
+    a chunk, so the subscriber can write heartbeats while it waits.
+    """
+    index = 0
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: index < len(self.chunks) or self.done, timeout=idle_seconds)
+        pending = self.chunks[index:]
+        done, error = self.done, self.error
+      if not pending and not done:
+        yield None
+        continue
+      for chunk in pending:
+        yield chunk
+      index += len(pending)
+      if done and index >= len(self.chunks):
+        if error is not None:
+          raise error
+        return
+
+  async def aiterate(self):
+    """Async twin of `iterate` for subscribers on an event loop"""
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    self.async_waiters.add(waiter)
+    try:
+      index = 0
+      while True:
+        with self.condition:
+          waiter[1].clear()
+          pending = self.chunks[index:]
+          done, error = self.done, self.error
+        for chunk in pending:
+          yield chunk
+        index += len(pending)
+        if done and index >= len(self.chunks):
+          if error is not None:
+            raise error
+          return
+        if not pending:
+          await waiter[1].wait()
+    finally:
+      self.async_waiters.discard(waiter)
+
+class RequestCoalescer:
+  """In-flight upstream streams by request key.
+
+  `join` returns the live SharedStream for a key and whether the caller is
+  its leader, the one that must start the producer. Producers call
+  `release` when the upstream stream ends; later requests with the same
+  key start a new stream (or hit the response cache).
+  """
+
+  def __init__(self):
+    self.streams = {}
+    self.lock = threading.Lock()
+
+  def join(self, key):
+    with self.lock:
+      shared = self.streams.get(key)
+      leader = shared is None
+      if leader:
+        shared = self.streams[key] = SharedStream(key)
+      shared.subscribe()
+    return shared, leader
+
+  def abandon(self, shared):
+    """Drop a stream nobody is reading; False if someone joined meanwhile"""
+    with self.lock:
+      if shared.subscribers:
+        return False
+      if self.streams.get(shared.key) is shared:
+        del self.streams[shared.key]
+      return True
+
+  def release(self, shared):
+    with self.lock:
+      if self.streams.get(shared.key) is shared:
+        del self.streams[shared.key]
@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+import uuid
+
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+class CachedPrefix:
+  """A registered cached prefix: backend name, model and expiry (epoch seconds)"""
+
+  def __init__(self, name, model, version, expires_at):
+    self.name = name
+    self.model = model
+    self.version = version
+    self.expires_at = expires_at
+
+  def remaining(self, now=None):
+    return self.expires_at - (time.time() if now is None else now)
+
+class GenaiCacheBackend:
+  """Context cache backend using the google-genai `client.caches` API"""
+
+  def __init__(self, client):
+    self.client = client
+
+  def create(self, model, contents, ttl_seconds, display_name):
+    cached = self.client.caches.create(
+      model=model,
+      config=types.CreateCachedContentConfig(
+        contents=contents,
+        ttl=f"{int(ttl_seconds)}s",
+        display_name=display_name,
+      ),
+    )
+    return cached.name, _expire_epoch(cached.expire_time, ttl_seconds)
+
+  def refresh(self, name, ttl_seconds):
+    cached = self.client.caches.update(
+      name=name,
+      config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_seconds)}s"),
+    )
+    return _expire_epoch(cached.expire_time, ttl_seconds)
+
+  def delete(self, name):
+    self.client.caches.delete(name=name)
+
+class InMemoryCacheBackend:
+  """Local stand-in for the caching API, for development and offline runs.
+
+  Keeps cached contents in a dict so a fake upstream can resolve a
+  `cached_content` name back to the prefix it stands for.
+  """
+
+  def __init__(self):
+    self.entries = {}
+    self.lock = threading.Lock()
+
+  def create(self, model, contents, ttl_seconds, display_name):
+    name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+    expires_at = time.time() + ttl_seconds
+    with self.lock:
+      self.entries[name] = (contents, expires_at)
+    return name, expires_at
+
+  def refresh(self, name, ttl_seconds):
+    with self.lock:
+      if name not in self.entries:
+        raise KeyError(f"Cached content {name} not found")
+      contents, _ = self.entries[name]
+      expires_at = time.time() + ttl_seconds
+      self.entries[name] = (contents, expires_at)
+    return expires_at
+
+  def delete(self, name):
+    with self.lock:
+      self.entries.pop(name, None)
+
+  def resolve(self, name):
+    """Return the cached contents for name, or None if missing or expired"""
+    with self.lock:
+      entry = self.entries.get(name)
+    if entry is None or entry[1] <= time.time():
+      return None
+    return entry[0]
+
+class ContextCache:
+  """Keeps one cached copy of the static prompt prefix per model.
+
+  `get(model)` returns the cached content name to reference from
+  GenerateContentConfig, or None when the caller should send the prompt
+  inline. The cache is refreshed once its remaining TTL drops under
+  `refresh_margin`; only one request does the refresh while the others keep
+  using the still-valid name. Failed creations back off for
+  `retry_after` seconds so an unavailable caching API does not add a round
+  trip to every request.
+  """
+
+  def __init__(self, backend, build_contents, version, ttl_seconds=3600,
+               refresh_margin=300, retry_after=60):
+    self.backend = backend
+    self.build_contents = build_contents
+    self.version = version
+    self.ttl_seconds = ttl_seconds
+    self.refresh_margin = refresh_margin
+    self.retry_after = retry_after
+    self.prefixes = {}
+    self.failed_at = {}
+    self.lock = threading.Lock()
+    self.refreshing = set()
+
+  def get(self, model):
+    """Return a valid cached content name for model, or None"""
+    now = time.time()
+    prefix = self.prefixes.get(model)
+
+    if prefix and prefix.version == self.version and prefix.remaining(now) > self.refresh_margin:
+      return prefix.name
+
+    if prefix and prefix.version == self.version and prefix.remaining(now) > 0:
+      # Still valid: refresh it if nobody else is, otherwise keep using it
+      with self.lock:
+        if model in self.refreshing:
+          return prefix.name
+        self.refreshing.add(model)
+      try:
+        return self._refresh(model, prefix)
+      finally:
+        with self.lock:
+          self.refreshing.discard(model)
+
+    with self.lock:
+      if now - self.failed_at.get(model, 0) < self.retry_after:
+        return None
+      prefix = self.prefixes.get(model)
+      if prefix and prefix.version == self.version and prefix.remaining(now) > 0:
+        return prefix.name
+      return self._create(model)
+
+  def invalidate(self, model, name=None):
+    """Forget the cached prefix for model (e.g. after a cache-miss error)"""
+    with self.lock:
+      prefix = self.prefixes.get(model)
+      if prefix and (name is None or prefix.name == name):
+        del self.prefixes[model]
+        logger.info(f"Context cache invalidated for {model}: {prefix.name}")
+
+  def set_version(self, build_contents, version):
+    """Point the cache at new prompt contents; old prefixes are replaced lazily"""
+    with self.lock:
+      self.build_contents = build_contents
+      self.version = version
+      self.failed_at.clear()
+
+  def _create(self, model):
+    try:
+      name, expires_at = self.backend.create(
+        model, self.build_contents(), self.ttl_seconds, f"optum-faq-{self.version}"
+      )
+    except Exception as e:
+      self.failed_at[model] = time.time()
+      logger.warning(f"Context cache creation failed for {model}, sending prompt inline: {str(e)}")
+      return None
+
+    old = self.prefixes.get(model)
+    self.prefixes[model] = CachedPrefix(name, model, self.version, expires_at)
+    logger.info(f"Context cache created for {model}: {name} (TTL {self.ttl_seconds}s)")
+    if old and old.name != name:
+      self._delete_quietly(old.name)
+    return name
+
+  def _refresh(self, model, prefix):
+    try:
+      prefix.expires_at = self.backend.refresh(prefix.name, self.ttl_seconds)
+      logger.info(f"Context cache refreshed for {model}: {prefix.name}")
+      return prefix.name
+    except Exception as e:
+      logger.warning(f"Context cache refresh failed for {model}, recreating: {str(e)}")
+      with self.lock:
+        return self._create(model)
+
+  def _delete_quietly(self, name):
+    try:
+      self.backend.delete(name)
+    except Exception as e:
+      logger.debug(f"Could not delete old cached content {name}: {str(e)}")
+
+def is_cache_error(exc):
+  """True when an upstream error means the referenced cached content is gone"""
+  if isinstance(exc, errors.APIError):
+    return exc.code == 404 or 'cache' in (exc.message or '').lower()
+  return 'cachedcontent' in str(exc).lower().replace(' ', '')
+
+def _expire_epoch(expire_time, ttl_seconds):
+  if expire_time is not None:
+    return expire_time.timestamp()
+  return time.time() + ttl_seconds
@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+# Marks where an oversized message was cut
+TRUNCATION_MARKER = "\n[... message truncated ...]\n"
+
+# Rough per-message cost of role and turn framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# The conversation window sent upstream and how it was packed; `start` is the
+# index of its first message in the full conversation
+Window = namedtuple('Window', ['messages', 'tokens', 'budget', 'dropped', 'truncated', 'start'])
+
+class ContextWindow:
+  """Packs the most recent conversation turns into a token budget.
+
+  The latest user turn is always kept; older turns are added newest first
+  while they fit, and the window never starts on a model turn. A single
+  message over `max_message_tokens` keeps its beginning and end around a
+  truncation marker. `count_tokens` should be a fast local counter.
+  """
+
+  def __init__(self, count_tokens, budget=2000, max_message_tokens=None):
+    self.count_tokens = count_tokens
+    self.budget = budget
+    self.max_message_tokens = max_message_tokens or budget // 2
+
+  def message_tokens(self, message):
+    return self.count_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+  def truncate(self, message, limit):
+    """Copy of message cut to about `limit` tokens, keeping its start and end"""
+    content = message.get('content', '')
+    tokens = self.count_tokens(content)
+    keep = max(0, int(len(content) * (limit - MESSAGE_OVERHEAD_TOKENS) / max(tokens, 1) * 0.95) - len(TRUNCATION_MARKER))
+    head = keep * 2 // 3
+    tail = keep - head
+    content = content[:head] + TRUNCATION_MARKER + (content[-tail:] if tail else '')
+    return dict(message, content=content)
+
+  def fit(self, message, limit):
+    """(message, tokens, truncated) with message cut down to limit if needed"""
+    tokens = self.message_tokens(message)
+    if tokens <= limit:
+      return message, tokens, False
+    message = self.truncate(message, limit)
+    return message, self.message_tokens(message), True
+
+  def select(self, messages, reserve=0):
+    """Window of `messages` that fits the budget less `reserve` tokens"""
+    budget = self.budget - reserve
+    if not messages:
+      return Window([], 0, budget, 0, 0, 0)
+
+    # The window ends on the latest user turn
+    last = len(messages) - 1
+    while last > 0 and messages[last].get('role') != 'user':
+      last -= 1
+
+    latest, used, cut = self.fit(messages[last], min(self.max_message_tokens, budget))
+    window = [latest]
+    truncated = int(cut)
+
+    for message in reversed(messages[:last]):
+      remaining = budget - used
+      if remaining <= MESSAGE_OVERHEAD_TOKENS:
+        break
+      message, tokens, cut = self.fit(message, min(self.max_message_tokens, remaining))
+      if tokens > remaining:
+        break
+      window.append(message)
+      used += tokens
+      truncated += cut
+
+    window.reverse()
+    while len(window) > 1 and window[0].get('role') != 'user':
+      used -= self.message_tokens(window.pop(0))
+
+    return Window(window, used, budget, len(messages) - len(window), truncated, last - len(window) + 1)
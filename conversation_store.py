@@ -0,0 +1,177 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class ConversationNotFound(KeyError):
+  """The conversation_id is unknown or its conversation has expired"""
+
+class Conversation:
+  """Stored turns of one conversation and when it was last used"""
+
+  def __init__(self, messages, last_used):
+    self.messages = messages
+    self.last_used = last_used
+
+def stored_message(message):
+  """The parts of a chat message worth keeping: role and content"""
+  return {'role': message.get('role', 'user'), 'content': message.get('content', '')}
+
+class ConversationStore:
+  """Conversation histories by id, so clients can send only the new turn.
+
+  Histories live in a bounded LRU in memory and, with `db_path`, in SQLite
+  so they survive restarts and LRU eviction. Conversations idle for longer
+  than `idle_ttl` seconds are dropped from both. Only the last
+  `max_messages` turns of a conversation are kept.
+  """
+
+  def __init__(self, max_conversations=10000, idle_ttl=7200, max_messages=500, db_path=None):
+    self.max_conversations = max_conversations
+    self.idle_ttl = idle_ttl
+    self.max_messages = max_messages
+    self.conversations = OrderedDict()
+    self.lock = threading.Lock()
+    self.last_sweep = time.time()
+    self.db = None
+    if db_path:
+      directory = os.path.dirname(db_path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+      self.db.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        CREATE TABLE IF NOT EXISTS conversations (
+          id TEXT PRIMARY KEY,
+          updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+          conversation_id TEXT NOT NULL,
+          seq INTEGER NOT NULL,
+          role TEXT NOT NULL,
+          content TEXT NOT NULL,
+          PRIMARY KEY (conversation_id, seq)
+        );
+      """)
+
+  @staticmethod
+  def new_id():
+    return uuid.uuid4().hex
+
+  def get(self, conversation_id):
+    """Copy of the stored messages; raises ConversationNotFound"""
+    now = time.time()
+    with self.lock:
+      conversation = self.conversations.get(conversation_id)
+      if conversation is None and self.db is not None:
+        conversation = self._load(conversation_id)
+        if conversation is not None:
+          self.conversations[conversation_id] = conversation
+      if conversation is None or now - conversation.last_used > self.idle_ttl:
+        raise ConversationNotFound(conversation_id)
+      conversation.last_used = now
+      self.conversations.move_to_end(conversation_id)
+      return list(conversation.messages)
+
+  def append(self, conversation_id, messages):
+    """Add new turns to a conversation, creating it if needed"""
+    messages = [stored_message(msg) for msg in messages]
+    now = time.time()
+    with self.lock:
+      conversation = self.conversations.get(conversation_id)
+      if conversation is None:
+        # Evicted from memory since it was read: append to the persisted
+        # turns rather than writing over them from seq 0
+        conversation = self._load(conversation_id) if self.db is not None else None
+        if conversation is None or now - conversation.last_used > self.idle_ttl:
+          conversation = Conversation([], now)
+        self.conversations[conversation_id] = conversation
+      start = len(conversation.messages)
+      conversation.messages.extend(messages)
+      trimmed = max(0, len(conversation.messages) - self.max_messages)
+      del conversation.messages[:trimmed]
+      conversation.last_used = now
+      self.conversations.move_to_end(conversation_id)
+      if self.db is not None:
+        if trimmed or not start:
+          self._write(conversation_id, conversation.messages, 0, now)
+        else:
+          self._write(conversation_id, messages, start, now, replace=False)
+      self._evict(now)
+
+  def put(self, conversation_id, messages):
+    """Replace a conversation's history"""
+    messages = [stored_message(msg) for msg in messages[-self.max_messages:]]
+    now = time.time()
+    with self.lock:
+      self.conversations[conversation_id] = Conversation(messages, now)
+      self.conversations.move_to_end(conversation_id)
+      if self.db is not None:
+        self._write(conversation_id, messages, 0, now)
+      self._evict(now)
+
+  def _evict(self, now):
+    while len(self.conversations) > self.max_conversations:
+      self.conversations.popitem(last=False)
+    # The LRU front is the longest idle; sweep it (and SQLite) once a minute
+    if now - self.last_sweep < 60:
+      return
+    self.last_sweep = now
+    cutoff = now - self.idle_ttl
+    while self.conversations:
+      conversation_id, conversation = next(iter(self.conversations.items()))
+      if conversation.last_used > cutoff:
+        break
+      self.conversations.popitem(last=False)
+    if self.db is not None:
+      self.db.execute(
+        "DELETE FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE updated_at <= ?)", (cutoff,)
+      )
+      self.db.execute("DELETE FROM conversations WHERE updated_at <= ?", (cutoff,))
+
+  def _load(self, conversation_id):
+    row = self.db.execute("SELECT updated_at FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+    if row is None:
+      return None
+    messages = [
+      {'role': role, 'content': content}
+      for role, content in self.db.execute(
+        "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+      )
+    ]
+    return Conversation(messages, row[0])
+
+  def _write(self, conversation_id, messages, start, now, replace=True):
+    try:
+      self.db.execute("BEGIN")
+      if replace:
+        self.db.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+      self.db.executemany(
+        "INSERT OR REPLACE INTO messages (conversation_id, seq, role, content) VALUES (?, ?, ?, ?)",
+        [(conversation_id, start + i, msg['role'], msg['content']) for i, msg in enumerate(messages)],
+      )
+      self.db.execute(
+        "INSERT OR REPLACE INTO conversations (id, updated_at) VALUES (?, ?)", (conversation_id, now)
+      )
+      self.db.execute("COMMIT")
+    except sqlite3.Error as e:
+      self.db.execute("ROLLBACK")
+      logger.error("Could not persist conversation %s: %s", conversation_id, e)
+
+def conversation_store_from_env():
+  """ConversationStore configured from CONVERSATION_* variables, or None if disabled"""
+  size = int(os.getenv('CONVERSATION_STORE_SIZE', '10000'))
+  if size <= 0:
+    return None
+  return ConversationStore(
+    max_conversations=size,
+    idle_ttl=int(os.getenv('CONVERSATION_IDLE_TTL_SECONDS', '7200')),
+    max_messages=int(os.getenv('CONVERSATION_MAX_MESSAGES', '500')),
+    db_path=os.getenv('CONVERSATION_DB_PATH') or None,
+  )
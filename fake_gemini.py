@@ -0,0 +1,238 @@
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+
+from google.genai import errors, types
+
+from token_usage import estimate_tokens
+
+# Canned answer streamed back by the fake, split into chunks of `words_per_chunk`
+DEFAULT_ANSWER = (
+  "Employees who are regular and currently participating in the Voluntary "
+  "Contributions of the Retirement Fund can apply for the Member Loan through "
+  "the Loan tab of the retirement portal. You will need to upload a signed "
+  "Promissory Note, which you can download from the same tab."
+)
+
+# What a model in `refusing_models` answers instead
+REFUSAL_ANSWER = "I'm sorry, I don't know the answer to that question."
+
+class Distribution:
+  """A delay distribution in seconds, parsed from specs such as:
+
+    0.5                 fixed
+    uniform:0.2,0.8     uniform between low and high
+    normal:0.5,0.1      mean and standard deviation (clipped at 0)
+    lognormal:0.5,0.4   median and sigma of the underlying normal
+    exponential:0.5     mean
+  """
+
+  KINDS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+  def __init__(self, kind, *params):
+    if kind not in self.KINDS:
+      raise ValueError(f"Unknown distribution {kind!r}, expected one of {', '.join(self.KINDS)}")
+    self.kind = kind
+    self.params = tuple(float(p) for p in params)
+
+  @classmethod
+  def parse(cls, spec):
+    if isinstance(spec, Distribution):
+      return spec
+    if isinstance(spec, (int, float)):
+      return cls('fixed', spec)
+    kind, _, params = str(spec).partition(':')
+    if not params:
+      return cls('fixed', kind)
+    return cls(kind, *params.split(','))
+
+  def sample(self, rng):
+    p = self.params
+    if self.kind == 'fixed':
+      return p[0]
+    if self.kind == 'uniform':
+      return rng.uniform(p[0], p[1])
+    if self.kind == 'normal':
+      return max(0.0, rng.gauss(p[0], p[1]))
+    if self.kind == 'lognormal':
+      return rng.lognormvariate(math.log(p[0]), p[1])
+    return rng.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+
+  def __repr__(self):
+    return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+class FakeChunk:
+  """Mimics the parts of GenerateContentResponse that app.py reads"""
+
+  def __init__(self, text, usage_metadata=None):
+    self.text = text
+    self.usage_metadata = usage_metadata
+
+class FakeStreamProfile:
+  """Timing, content and failure behaviour of a fake stream.
+
+  `ttft` is a number of seconds or a Distribution spec. Chunks are
+  `words_per_chunk` words apart by `chunk_interval` seconds, or paced at
+  `tokens_per_second` when that is set. A fraction `error_rate` of calls
+  fail with a 503 before the first chunk, and a fraction `stall_rate` hang
+  for `stall_seconds` before it. Calls to a model in `failing_models`
+  always fail with a 503, and a model in `refusing_models` answers with a
+  refusal. `seed` makes the sampled delays and failures reproducible.
+  """
+
+  def __init__(self, ttft=0.5, chunk_interval=0.05, words_per_chunk=3, answer=DEFAULT_ANSWER,
+               tokens_per_second=None, error_rate=0.0, seed=None, stall_rate=0.0, stall_seconds=60.0,
+               failing_models=(), refusing_models=()):
+    self.ttft = Distribution.parse(ttft)
+    self.chunk_interval = chunk_interval
+    self.words_per_chunk = words_per_chunk
+    self.answer = answer
+    self.tokens_per_second = tokens_per_second
+    self.error_rate = error_rate
+    self.stall_rate = stall_rate
+    self.stall_seconds = stall_seconds
+    self.failing_models = set(failing_models)
+    self.refusing_models = set(refusing_models)
+    self.rng = random.Random(seed)
+    self.lock = threading.Lock()
+
+  @classmethod
+  def from_env(cls):
+    """Profile configured from the FAKE_GEMINI_* environment variables"""
+    tokens_per_second = os.getenv('FAKE_GEMINI_TOKENS_PER_SECOND')
+    seed = os.getenv('FAKE_GEMINI_SEED')
+    return cls(
+      ttft=os.getenv('FAKE_GEMINI_TTFT', '0.5'),
+      chunk_interval=float(os.getenv('FAKE_GEMINI_CHUNK_INTERVAL', '0.05')),
+      words_per_chunk=int(os.getenv('FAKE_GEMINI_WORDS_PER_CHUNK', '3')),
+      tokens_per_second=float(tokens_per_second) if tokens_per_second else None,
+      error_rate=float(os.getenv('FAKE_GEMINI_ERROR_RATE', '0')),
+      seed=int(seed) if seed else None,
+      stall_rate=float(os.getenv('FAKE_GEMINI_STALL_RATE', '0')),
+      stall_seconds=float(os.getenv('FAKE_GEMINI_STALL_SECONDS', '60')),
+      failing_models=[m for m in os.getenv('FAKE_GEMINI_FAILING_MODELS', '').split(',') if m],
+      refusing_models=[m for m in os.getenv('FAKE_GEMINI_REFUSING_MODELS', '').split(',') if m],
+    )
+
+  def plan(self, model=None):
+    """Sample one call to model: (time to first chunk, whether it fails)"""
+    with self.lock:
+      ttft = self.ttft.sample(self.rng)
+      fails = self.error_rate > 0 and self.rng.random() < self.error_rate
+      if self.stall_rate > 0 and self.rng.random() < self.stall_rate:
+        ttft += self.stall_seconds
+    return ttft, fails or model in self.failing_models
+
+  def chunk_delay(self, text):
+    if self.tokens_per_second:
+      return estimate_tokens(text) / self.tokens_per_second
+    return self.chunk_interval
+
+  def chunks(self, contents=(), cached_contents=(), model=None):
+    answer = REFUSAL_ANSWER if model in self.refusing_models else self.answer
+    words = answer.split(' ')
+    texts = [
+      ' '.join(words[i:i + self.words_per_chunk]) + ' '
+      for i in range(0, len(words), self.words_per_chunk)
+    ]
+    cached_tokens = _count_tokens(cached_contents)
+    usage = types.GenerateContentResponseUsageMetadata(
+      prompt_token_count=cached_tokens + _count_tokens(contents),
+      cached_content_token_count=cached_tokens or None,
+      candidates_token_count=estimate_tokens(answer),
+    )
+    return [FakeChunk(text, usage if i == len(texts) - 1 else None) for i, text in enumerate(texts)]
+
+# Canned reply to non-streaming calls such as conversation summaries
+DEFAULT_SUMMARY = (
+  "The employee is a regular employee in the Voluntary Contributions program "
+  "and asked how to apply for the Member Loan; the Loan tab and the signed "
+  "Promissory Note were explained."
+)
+
+def _count_tokens(contents):
+  return sum(estimate_tokens(part.text or '') for content in contents for part in (content.parts or []))
+
+def _unavailable():
+  return errors.ServerError(503, {'error': {'code': 503, 'message': 'Fake upstream overloaded', 'status': 'UNAVAILABLE'}})
+
+def _cache_not_found(name):
+  return errors.ClientError(404, {'error': {'code': 404, 'message': f'Cached content {name} not found', 'status': 'NOT_FOUND'}})
+
+class FakeModels:
+  """Blocking `client.models` stand-in"""
+
+  def __init__(self, profile, cache_backend=None):
+    self.profile = profile
+    self.cache_backend = cache_backend
+
+  def resolve_cached(self, config):
+    """Contents of the cached prefix referenced by config, if any"""
+    name = getattr(config, 'cached_content', None)
+    if not name:
+      return ()
+    contents = self.cache_backend.resolve(name) if self.cache_backend else None
+    if contents is None:
+      raise _cache_not_found(name)
+    return contents
+
+  def generate_content(self, model, contents, config=None):
+    ttft, fails = self.profile.plan(model)
+    time.sleep(ttft)
+    if fails:
+      raise _unavailable()
+    usage = types.GenerateContentResponseUsageMetadata(
+      prompt_token_count=_count_tokens(contents),
+      candidates_token_count=estimate_tokens(DEFAULT_SUMMARY),
+    )
+    return FakeChunk(DEFAULT_SUMMARY, usage)
+
+  def generate_content_stream(self, model, contents, config=None):
+    profile = self.profile
+    cached_contents = self.resolve_cached(config)
+    ttft, fails = profile.plan(model)
+    time.sleep(ttft)
+    if fails:
+      raise _unavailable()
+    for i, chunk in enumerate(profile.chunks(contents, cached_contents, model)):
+      if i:
+        time.sleep(profile.chunk_delay(chunk.text))
+      yield chunk
+
+class FakeAsyncModels(FakeModels):
+  """Asyncio `client.aio.models` stand-in"""
+
+  async def generate_content_stream(self, model, contents, config=None):
+    profile = self.profile
+    cached_contents = self.resolve_cached(config)
+    ttft, fails = profile.plan(model)
+
+    async def stream():
+      await asyncio.sleep(ttft)
+      if fails:
+        raise _unavailable()
+      for i, chunk in enumerate(profile.chunks(contents, cached_contents, model)):
+        if i:
+          await asyncio.sleep(profile.chunk_delay(chunk.text))
+        yield chunk
+
+    return stream()
+
+class FakeAio:
+  def __init__(self, profile, cache_backend=None):
+    self.models = FakeAsyncModels(profile, cache_backend)
+
+class FakeClient:
+  """Offline stand-in for `genai.Client` that streams a canned answer.
+
+  Pass the InMemoryCacheBackend used by the context cache so that
+  `cached_content` references resolve (and expire) like the real API's.
+  """
+
+  def __init__(self, profile=None, cache_backend=None):
+    self.profile = profile or FakeStreamProfile()
+    self.models = FakeModels(self.profile, cache_backend)
+    self.aio = FakeAio(self.profile, cache_backend)
@@ -0,0 +1,92 @@
+import re
+
+import numpy as np
+
+from retrieval import tokenize
+
+# Negations flip a question's meaning but barely move its similarity score
+NEGATION_PATTERN = re.compile(r"\b(?:not|no|never|cannot|without)\b|n['\u2019]t\b")
+
+def has_negation(text):
+  return NEGATION_PATTERN.search(text.lower()) is not None
+
+def features(text):
+  """Heading/question features: normalized terms plus adjacent-term bigrams"""
+  terms = tokenize(text)
+  return terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+
+class FaqMatcher:
+  """Matches a question to the FAQ heading it restates.
+
+  Headings are TF-IDF vectors in a precomputed, L2-normalized NumPy matrix,
+  so matching a question is one matrix-vector product of cosine
+  similarities. Question terms that appear in no heading still count
+  towards its norm, which keeps long or off-topic questions below the
+  threshold. `match` returns the best section only when it scores at least
+  `threshold` and beats the runner-up by `margin`, and never when the
+  question is negated ("can I not cancel ...") but the heading is not.
+  """
+
+  def __init__(self, sections, threshold=0.8, margin=0.1, words_per_chunk=8):
+    self.sections = list(sections)
+    self.threshold = threshold
+    self.margin = margin
+    self.words_per_chunk = words_per_chunk
+
+    heading_features = [features(section.heading) for section in self.sections]
+    self.negated = [has_negation(section.heading) for section in self.sections]
+    vocabulary = sorted({f for fs in heading_features for f in fs})
+    self.vocabulary = {f: i for i, f in enumerate(vocabulary)}
+
+    doc_freq = np.zeros(len(vocabulary), dtype=np.float32)
+    for fs in heading_features:
+      for f in set(fs):
+        doc_freq[self.vocabulary[f]] += 1
+    self.idf = np.log((1 + len(self.sections)) / (1 + doc_freq)) + 1
+    self.unknown_idf = float(self.idf.max()) if len(vocabulary) else 1.0
+
+    self.matrix = np.zeros((len(self.sections), len(vocabulary)), dtype=np.float32)
+    for row, fs in enumerate(heading_features):
+      for f in fs:
+        self.matrix[row, self.vocabulary[f]] += 1
+    self.matrix *= self.idf
+    norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+    self.matrix /= np.where(norms > 0, norms, 1)
+
+    # Answers are pre-split into stream chunks
+    self.answers = [self.chunk(section.body) for section in self.sections]
+
+  def chunk(self, text):
+    words = text.split(' ')
+    n = self.words_per_chunk
+    return [' '.join(words[i:i + n]) + (' ' if i + n < len(words) else '') for i in range(0, len(words), n)]
+
+  def scores(self, question):
+    """Cosine similarity of the question to every heading"""
+    query = np.zeros(len(self.vocabulary), dtype=np.float32)
+    unknown = 0.0
+    for f in features(question):
+      i = self.vocabulary.get(f)
+      if i is None:
+        unknown += self.unknown_idf ** 2
+      else:
+        query[i] += 1
+    query *= self.idf
+    norm = np.sqrt(float(query @ query) + unknown)
+    if norm == 0:
+      return np.zeros(len(self.sections), dtype=np.float32)
+    return self.matrix @ (query / norm)
+
+  def match(self, question):
+    """(section, score) of the heading the question restates, or None"""
+    if not self.sections:
+      return None
+    scores = self.scores(question)
+    best = int(np.argmax(scores))
+    score = float(scores[best])
+    runner_up = float(np.partition(scores, -2)[-2]) if len(scores) > 1 else 0.0
+    if score < self.threshold or score - runner_up < self.margin:
+      return None
+    if has_negation(question) and not self.negated[best]:
+      return None
+    return self.sections[best], score
@@ -0,0 +1,261 @@
+import hashlib
+import re
+from collections import namedtuple
+
+# Instructions that frame every conversation with the Retirement Specialist
+SYSTEM_INSTRUCTIONS = """You are Optum's Retirement Specialist, an AI assistant designed to help employees with retirement questions and concerns. You should:
+1. Provide accurate, concise, and helpful information about retirement policies, benefits, and procedures.  **Focus on the Philippine market.**
+2. Be professional, empathetic, and supportive.  Do not expand the explanation beyond 100 words.  Wait for the user to ask for more information.
+3. Guide employees to the right resources when needed
+4. Use the information in the KNOWLEDGE_BASE to answer questions.
+"""
+
+# Optum retirement FAQ, one `###` section per question
+KNOWLEDGE_BASE = """## Optum Retirement FAQ
+
+### How often can I use the Individual Retirement Account online service?
+
+You can use and access your Individual Retirement Account anytime at your convenience. Contributions will be posted twice a month (15th and 30th) within twenty business days from deduction, and Gain/(Loss) shall be posted once a month.
+
+### Will I receive paper statements?
+
+Employees will no longer receive paper statements. All information can already be viewed anytime through the portal.
+
+### How can I confirm that a contribution was made?
+
+View the Account Activity tab to see the Contribution transactions pertaining to your account.
+
+### How can I confirm that an Accumulated Gain/Loss from the Fund was posted to my account?
+
+View the Account Activity tab to see the Gain/Loss transactions pertaining to your account.
+
+### What if there is a discrepancy in the contributions or I have other questions?
+
+If there are any questions on the posted amounts, you can coordinate directly with the Employee Center.
+
+### Can I change my information in the Retirement Fund Account online?
+
+Employees can only input their contact numbers and addresses. To change any other information, kindly raise a ticket through Employee Center.
+
+### For former employees, when will I receive my retirement benefit?
+
+TAT is 60 business days from last working day (LWD). If beyond 60 business days, former employees may follow up their retirement benefit status via Employee Center.
+
+### Retirement Withdrawal – when will I receive it / follow-up? How much will I get?
+
+You will get 100% of your Employee Voluntary Contributions including earnings and losses, while the corresponding Employer Matching contributions will be forfeited as per the retirement policy. TAT is 60 business days from the final withdrawal date.
+
+### Opted for Employee Voluntary Contributions but can’t see it on my payslip.
+
+If you enroll between 1st – 31st of the month, the employee voluntary contributions will be deducted on the 15th payroll of the following month and the same will be reflected onyour payslip. If you nominated 5%, 7.5% or 10% of your employee voluntary contributions but didn’t see on your payslip, please reach out to Employee Center.
+
+### How to enroll / renew?
+
+Log in to the retirement portal (*ogs.zalamea.ph*), go to the “Enrollment” tab so you can nominate 5%, 7.5%, or 10% of your monthly basic salary. The same process is being followed for the renewal which happens every March of the year. We also have the detailed User Guide uploaded on the portal under “Resources” tab.
+
+### Understanding vested balance, account activity, why is there a negative amount on Zalamea website?
+
+Contributions are being invested. An investment can have gains and potential losses.
+
+### Less than 5 years tenure would like to know if employee would get 100% of his/her retirement benefit if EE choose to resign.
+
+An employee who resigns with less than 5 years of tenure will only be eligible to his/her employee voluntary contributions, if any. If the employee has past service contributions in his/her account, this will also be vested to the employee from 5 years of service and up in line with the vesting schedule.
+
+### When will I be eligible for tax exemption?
+
+Employees will be eligible for tax exemption once he reached the age of 50 and 10 years of service under the same company.
+
+### When will I be eligible for retirement?
+
+Employees who reached the age of 60 are eligible for Normal Retirement while for those employees who will go beyond this age, but not beyond 65 years old, will be eligible for Late Retirement, given that the employee has served the company for at least five years.
+
+Additionally, employees with at least five years of service are eligible for Early Retirement.
+
+### Can I separate from the company before my Early/Normal/Late Retirement Date?
+
+Employees can separate from the company before they reach their Early / Normal / Late Retirement Date. However, employees who separate before said days are only entitled to their Employee Voluntary Balances, if any.
+
+### Are my retirement benefit subject to the applicable Regulatory Benefit?
+
+Yes. In cases where the employee’s Total Employer benefit is lower than the applicable Regulatory Benefit, the company shall cover the difference.
+
+### I was hired at age 65 or older, will I be eligible for any of the company’s retirement benefit?
+
+No. Employees hired at age 65 or older are no longer eligible for the company’s retirement plan hence retirement benefits do not apply.
+
+Note that 65 years old is the mandatory retirement age.
+
+### I already reached the age of 65 but has not yet reached the 5 years of service, what benefits will I be eligible to?
+
+Employees are still entitled to retirement pay based on company guidelines, and the computation will follow the formula prescribed under the Labor Code.
+
+### Can I cancel my voluntary withdrawal request?
+
+Yes. Employees are given ten (10) days to retract their withdrawal request.
+
+### When can I request another voluntary withdrawal after my previous one?
+
+Employees can request for another withdrawal after the completion of their one-year resting period### Optum Retirement Plan Member Loan Program*### How does an employee apply for the Member Loan?
+
+An employee who is currently participating in the Voluntary Contributions of the Retirement Fund will have to log in to the retirement portal and navigate to the Loan tab to apply for the Member Loan.
+
+### Who are eligible to apply for the Member Loan?
+
+Employees who are regular and are currently participating in the Voluntary Contributions of the Retirement Fund are eligible to apply for the Member Loan.
+
+### How much can an employee borrow from the fund?
+
+Employees can borrow up to 100% of their Voluntary Contributions \+ Earnings/Losses, provided the loan's monthly amortization does not exceed 30% of their monthly basic salary plus interest. Additionally, the loan amount must be in increments of 1,000 or divisible by 1,000. For example, if an employee's total Voluntary Contributions is PHP24,012.87, they can borrow PHP24,000. If the total Voluntary Contributions is PHP58,000.12, they can borrow PHP58,000.
+
+### When will the borrowed amount be received and how?
+
+The borrowed amount will be credited to the employee-borrower's Payroll account on the 15th business day after loan approval. Note that this does not follow the regular payroll crediting schedule of the 15th and 30th. BPI will credit the amount according to the bank's standard turnaround time.
+
+  
+
+For non-BPI accounts, an additional PHP500.00 fee will be charged by BPI on the loan proceeds.
+
+### How will employee/borrower know if the loan is approved?
+
+An email notification will be sent by the loan administrator to the employee-borrower’s Optum email regarding the loan status and approval.
+
+### How can employee-borrower check the status of his / her loan application?
+
+Loan status will be regularly shared via email by the loan administrator. Employee-borrower may check the status of the loan application by logging in to the retirement portal and navigate to the Loan tab.
+
+### Can an employee request to expedite the loan process?
+
+All loan applications are processed efficiently in batches, adhering to the standard turnaround time for signature routing to the Retirement Committee and the bank’s established process for crediting. This ensures a smooth and consistent experience for everyone involved.
+
+### Will the Member Loan balance reflect on the employee’s payslip?*### the Member Loan balance will reflect on the employee-borrower’s payslip.*### Is the Member Loan interest rate fixed?
+
+Yes, the loan interest rate is fixed and set below the market rate. It remains fixed for the entire tenure of the loan. Additionally, interest rates will be reviewed annually.
+
+### What are the advantages of taking a loan with interest instead of withdrawing my voluntary contributions from the fund?
+
+Applying for a loan from the retirement fund will allow you to choose the amount you wish to borrow (up to 100% of your voluntary contributions, in increments of 1,000) and your Company Matching contributions remain intact.
+
+### Are there any documentary requirements for applying for the member loan?
+
+Yes, there is one required document: the Promissory Note (PN). Employees need to print, read, agree to, sign, and upload this document when applying for the member loan. Important: Ensure the PN is clearly signed to avoid disapproval of your loan application. You can download the PN from the Loans tab of the retirement portal.
+
+### What file types will the tool accept for the soft copy of the Promissory Note?
+
+The tool accepts the following file types for the uploading of Promissory Note: 'jpeg', 'jpg', 'png', 'doc', 'docx', 'xls', 'xlsx', 'csv', 'pdf', 'ppt', 'pptx' and up to 25MB file size only.
+
+### How many months can employee-borrower pay for the loaned amount?
+
+Employee-borrower can choose from the four term options to pay for the loaned amount: 6, 12, 18 and 24 months. In case where the term of the loan will exceed the employee's normal retirement age, the maximum loan term shall be adjusted accordingly. As a result, this amount will be deducted from the salary on a semi-monthly basis.
+
+### How can employee-borrower pay for the borrowed amount?
+
+Repayment will be set against the employee-borrowers’ salary and will be made through equal semi-monthly salary deductions.
+
+### When will salary deductions for the payment of the loan start?
+
+The salary deduction shall commence on the 2nd payroll date from the date of receipt by the employee-borrower of the loan and will continue with each subsequent payroll.
+
+### Can employee-borrower pay off the loan balance in full? If yes, how?
+
+Yes, after employee-borrower has paid at least 3 months or 6 semi-monthly installments. Full loan balance pay-off can only be requested via salary deduction by submitting an online case via Employee Center.
+
+### Can borrower-employee stop voluntary contributions while there is an existing member loan?
+
+While employee-borrower has an existing member loan, employee-borrower will not be able to opt out of the Voluntary Contributions.
+
+### Can borrower-employee change the percentage of voluntary contributions while there is an existing member loan?
+
+Yes, the employee-borrower who has an existing member loan can change the percentage of voluntary contributions to a lower or higher percentage but not zero (0).
+
+### Can borrower-employee withdraw voluntary contributions from the fund while there is an existing member loan?
+
+While an employee-borrower has an existing loan, voluntary contributions will remain in the fund, continuing to earn returns and receive company matching until the loan term ends. This means voluntary contributions cannot be withdrawn while the loan is active.
+
+### Can the employee-borrower renew his/her loan? If yes, when?
+
+Yes, employee-borrower may renew his/her loan after paying at least 50% of the principal loan balance and this can be applied again through ### retirement tool. The current loan balance shall be deducted from the renewed loan proceeds.*### After employee-borrower fully pays the loan over the selected term, when can employee- borrower apply again for the member loan?
+
+Employees who successfully complete their loan payments over the selected term can re- apply for a new loan immediately after the final payment is posted on the retirement portal.
+
+### When can employees start applying for the member loan?
+
+The Retirement Plan Member Loan Program will be available to all employees who are currently participating in the Voluntary Contributions starting April 1, 2025.
+
+### If a loan application is disapproved can an employee reapply?
+
+If a loan application is disapproved the employee can promptly submit a new application through the retirement portal. Please ensure that the uploaded Promissory Note is accurate, signed, and clearly legible for a smoother process.
+
+### What are the reasons for a loan to be disapproved?
+
+The only reason for loan disapproval is an issue found with the uploaded Promissory Note.
+
+### What if an employee changes their mind about borrowing money from the fund? Can they still cancel the loan application?
+
+If the loan application status in the retirement portal is "Saved," the employee can cancel the loan by clicking the trash icon. However, if the status is "For Approval," the employee must submit a cancellation request to the Employee Center.
+
+### What happens if the employee/borrower resigns immediately or absconds 1 month after receiving the loan amount?
+
+The loan balance will be deducted from the employee’s retirement benefit, offsetting the Voluntary Contributions. Any remaining amount will be recovered from the final pay. If insufficient, the final pay will remain negative.
+
+"""
+
+# A knowledge base section: one FAQ question and its answer. `carried` holds
+# the answerless headings that preceded it (group titles, collapsed lines):
+# they are indexed and shown to the model, but are not part of the answer.
+Section = namedtuple('Section', ['index', 'heading', 'body', 'carried'], defaults=('',))
+
+# `###` starts a section at the beginning of a line, or when glued to the
+# previous text (e.g. "period### Next question"). A `###` preceded by a space
+# is part of the answer text and is left alone.
+SECTION_MARKER = re.compile(r'(?:^|(?<=\S))###[ \t]*', re.MULTILINE)
+
+def parse_sections(text):
+  """Split the knowledge base into its `###` question sections"""
+  fragments = SECTION_MARKER.split(text)[1:]  # Drop the preamble before the first ###
+  sections = []
+  pending = []
+
+  for fragment in fragments:
+    heading, _, body = fragment.strip().partition('\n')
+    heading = heading.strip().rstrip('*').strip()
+    body = body.strip()
+
+    # Headings without an answer (group titles, collapsed lines) are carried
+    # into the next section so their text stays retrievable
+    if not body:
+      if heading:
+        pending.append(heading)
+      continue
+
+    carried = ''
+    if pending:
+      carried = ' '.join(pending) if heading else ''
+      heading = heading or ' '.join(pending)
+      pending = []
+
+    sections.append(Section(len(sections), heading, body, carried))
+
+  if pending and sections:
+    last = sections[-1]
+    sections[-1] = last._replace(carried=' '.join(filter(None, [last.carried] + pending)))
+
+  return sections
+
+def format_sections(sections):
+  """Render sections back into the `###` markdown used by the knowledge base"""
+  return '\n\n'.join(
+    f"### {section.heading}\n\n" + (f"{section.carried}\n\n" if section.carried else '') + section.body
+    for section in sections
+  )
+
+def build_system_prompt(sections):
+  """Build the system prompt from the instructions and the given sections"""
+  return (
+    f"{SYSTEM_INSTRUCTIONS}\n<KNOWLEDGE_BASE>\n\n## Optum Retirement FAQ\n\n"
+    f"{format_sections(sections)}\n\n</KNOWLEDGE_BASE>\n"
+  )
+
+def knowledge_base_version(text=None):
+  """Short content hash identifying the current knowledge base text"""
+  text = KNOWLEDGE_BASE if text is None else text
+  return hashlib.sha256((SYSTEM_INSTRUCTIONS + text).encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,171 @@
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump when a field changes meaning; readers can branch on "v"
+LEDGER_SCHEMA_VERSION = 1
+
+class RequestLedger:
+  """Append-only JSONL ledger with one record per completed request.
+
+  Records are queued by the request thread and written in batches by a
+  background thread. The active segment is rotated once it exceeds
+  `max_bytes` or is older than `max_age` seconds; rotated segments are
+  renamed with a timestamp and optionally gzipped.
+  """
+
+  def __init__(self, path, max_bytes=50 * 1024 * 1024, max_age=86400, compress=True,
+               batch_size=256, flush_interval=1.0, max_queue=10000):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.max_age = max_age
+    self.compress = compress
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.queue = queue.Queue(maxsize=max_queue)
+    self.dropped = 0
+    self.file = None
+    self.opened_at = None
+
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+
+    self.thread = threading.Thread(target=self._run, name='request-ledger', daemon=True)
+    self.thread.start()
+    atexit.register(self.close)
+
+  def append(self, record):
+    """Queue a record; never blocks the caller"""
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+  def close(self):
+    """Write what is queued and stop the writer"""
+    if self.thread.is_alive():
+      self.queue.put(None)
+      self.thread.join(timeout=5)
+
+  def _run(self):
+    while True:
+      try:
+        first = self.queue.get(timeout=self.flush_interval)
+      except queue.Empty:
+        self._maybe_rotate()
+        continue
+
+      batch = [first]
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+
+      records = [record for record in batch if record is not None]
+      if records:
+        try:
+          self._write(records)
+        except Exception as e:
+          logger.error("Could not write %d ledger records: %s", len(records), e)
+      if len(records) != len(batch):
+        self._close_file()
+        return
+
+  def _write(self, records):
+    self._maybe_rotate()
+    if self.file is None:
+      self._open()
+    lines = ''.join(
+      json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n' for record in records
+    )
+    self.file.write(lines)
+    self.file.flush()
+
+  def _open(self):
+    self.file = open(self.path, 'a', encoding='utf-8')
+    if self.opened_at is None:
+      try:
+        self.opened_at = os.path.getmtime(self.path) if self.file.tell() else time.time()
+      except OSError:
+        self.opened_at = time.time()
+
+  def _close_file(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+
+  def _maybe_rotate(self):
+    try:
+      size = os.path.getsize(self.path)
+    except OSError:
+      return
+    age = time.time() - (self.opened_at or time.time())
+    if size == 0 or (size < self.max_bytes and age < self.max_age):
+      return
+
+    self._close_file()
+    base, ext = os.path.splitext(self.path)
+    rotated = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+    suffix = 1
+    while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+      rotated = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+      suffix += 1
+    os.rename(self.path, rotated)
+    self.opened_at = None
+
+    if self.compress:
+      with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+      os.remove(rotated)
+
+# Rotated segment names: <base>-<YYYYmmdd-HHMMSS>[-<n>]<ext>[.gz]
+SEGMENT_STAMP = re.compile(r'-(\d{8}-\d{6})(?:-(\d+))?$')
+
+def segment_order(segment, ext):
+  """Sort key putting segments in rotation order: by timestamp, then by the
+  suffix of same-second rotations (none counts as 0)"""
+  name = segment[:-len('.gz')] if segment.endswith('.gz') else segment
+  match = SEGMENT_STAMP.search(name[:len(name) - len(ext)])
+  if match is None:
+    return ('', 0, name)
+  return (match.group(1), int(match.group(2) or 0), name)
+
+def iter_ledger(path):
+  """Yield records from rotated segments (oldest first) and then the active file"""
+  base, ext = os.path.splitext(path)
+  segments = sorted(
+    glob.glob(f"{base}-*{ext}") + glob.glob(f"{base}-*{ext}.gz"),
+    key=lambda segment: segment_order(segment, ext),
+  )
+  if os.path.exists(path):
+    segments.append(path)
+  for segment in segments:
+    opener = gzip.open if segment.endswith('.gz') else open
+    with opener(segment, 'rt', encoding='utf-8') as f:
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+
+def ledger_from_env():
+  """RequestLedger configured from LEDGER_* variables, or None if disabled"""
+  path = os.getenv('LEDGER_PATH', os.path.join('ledger', 'requests.jsonl'))
+  if not path:
+    return None
+  return RequestLedger(
+    path,
+    max_bytes=int(os.getenv('LEDGER_MAX_BYTES', str(50 * 1024 * 1024))),
+    max_age=int(os.getenv('LEDGER_ROTATE_SECONDS', '86400')),
+    compress=os.getenv('LEDGER_GZIP', 'true').lower() == 'true',
+  )
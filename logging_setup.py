@@ -0,0 +1,181 @@
+import atexit
+import hmac
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Per-request verbosity: 'summary' logs one line per request (plus warnings
+# and errors); 'debug' logs every step, conversation previews included
+VERBOSITY_SUMMARY = 'summary'
+VERBOSITY_DEBUG = 'debug'
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+  """QueueHandler that leaves formatting to the writer thread.
+
+  The stock QueueHandler formats every record in the calling thread before
+  enqueueing it; here the caller only pays for creating the record and a
+  non-blocking put. Records are dropped (and counted) if the queue is full
+  rather than stalling a streaming response.
+  """
+
+  def __init__(self, log_queue):
+    super().__init__(log_queue)
+    self.dropped = 0
+
+  def prepare(self, record):
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+class BatchWriter(threading.Thread):
+  """Background thread that formats queued records and writes them in batches.
+
+  Each batch is joined into one string and written with a single write and
+  flush per stream, instead of one write and flush per record.
+  """
+
+  def __init__(self, log_queue, streams, formatter, batch_size=256, flush_interval=0.2):
+    super().__init__(name='log-writer', daemon=True)
+    self.queue = log_queue
+    self.streams = streams
+    self.formatter = formatter
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.stopping = threading.Event()
+
+  def run(self):
+    while True:
+      try:
+        first = self.queue.get(timeout=self.flush_interval)
+      except queue.Empty:
+        if self.stopping.is_set():
+          return
+        continue
+
+      batch = [first]
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+
+      self.write([record for record in batch if record is not None])
+      if any(record is None for record in batch):
+        return
+
+  def write(self, records):
+    if not records:
+      return
+    lines = []
+    for record in records:
+      try:
+        lines.append(self.formatter.format(record))
+      except Exception:
+        lines.append(f"Unformattable log record from {record.name}: {record.msg!r}")
+    text = '\n'.join(lines) + '\n'
+    for stream in self.streams:
+      try:
+        stream.write(text)
+        stream.flush()
+      except Exception:
+        pass
+
+  def stop(self):
+    """Flush what is queued and stop the thread"""
+    self.stopping.set()
+    self.queue.put(None)
+    self.join(timeout=5)
+
+_writer = None
+
+def configure_logging(log_file='chat_app.log', level=logging.INFO, to_stdout=True,
+                      batch_size=256, flush_interval=0.2, max_queue=10000):
+  """Route all logging through a queue to a background batch writer.
+
+  Safe to call again: the previous writer is flushed and replaced.
+  """
+  global _writer
+
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    root.removeHandler(handler)
+  if _writer is not None:
+    _writer.stop()
+
+  streams = []
+  if log_file:
+    streams.append(open(log_file, 'a', encoding='utf-8', buffering=1 << 16))
+  if to_stdout:
+    streams.append(sys.stdout)
+
+  log_queue = queue.Queue(maxsize=max_queue)
+  handler = DeferredQueueHandler(log_queue)
+  root.addHandler(handler)
+  root.setLevel(level)
+
+  _writer = BatchWriter(log_queue, streams, logging.Formatter(LOG_FORMAT), batch_size, flush_interval)
+  _writer.start()
+  return handler
+
+def configure_from_env():
+  """Configure logging from LOG_FILE, LOG_LEVEL, LOG_BATCH_SIZE and LOG_FLUSH_INTERVAL"""
+  return configure_logging(
+    log_file=os.getenv('LOG_FILE', 'chat_app.log'),
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    batch_size=int(os.getenv('LOG_BATCH_SIZE', '256')),
+    flush_interval=float(os.getenv('LOG_FLUSH_INTERVAL', '0.2')),
+  )
+
+def shutdown_logging():
+  global _writer
+  if _writer is not None:
+    _writer.stop()
+    _writer = None
+
+atexit.register(shutdown_logging)
+
+class RequestLog:
+  """Logger for one request: prefixes the request id and gates detail lines.
+
+  `detail` lines are only emitted in debug verbosity, and callers should
+  check `verbose` before building anything expensive for them. All methods
+  take %-style arguments so formatting happens on the writer thread.
+  """
+
+  def __init__(self, logger, request_id, verbosity=VERBOSITY_SUMMARY):
+    self.logger = logger
+    self.request_id = request_id
+    self.verbose = verbosity == VERBOSITY_DEBUG
+
+  def detail(self, msg, *args):
+    if self.verbose:
+      self.logger.info('[%s] ' + msg, self.request_id, *args)
+
+  def info(self, msg, *args):
+    self.logger.info('[%s] ' + msg, self.request_id, *args)
+
+  def warning(self, msg, *args):
+    self.logger.warning('[%s] ' + msg, self.request_id, *args)
+
+  def error(self, msg, *args, exc_info=False):
+    self.logger.error('[%s] ' + msg, self.request_id, *args, exc_info=exc_info)
+
+def request_verbosity(header_value, default, key=None, debug_key=None):
+  """Verbosity for a request: the X-Log-Verbosity header if valid, else the default.
+
+  Debug lines include conversation previews, so the header only counts when
+  operators set `debug_key` (LOG_DEBUG_KEY) and the request sends it as `key`.
+  """
+  if not debug_key or not key or not hmac.compare_digest(key.encode('utf-8'), debug_key.encode('utf-8')):
+    return default
+  value = (header_value or '').strip().lower()
+  return value if value in (VERBOSITY_SUMMARY, VERBOSITY_DEBUG) else default
@@ -0,0 +1,224 @@
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+class Metric:
+  """Base class: a named metric with label values mapped to samples.
+
+  Every update takes one uncontended per-metric lock for a few dict
+  operations, which is cheap next to the rest of a request.
+  """
+
+  kind = None
+
+  def __init__(self, name, documentation, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.values = {}
+    self.lock = threading.Lock()
+
+  def key(self, labels):
+    return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+class Counter(Metric):
+  kind = 'counter'
+
+  def inc(self, amount=1, **labels):
+    key = self.key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def snapshot(self):
+    with self.lock:
+      return {json.dumps(key): value for key, value in self.values.items()}
+
+class Gauge(Metric):
+  kind = 'gauge'
+
+  def inc(self, amount=1, **labels):
+    key = self.key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def dec(self, amount=1, **labels):
+    self.inc(-amount, **labels)
+
+  def set(self, value, **labels):
+    with self.lock:
+      self.values[self.key(labels)] = value
+
+  def snapshot(self):
+    with self.lock:
+      return {json.dumps(key): value for key, value in self.values.items()}
+
+class Histogram(Metric):
+  kind = 'histogram'
+
+  def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    key = self.key(labels)
+    index = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      state = self.values.get(key)
+      if state is None:
+        state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+      state[0][index] += 1
+      state[1] += value
+      state[2] += 1
+
+  def snapshot(self):
+    with self.lock:
+      return {
+        json.dumps(key): [list(counts), total, count]
+        for key, (counts, total, count) in self.values.items()
+      }
+
+class MetricsRegistry:
+  """Holds the process's metrics and renders them in Prometheus text format.
+
+  With `multiprocess_dir` set, each process also writes its snapshot to
+  `<dir>/metrics-<pid>.json` (every `sync_interval` seconds and on each
+  scrape), and `render()` merges the snapshots of all workers: counters and
+  histograms are summed across every file, gauges only across live processes.
+  """
+
+  def __init__(self, multiprocess_dir=None, sync_interval=5.0):
+    self.metrics = {}
+    self.multiprocess_dir = multiprocess_dir
+    self.sync_interval = sync_interval
+    self.lock = threading.Lock()
+    if multiprocess_dir:
+      os.makedirs(multiprocess_dir, exist_ok=True)
+      threading.Thread(target=self._sync_loop, name='metrics-sync', daemon=True).start()
+
+  def register(self, metric):
+    with self.lock:
+      self.metrics[metric.name] = metric
+    return metric
+
+  def counter(self, name, documentation, labelnames=()):
+    return self.register(Counter(name, documentation, labelnames))
+
+  def gauge(self, name, documentation, labelnames=()):
+    return self.register(Gauge(name, documentation, labelnames))
+
+  def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return self.register(Histogram(name, documentation, labelnames, buckets))
+
+  def snapshot(self):
+    return {
+      name: {'kind': metric.kind, 'values': metric.snapshot()}
+      for name, metric in list(self.metrics.items())
+    }
+
+  def write_snapshot(self):
+    """Write this process's snapshot for the other workers to merge"""
+    path = os.path.join(self.multiprocess_dir, f'metrics-{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'pid': os.getpid(), 'metrics': self.snapshot()}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+  def _sync_loop(self):
+    while True:
+      time.sleep(self.sync_interval)
+      try:
+        self.write_snapshot()
+      except Exception as e:
+        logger.warning("Could not write metrics snapshot: %s", e)
+
+  def collect(self):
+    """Merged snapshot of this process, plus the other workers in multiprocess mode"""
+    if not self.multiprocess_dir:
+      return self.snapshot()
+
+    self.write_snapshot()
+    merged = {}
+    for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics-*.json')):
+      try:
+        with open(path) as f:
+          data = json.load(f)
+      except (OSError, ValueError):
+        continue
+      alive = _pid_alive(data.get('pid'))
+      for name, metric in data['metrics'].items():
+        if metric['kind'] == 'gauge' and not alive:
+          continue
+        target = merged.setdefault(name, {'kind': metric['kind'], 'values': {}})['values']
+        for key, value in metric['values'].items():
+          target[key] = _merge(target.get(key), value)
+    return merged
+
+  def render(self):
+    """Prometheus text exposition of all metrics"""
+    collected = self.collect()
+    lines = []
+    for name, metric in sorted(self.metrics.items()):
+      lines.append(f'# HELP {name} {metric.documentation}')
+      lines.append(f'# TYPE {name} {metric.kind}')
+      values = collected.get(name, {}).get('values', {})
+      for key, value in sorted(values.items()):
+        labels = dict(zip(metric.labelnames, json.loads(key)))
+        if metric.kind == 'histogram':
+          counts, total, count = value
+          cumulative = 0
+          for bound, bucket_count in zip(list(metric.buckets) + [math.inf], counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == math.inf else _format_number(bound)
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": le})} {cumulative}')
+          lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(total)}')
+          lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        else:
+          lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+def _merge(current, value):
+  if current is None:
+    return value
+  if isinstance(value, list):
+    counts = [a + b for a, b in zip(current[0], value[0])]
+    return [counts, current[1] + value[1], current[2] + value[2]]
+  return current + value
+
+def _pid_alive(pid):
+  if pid is None:
+    return False
+  try:
+    os.kill(pid, 0)
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+  pairs = ','.join(
+    '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    for k, v in labels.items()
+  )
+  return '{' + pairs + '}'
+
+def _format_number(value):
+  if isinstance(value, float):
+    if value == math.inf:
+      return '+Inf'
+    return repr(round(value, 9))
+  return str(value)
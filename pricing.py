@@ -0,0 +1,62 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ModelPricing:
+  """USD price per token for one model"""
+
+  def __init__(self, input_per_million, cached_input_per_million, output_per_million):
+    self.input = input_per_million / 1_000_000
+    self.cached_input = cached_input_per_million / 1_000_000
+    self.output = output_per_million / 1_000_000
+
+  def cost(self, usage):
+    """Cost of a TokenUsage; thinking tokens are billed as output"""
+    return (
+      usage.uncached_prompt_tokens * self.input
+      + usage.cached_tokens * self.cached_input
+      + usage.output_tokens * self.output
+    )
+
+# Gemini API paid-tier prices (USD per 1M tokens, prompts up to 200k tokens)
+MODEL_PRICING = {
+  'gemini-2.5-flash-lite': ModelPricing(0.10, 0.025, 0.40),
+  'gemini-2.5-flash': ModelPricing(0.30, 0.075, 2.50),
+  'gemini-2.5-pro': ModelPricing(1.25, 0.3125, 10.00),
+  'gemini-2.0-flash': ModelPricing(0.10, 0.025, 0.40),
+  'gemini-2.0-flash-lite': ModelPricing(0.075, 0.01875, 0.30),
+}
+
+# Moving aliases resolve to the model they currently point at
+MODEL_ALIASES = {
+  'gemini-flash-lite-latest': 'gemini-2.5-flash-lite',
+  'gemini-flash-latest': 'gemini-2.5-flash',
+  'gemini-pro-latest': 'gemini-2.5-pro',
+}
+
+DEFAULT_MODEL = 'gemini-2.5-flash-lite'
+
+# Models already warned about, so an unpriced model warns once, not per request
+_warned_models = set()
+
+def get_pricing(model):
+  """Pricing for a model name, alias or versioned name (e.g. gemini-2.5-flash-001)"""
+  name = MODEL_ALIASES.get(model, model)
+  if name.startswith('models/'):
+    name = name[len('models/'):]
+  if name in MODEL_PRICING:
+    return MODEL_PRICING[name]
+
+  # Versioned and preview names share the price of their base model
+  for base in sorted(MODEL_PRICING, key=len, reverse=True):
+    if name.startswith(base + '-'):
+      return MODEL_PRICING[base]
+
+  if model not in _warned_models:
+    _warned_models.add(model)
+    logger.warning("No pricing registered for %s, using %s prices", model, DEFAULT_MODEL)
+  return MODEL_PRICING[DEFAULT_MODEL]
+
+def calculate_cost(model, usage):
+  """Calculate the cost of a generation from its TokenUsage"""
+  return get_pricing(model).cost(usage)
@@ -0,0 +1,57 @@
+import functools
+import threading
+
+from google.genai import types
+
+from knowledge_base import build_system_prompt
+
+class PromptRegistry:
+  """Prompt and config objects shared by every request.
+
+  The full system prompt, its Content and the GenerateContentConfig are
+  built once; the system Content for a retrieved section set, the config
+  for a cached prefix name and the Content of each conversation message
+  are built on first use and then reused. These objects are shared, so
+  callers must treat them as read-only. `reload(sections)` rebuilds
+  everything for a new knowledge base.
+  """
+
+  def __init__(self, sections, config_params, max_prompts=256, max_messages=4096):
+    self.config = types.GenerateContentConfig(**config_params)
+    self.lock = threading.Lock()
+    self.content = functools.lru_cache(maxsize=max_messages)(_content)
+    self.max_prompts = max_prompts
+    self.reload(sections)
+
+  def reload(self, sections):
+    """Rebuild the prompts for a new knowledge base"""
+    by_index = {section.index: section for section in sections}
+    system_content = functools.lru_cache(maxsize=self.max_prompts)(functools.partial(_system_content, by_index))
+    cached_config = functools.lru_cache(maxsize=16)(self._cached_config)
+    full_prompt = build_system_prompt(sections)
+    with self.lock:
+      self.full_prompt = full_prompt
+      self.full_prompt_content = _content('user', full_prompt)
+      self._system_content_for = system_content
+      self.cached_config = cached_config
+
+  def _cached_config(self, cache_name):
+    return self.config.model_copy(update={'cached_content': cache_name})
+
+  def system_prompt(self, sections):
+    """(prompt text, Content) for a set of retrieved sections"""
+    return self._system_content_for(tuple(section.index for section in sections))
+
+  def format_conversation(self, messages):
+    """Gemini Contents for chat messages, reusing ones already converted"""
+    return [
+      self.content("user" if msg["role"] == "user" else "model", msg["content"])
+      for msg in messages
+    ]
+
+def _system_content(by_index, indexes):
+  prompt = build_system_prompt([by_index[i] for i in indexes])
+  return prompt, _content('user', prompt)
+
+def _content(role, text):
+  return types.Content(role=role, parts=[types.Part.from_text(text=text)])
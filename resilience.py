@@ -0,0 +1,400 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+from google.genai import errors
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+class FirstChunkTimeout(Exception):
+  """The upstream sent nothing before the first-chunk deadline"""
+
+class CircuitOpen(Exception):
+  """Every configured model is failing; the request is not sent upstream"""
+
+def is_retryable(error):
+  """Whether an error before the first chunk is transient and worth another attempt"""
+  if isinstance(error, FirstChunkTimeout):
+    return True
+  if isinstance(error, errors.APIError):
+    return error.code in RETRYABLE_STATUSES
+  return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+class CircuitBreaker:
+  """Consecutive-failure breaker for one model.
+
+  After `failure_threshold` retryable failures in a row the circuit opens
+  and `allow` refuses calls. Once `reset_timeout` seconds have passed it
+  lets one probe through (and another every `reset_timeout` seconds); the
+  first success closes the circuit again.
+  """
+
+  def __init__(self, failure_threshold=5, reset_timeout=30.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+    self.lock = threading.Lock()
+
+  @property
+  def is_open(self):
+    return self.opened_at is not None
+
+  def allow(self):
+    with self.lock:
+      if self.opened_at is None:
+        return True
+      now = time.monotonic()
+      if now - self.opened_at >= self.reset_timeout:
+        self.opened_at = now
+        return True
+      return False
+
+  def record_success(self):
+    """True if this closed an open circuit"""
+    with self.lock:
+      was_open = self.opened_at is not None
+      self.failures = 0
+      self.opened_at = None
+      return was_open
+
+  def record_failure(self):
+    """True if this opened the circuit"""
+    with self.lock:
+      self.failures += 1
+      if self.opened_at is not None:
+        self.opened_at = time.monotonic()
+        return False
+      if self.failures >= self.failure_threshold:
+        self.opened_at = time.monotonic()
+        return True
+      return False
+
+class LatencyTracker:
+  """Recent time-to-first-chunk samples, for the hedging threshold"""
+
+  def __init__(self, size=200):
+    self.samples = deque(maxlen=size)
+    self.lock = threading.Lock()
+
+  def observe(self, seconds):
+    with self.lock:
+      self.samples.append(seconds)
+
+  def percentile(self, p, min_samples):
+    with self.lock:
+      if len(self.samples) < min_samples:
+        return None
+      ordered = sorted(self.samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class Attempt:
+  """One upstream call racing for its first chunk (sync path)"""
+
+  def __init__(self, model, started):
+    self.model = model
+    self.started = started
+    self.stream = None
+    self.abandoned = False
+    self.finished = False
+
+class ResilientUpstream:
+  """First-chunk deadline, retries, hedging and model fallback around a stream.
+
+  `stream(open_stream)` and `astream(open_stream)` call `open_stream(model)`
+  for a (sync or async) chunk iterator and wait for its first chunk:
+
+  - an attempt that sends nothing within `first_chunk_timeout` is dropped;
+  - a retryable failure before the first chunk is retried up to
+    `max_retries` times after a jittered exponential backoff;
+  - with `hedge_percentile`, a second attempt starts once the first has
+    waited longer than that percentile of recent first-chunk times, and
+    whichever answers first wins;
+  - each model has a CircuitBreaker, and calls go to `fallback_model`
+    while the primary's circuit is open.
+
+  Once a chunk has been streamed, errors propagate unchanged: a retry would
+  repeat text the client already has. `on_event(event, model)` reports
+  retry, timeout, hedge, fallback, circuit_open and circuit_closed.
+  """
+
+  def __init__(self, primary_model, fallback_model=None, first_chunk_timeout=15.0, max_retries=2,
+               backoff_base=0.25, backoff_max=2.0, hedge_percentile=0, hedge_min_samples=20,
+               failure_threshold=5, reset_timeout=30.0, on_event=None):
+    self.primary_model = primary_model
+    self.fallback_model = fallback_model
+    self.first_chunk_timeout = first_chunk_timeout or None
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.hedge_percentile = hedge_percentile
+    self.hedge_min_samples = hedge_min_samples
+    self.on_event = on_event
+    models = [primary_model] + ([fallback_model] if fallback_model else [])
+    self.breakers = {model: CircuitBreaker(failure_threshold, reset_timeout) for model in models}
+    self.latency = {model: LatencyTracker() for model in models}
+
+  def _event(self, event, model):
+    if self.on_event:
+      self.on_event(event, model)
+
+  def choose_model(self):
+    """The primary model, or the fallback while the primary's circuit is open"""
+    if self.breakers[self.primary_model].allow():
+      return self.primary_model
+    if self.fallback_model and self.breakers[self.fallback_model].allow():
+      self._event('fallback', self.fallback_model)
+      return self.fallback_model
+    raise CircuitOpen(f"Upstream unavailable: circuit open for {', '.join(self.breakers)}")
+
+  def _hedge_model(self):
+    """Model for a hedged attempt, or None if no circuit lets one through"""
+    try:
+      model = self.choose_model()
+    except CircuitOpen:
+      return None
+    self._event('hedge', model)
+    return model
+
+  def hedge_delay(self, model):
+    if not self.hedge_percentile:
+      return None
+    return self.latency[model].percentile(self.hedge_percentile, self.hedge_min_samples)
+
+  def backoff(self, retry):
+    """Full-jitter exponential backoff before retry number `retry` (1-based)"""
+    return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (retry - 1)))
+
+  def succeeded(self, model, first_chunk_seconds):
+    self.latency[model].observe(first_chunk_seconds)
+    if self.breakers[model].record_success():
+      self._event('circuit_closed', model)
+
+  def failed(self, model, error):
+    if not is_retryable(error):
+      return
+    if isinstance(error, FirstChunkTimeout):
+      self._event('timeout', model)
+    if self.breakers[model].record_failure():
+      self._event('circuit_open', model)
+
+  def _should_retry(self, error, retries, log):
+    if retries >= self.max_retries or not is_retryable(error):
+      return False
+    log.warning("Upstream failed before the first chunk, retrying (%d/%d): %s", retries + 1, self.max_retries, error)
+    return True
+
+  def stream(self, open_stream, on_start=None, log=None):
+    """Chunks of the first attempt to answer; on_start(model) runs before the first one"""
+    log = log or logger
+    retries = 0
+    while True:
+      try:
+        model, stream, first = self._first_chunk(open_stream)
+        break
+      except Exception as e:
+        if not self._should_retry(e, retries, log):
+          raise
+        retries += 1
+        self._event('retry', self.primary_model)
+        time.sleep(self.backoff(retries))
+
+    if on_start:
+      on_start(model)
+    try:
+      if first is not None:
+        yield first
+        yield from stream
+    finally:
+      stream.close()
+
+  def _first_chunk(self, open_stream):
+    """(model, stream, first chunk or None if empty) of the winning attempt"""
+    model = self.choose_model()
+    if not self.first_chunk_timeout and not self.hedge_percentile:
+      started = time.monotonic()
+      stream = open_stream(model)
+      try:
+        first = next(stream, None)
+      except Exception as e:
+        self.failed(model, e)
+        raise
+      self.succeeded(model, time.monotonic() - started)
+      return model, stream, first
+
+    results = queue.Queue()
+    lock = threading.Lock()
+    attempts = []
+
+    def run(attempt):
+      try:
+        stream = open_stream(attempt.model)
+        first = next(stream, None)
+        error = None
+      except Exception as e:
+        stream, first, error = None, None, e
+      with lock:
+        if attempt.abandoned:
+          if stream is not None:
+            stream.close()
+          return
+        attempt.stream = stream
+        results.put((attempt, first, error))
+
+    def start(model):
+      attempt = Attempt(model, time.monotonic())
+      attempts.append(attempt)
+      threading.Thread(target=run, args=(attempt,), daemon=True, name='upstream-attempt').start()
+
+    def abandon(winner=None):
+      with lock:
+        for attempt in attempts:
+          if attempt is not winner:
+            attempt.abandoned = True
+        while not results.empty():
+          attempt, _, _ = results.get_nowait()
+          if attempt is not winner and attempt.stream is not None:
+            attempt.stream.close()
+
+    start(model)
+    now = time.monotonic()
+    deadline = now + self.first_chunk_timeout if self.first_chunk_timeout else None
+    delay = self.hedge_delay(model)
+    hedge_at = now + delay if delay is not None else None
+    pending = 1
+    error = None
+    while True:
+      wake_at = min(t for t in (deadline, hedge_at) if t is not None) if (deadline or hedge_at) else None
+      try:
+        attempt, first, error = results.get(timeout=max(0.0, wake_at - time.monotonic()) if wake_at else None)
+      except queue.Empty:
+        now = time.monotonic()
+        if hedge_at is not None and now >= hedge_at:
+          hedge_at = None
+          hedge_model = self._hedge_model()
+          if hedge_model:
+            start(hedge_model)
+            pending += 1
+          continue
+        abandon()
+        error = FirstChunkTimeout(f"No response from {model} within {self.first_chunk_timeout:g}s")
+        for attempt in attempts:
+          if not attempt.finished:
+            self.failed(attempt.model, error)
+        raise error
+      attempt.finished = True
+      pending -= 1
+      if error is not None:
+        self.failed(attempt.model, error)
+        if pending:
+          continue
+        abandon()
+        raise error
+      abandon(attempt)
+      self.succeeded(attempt.model, time.monotonic() - attempt.started)
+      return attempt.model, attempt.stream, first
+
+  async def astream(self, open_stream, on_start=None, log=None):
+    """Async twin of `stream` for async chunk iterators"""
+    log = log or logger
+    retries = 0
+    while True:
+      try:
+        model, stream, first = await self._afirst_chunk(open_stream)
+        break
+      except Exception as e:
+        if not self._should_retry(e, retries, log):
+          raise
+        retries += 1
+        self._event('retry', self.primary_model)
+        await asyncio.sleep(self.backoff(retries))
+
+    if on_start:
+      on_start(model)
+    try:
+      if first is not None:
+        yield first
+        async for chunk in stream:
+          yield chunk
+    finally:
+      await stream.aclose()
+
+  async def _afirst_chunk(self, open_stream):
+    model = self.choose_model()
+    loop = asyncio.get_running_loop()
+
+    async def run(attempt_model):
+      stream = open_stream(attempt_model)
+      try:
+        first = await stream.__anext__()
+      except StopAsyncIteration:
+        first = None
+      except BaseException:
+        await stream.aclose()
+        raise
+      return attempt_model, stream, first
+
+    tasks = {asyncio.create_task(run(model)): (model, loop.time())}
+    deadline = loop.time() + self.first_chunk_timeout if self.first_chunk_timeout else None
+    delay = self.hedge_delay(model)
+    hedge_at = loop.time() + delay if delay is not None else None
+    try:
+      while True:
+        wake_at = min(t for t in (deadline, hedge_at) if t is not None) if (deadline or hedge_at) else None
+        done, _ = await asyncio.wait(
+          tasks, timeout=max(0.0, wake_at - loop.time()) if wake_at else None,
+          return_when=asyncio.FIRST_COMPLETED,
+        )
+        if not done:
+          if hedge_at is not None and loop.time() >= hedge_at:
+            hedge_at = None
+            hedge_model = self._hedge_model()
+            if hedge_model:
+              tasks[asyncio.create_task(run(hedge_model))] = (hedge_model, loop.time())
+            continue
+          error = FirstChunkTimeout(f"No response from {model} within {self.first_chunk_timeout:g}s")
+          for attempt_model, _ in tasks.values():
+            self.failed(attempt_model, error)
+          raise error
+        for task in done:
+          attempt_model, started = tasks.pop(task)
+          error = task.exception()
+          if error is None:
+            _, stream, first = task.result()
+            self.succeeded(attempt_model, loop.time() - started)
+            return attempt_model, stream, first
+          self.failed(attempt_model, error)
+        if not tasks:
+          raise error
+    finally:
+      # Losing attempts: cancel those still waiting, close any that also answered
+      for task in tasks:
+        if not task.done():
+          task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+          await task.result()[1].aclose()
+
+def resilience_from_env(primary_model, on_event=None):
+  """ResilientUpstream configured from the UPSTREAM_* / BREAKER_* variables"""
+  fallback_model = os.getenv('UPSTREAM_FALLBACK_MODEL') or None
+  return ResilientUpstream(
+    primary_model,
+    fallback_model=fallback_model if fallback_model != primary_model else None,
+    first_chunk_timeout=float(os.getenv('UPSTREAM_FIRST_CHUNK_TIMEOUT_SECONDS', '15')),
+    max_retries=int(os.getenv('UPSTREAM_MAX_RETRIES', '2')),
+    backoff_base=float(os.getenv('UPSTREAM_RETRY_BACKOFF_SECONDS', '0.25')),
+    hedge_percentile=float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', '0')),
+    hedge_min_samples=int(os.getenv('UPSTREAM_HEDGE_MIN_SAMPLES', '20')),
+    failure_threshold=int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5')),
+    reset_timeout=float(os.getenv('BREAKER_RESET_SECONDS', '30')),
+    on_event=on_event,
+  )
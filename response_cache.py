@@ -0,0 +1,72 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+WHITESPACE = re.compile(r"\s+")
+TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+def normalize_text(text):
+  """Case-fold and collapse whitespace so trivially different prompts share a key"""
+  text = WHITESPACE.sub(' ', text.strip().lower())
+  return TRAILING_PUNCTUATION.sub('', text)
+
+def conversation_key(messages, model, version):
+  """Cache key for a conversation window, model and knowledge base version"""
+  window = [(msg.get('role', 'user'), normalize_text(msg.get('content', ''))) for msg in messages]
+  payload = json.dumps([model, version, window], ensure_ascii=False, separators=(',', ':'))
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class CachedResponse:
+  """A completed answer: the streamed chunks and the metrics of the original call"""
+
+  def __init__(self, chunks, metrics, created_at):
+    self.chunks = chunks
+    self.metrics = metrics
+    self.created_at = created_at
+
+class ResponseCache:
+  """Bounded LRU cache of completed responses with a per-entry TTL.
+
+  Entries are tagged with the knowledge base version they were produced
+  from; `set_version` drops everything when the knowledge base changes.
+  """
+
+  def __init__(self, max_entries=256, ttl_seconds=3600, version=None):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self.version = version
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    """Return the cached response for key, or None if missing or expired"""
+    now = time.time()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None or now - entry.created_at > self.ttl_seconds:
+        if entry is not None:
+          del self.entries[key]
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return entry
+
+  def put(self, key, chunks, metrics):
+    with self.lock:
+      self.entries[key] = CachedResponse(list(chunks), dict(metrics), time.time())
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def set_version(self, version):
+    """Switch to a new knowledge base version, invalidating every entry"""
+    with self.lock:
+      if version != self.version:
+        self.version = version
+        self.entries.clear()
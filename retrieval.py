@@ -0,0 +1,121 @@
+import heapq
+import math
+import re
+from array import array
+
+# Words that carry no signal for matching questions to FAQ sections
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does for from had has have he her
+his how i if in into is it its me my of on or our she so that the their them then
+there these they this to was we were what when where which who why will with would
+you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize_term(term):
+  """Light suffix stripping so 'loans' and 'loan' share a posting list"""
+  if len(term) > 4 and term.endswith('ies'):
+    return term[:-3] + 'y'
+  if len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+    return term[:-1]
+  return term
+
+def tokenize(text):
+  """Lowercase, split into words, drop stopwords and normalize"""
+  return [
+    normalize_term(token)
+    for token in TOKEN_PATTERN.findall(text.lower())
+    if token not in STOPWORDS
+  ]
+
+class BM25Index:
+  """In-memory BM25 index over knowledge base sections.
+
+  Postings are stored in CSR layout: for term id t, the documents containing
+  it are doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies in
+  term_freqs. Everything lives in flat `array` buffers rather than per-term
+  Python lists.
+  """
+
+  def __init__(self, sections, k1=1.2, b=0.75):
+    self.sections = list(sections)
+    self.k1 = k1
+    self.b = b
+
+    # Headings are indexed twice so a question that matches a heading wins
+    # over one that only shares words with an answer body
+    doc_terms = [tokenize(f"{s.heading} {s.heading} {s.carried} {s.body}") for s in self.sections]
+
+    counts_by_term = {}
+    for doc_id, terms in enumerate(doc_terms):
+      counts = {}
+      for term in terms:
+        counts[term] = counts.get(term, 0) + 1
+      for term, tf in counts.items():
+        counts_by_term.setdefault(term, []).append((doc_id, tf))
+
+    self.vocabulary = {term: term_id for term_id, term in enumerate(sorted(counts_by_term))}
+    self.offsets = array('I', [0])
+    self.doc_ids = array('H')
+    self.term_freqs = array('H')
+    self.idf = array('d')
+
+    doc_count = len(self.sections)
+    for term in sorted(counts_by_term):
+      postings = counts_by_term[term]
+      for doc_id, tf in postings:
+        self.doc_ids.append(doc_id)
+        self.term_freqs.append(min(tf, 0xFFFF))
+      self.offsets.append(len(self.doc_ids))
+      df = len(postings)
+      self.idf.append(math.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+
+    self.doc_lengths = array('I', (len(terms) for terms in doc_terms))
+    self.avg_doc_length = (sum(self.doc_lengths) / doc_count) if doc_count else 0.0
+    self.length_norm = array('d', (
+      k1 * (1 - b + b * length / self.avg_doc_length) if self.avg_doc_length else k1
+      for length in self.doc_lengths
+    ))
+
+  def __len__(self):
+    return len(self.sections)
+
+  def score(self, query_terms):
+    """Return a BM25 score per section for the given query terms"""
+    scores = [0.0] * len(self.sections)
+    if not self.sections:
+      return scores
+
+    k1 = self.k1
+    length_norm = self.length_norm
+
+    for term in query_terms:
+      term_id = self.vocabulary.get(term)
+      if term_id is None:
+        continue
+      idf = self.idf[term_id]
+      for i in range(self.offsets[term_id], self.offsets[term_id + 1]):
+        doc_id = self.doc_ids[i]
+        tf = self.term_freqs[i]
+        scores[doc_id] += idf * tf * (k1 + 1) / (tf + length_norm[doc_id])
+
+    return scores
+
+  def search(self, query, top_k=4):
+    """Return up to top_k (section, score) pairs with a positive score"""
+    terms = tokenize(query) if isinstance(query, str) else query
+    scores = self.score(terms)
+    best = heapq.nlargest(top_k, range(len(scores)), key=scores.__getitem__)
+    return [(self.sections[doc_id], scores[doc_id]) for doc_id in best if scores[doc_id] > 0]
+
+def build_query(messages):
+  """Build retrieval query terms from the user turns of a conversation window.
+
+  The latest user message is counted twice so it dominates, while earlier
+  user turns still give context to follow-ups like "what note?".
+  """
+  user_turns = [msg.get('content', '') for msg in messages if msg.get('role') == 'user']
+  if not user_turns:
+    return []
+  return tokenize(user_turns[-1]) * 2 + tokenize(' '.join(user_turns[:-1]))
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+
+# A streamed /chat response: real SSE, never cached or transformed, and not
+# buffered by nginx-style proxies (X-Accel-Buffering)
+CONTENT_TYPE = 'text/event-stream; charset=utf-8'
+HEADERS = {'Cache-Control': 'no-cache, no-transform', 'X-Accel-Buffering': 'no'}
+
+# Comment line sent on idle streams so proxies and clients keep the connection open
+HEARTBEAT = ': keep-alive\n\n'
+
+def content_data(text):
+  """JSON of a content event; encodes only the text instead of building a dict"""
+  return '{"type": "content", "content": ' + json.dumps(text) + '}'
+
+class EventStream:
+  """Formats one response as text/event-stream frames with increasing ids.
+
+  `content` returns the frame for a chunk of answer text. With
+  `coalesce_chars` set, text after the first chunk is held back and sent as
+  one frame once `coalesce_chars` characters are waiting or the oldest has
+  waited `coalesce_seconds`. Any other event, `done` and `tick` flush held
+  text first. The writer calls `tick` every `tick_seconds` while the
+  upstream is idle; it returns held text that is due, or a heartbeat comment
+  once nothing has been written for `heartbeat_seconds`. Every method
+  returns the text to write, which is empty when there is nothing to send.
+  """
+
+  def __init__(self, coalesce_chars=0, coalesce_seconds=0.05, heartbeat_seconds=0.0, clock=time.monotonic):
+    self.coalesce_chars = coalesce_chars
+    self.coalesce_seconds = coalesce_seconds
+    self.heartbeat_seconds = heartbeat_seconds
+    self.clock = clock
+    self.last_id = 0
+    self.frames = 0
+    self.pending = []
+    self.pending_chars = 0
+    self.pending_since = None
+    self.sent_content = False
+    self.last_write = clock()
+
+  @property
+  def tick_seconds(self):
+    """How often the writer should call `tick` while idle, or None if never"""
+    intervals = [s for s in (self.coalesce_seconds if self.coalesce_chars else 0, self.heartbeat_seconds) if s > 0]
+    return min(intervals) if intervals else None
+
+  def _frame(self, data):
+    self.last_id += 1
+    self.frames += 1
+    self.last_write = self.clock()
+    return f"id: {self.last_id}\ndata: {data}\n\n"
+
+  def content(self, text):
+    # The first text always goes out at once, so coalescing never delays TTFT
+    if not self.coalesce_chars or not self.sent_content:
+      self.sent_content = True
+      return self._frame(content_data(text))
+    now = self.clock()
+    if not self.pending:
+      self.pending_since = now
+    self.pending.append(text)
+    self.pending_chars += len(text)
+    if self.pending_chars >= self.coalesce_chars or now - self.pending_since >= self.coalesce_seconds:
+      return self.flush()
+    return ''
+
+  def flush(self):
+    if not self.pending:
+      return ''
+    text = ''.join(self.pending)
+    self.pending = []
+    self.pending_chars = 0
+    self.pending_since = None
+    return self._frame(content_data(text))
+
+  def event(self, payload):
+    return self.flush() + self._frame(json.dumps(payload))
+
+  def done(self):
+    return self.flush() + self._frame('[DONE]')
+
+  def tick(self):
+    now = self.clock()
+    if self.pending and now - self.pending_since >= self.coalesce_seconds:
+      return self.flush()
+    if self.heartbeat_seconds and now - self.last_write >= self.heartbeat_seconds:
+      self.last_write = now
+      return HEARTBEAT
+    return ''
+
+async def awith_ticks(iterator, interval):
+  """Items of iterator, plus None whenever `interval` seconds pass without one.
+
+  Waits on the event loop, so no thread is needed. With no interval the
+  iterator is passed through as is. Closing the returned generator also
+  closes the iterator.
+  """
+  pending = None
+  try:
+    if not interval:
+      async for item in iterator:
+        yield item
+      return
+    while True:
+      if pending is None:
+        pending = asyncio.ensure_future(iterator.__anext__())
+      done, _ = await asyncio.wait({pending}, timeout=interval)
+      if not done:
+        yield None
+        continue
+      next_item, pending = pending, None
+      try:
+        item = next_item.result()
+      except StopAsyncIteration:
+        return
+      yield item
+  finally:
+    if pending is not None:
+      pending.cancel()
+      try:
+        await pending
+      except BaseException:
+        pass
+    await iterator.aclose()
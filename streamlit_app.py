@@ -1,8 +1,11 @@
 import streamlit as st
 import requests
 import json
+import os
 from datetime import datetime
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configure Streamlit page
 st.set_page_config(
@@ -11,32 +14,90 @@ st.set_page_config(
   layout="wide"
 )
 
-# Flask backend URL
-FLASK_URL = "http://localhost:6000"
+# Flask backend URL (BACKEND_URL overrides it, e.g. for the ASGI server)
+FLASK_URL = os.getenv("BACKEND_URL", "http://localhost:6000").rstrip("/")
 
-def send_message_to_backend(message, messages=None):
-  """Send message to Flask backend"""
-  try:
-    # Include session messages if provided
-    request_data = {
-      "message": message,
-      "messages": messages or []
-    }
-    
-    response = requests.post(
+# Deadlines: time to open the connection, and the longest wait for the next
+# bytes of the response (the first chunk, or the next one mid-stream)
+CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+CONNECT_RETRIES = int(os.getenv("BACKEND_CONNECT_RETRIES", "2"))
+POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "20"))
+
+# A busy backend (429 rate limited, 503 admission queue full) says when to
+# come back in Retry-After; wait that long, at most BACKEND_BUSY_MAX_WAIT
+# seconds, up to BACKEND_BUSY_RETRIES times before showing the error
+BUSY_RETRIES = int(os.getenv("BACKEND_BUSY_RETRIES", "2"))
+BUSY_MAX_WAIT = float(os.getenv("BACKEND_BUSY_MAX_WAIT", "5"))
+
+# Sent as X-API-Key; list it in the backend's RATE_LIMIT_API_KEYS to give this
+# frontend its own rate limit bucket
+BACKEND_API_KEY = os.getenv("BACKEND_API_KEY", "")
+
+@st.cache_resource
+def get_http_session():
+  """Process-wide keep-alive session shared by every Streamlit session.
+  
+  Only connection failures are retried: the request never reached the
+  backend, so retrying a POST cannot generate an answer twice.
+  """
+  retry = Retry(total=None, connect=CONNECT_RETRIES, read=0, redirect=0, status=0, other=0, backoff_factor=0.2)
+  adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+  session = requests.Session()
+  session.mount("http://", adapter)
+  session.mount("https://", adapter)
+  return session
+
+def post_chat(request_data):
+  """POST to /chat, waiting out Retry-After while the backend is busy"""
+  for attempt in range(BUSY_RETRIES + 1):
+    response = get_http_session().post(
       f"{FLASK_URL}/chat",
       json=request_data,
+      headers={"X-API-Key": BACKEND_API_KEY} if BACKEND_API_KEY else None,
       stream=True,
-      timeout=30
+      timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
     )
+    if response.status_code not in (429, 503) or attempt == BUSY_RETRIES:
+      return response
+    try:
+      wait = float(response.headers.get("Retry-After", "1"))
+    except ValueError:
+      wait = 1.0
+    response.close()
+    time.sleep(min(max(wait, 0.1), BUSY_MAX_WAIT))
+
+def stream_from_backend(message, messages, result):
+  """Send message to Flask backend and yield the answer as it streams in.
+  
+  Once the backend has assigned a conversation_id only the new message is
+  sent; the full history is resent if the backend no longer knows it. The
+  final metrics event is stored in result["timing"] and any error, including
+  a mid-stream error event, in result["error"].
+  """
+  try:
+    conversation_id = st.session_state.get("conversation_id")
+    history = [{"role": msg["role"], "content": msg["content"]} for msg in (messages or [])]
+    
+    if conversation_id:
+      response = post_chat({"conversation_id": conversation_id, "message": message})
+      if response.status_code == 404:
+        response.close()
+        response = post_chat({"messages": history})
+    else:
+      response = post_chat({"messages": history or [{"role": "user", "content": message}]})
+    
+    if response.headers.get("X-Conversation-Id"):
+      st.session_state.conversation_id = response.headers["X-Conversation-Id"]
     
+    if response.status_code in (429, 503):
+      result["error"] = "The assistant is busy right now. Please try again in a few seconds."
+      return
     if response.status_code != 200:
-      return {"error": f"Backend returned status {response.status_code}: {response.text}"}
+      result["error"] = f"Backend returned status {response.status_code}: {response.text}"
+      return
     
     # Process streaming response
-    full_response = ""
-    metrics_data = {}
-    
     for line in response.iter_lines():
       if line:
         line_str = line.decode('utf-8')
@@ -44,200 +105,209 @@ def send_message_to_backend(message, messages=None):
           data_str = line_str[6:]  # Remove 'data: ' prefix
           
           if data_str == '[DONE]':
-            break
+            continue  # read to the end so the connection goes back to the pool
           
           try:
             data = json.loads(data_str)
-            
-            if data.get('type') == 'content':
-              full_response += data.get('content', '')
-            elif data.get('type') == 'metrics':
-              metrics_data = data
-            elif data.get('type') == 'error':
-              return {"error": data.get('error', 'Unknown error')}
-              
           except json.JSONDecodeError:
             continue
-    
-    return {
-      "response": full_response,
-      "timing": metrics_data
-    }
+          
+          if data.get('type') == 'content':
+            yield data.get('content', '')
+          elif data.get('type') == 'metrics':
+            result["timing"] = data
+          elif data.get('type') == 'error':
+            result["error"] = data.get('error', 'Unknown error')
+            return
     
   except requests.exceptions.RequestException as e:
-    return {"error": f"Failed to connect to backend: {str(e)}"}
+    result["error"] = f"Failed to connect to backend: {str(e)}"
 
-def render_chat_input():
-  """Render the chat input"""
-  prompt = st.chat_input("Ask me anything about HR policies, benefits, or procedures!")
-  if prompt:
-    # Add user message to chat history
-    st.session_state.messages.append({
-      "role": "user", 
-      "content": prompt,
-      "request_time": time.time(),
-      "timing": None
-    })
+def render_assistant_response(prompt):
+  """Render the answer chunk by chunk as it streams; returns (content, timing)"""
+  result = {"timing": None, "error": None}
+  
+  with st.chat_message("assistant"):
+    thinking = st.empty()
+    thinking.markdown("_Thinking..._")
     
-    # Display user message
-    with st.chat_message("user"):
-      st.markdown(prompt)
-
+    def chunks():
+      for text in stream_from_backend(prompt, st.session_state.messages, result):
+        thinking.empty()
+        yield text
+      thinking.empty()
     
-    # Get AI response
-    with st.chat_message("assistant"):
-      with st.spinner("Thinking..."):
-        response_data = send_message_to_backend(prompt, st.session_state.messages)
-        
-        if "error" in response_data:
-          st.error(response_data["error"])
-          response_content = f"Sorry, I encountered an error: {response_data['error']}"
-        else:
-          response_content = response_data.get("response", "I'm sorry, I didn't understand that.")
-          st.markdown(response_content)
+    streamed = st.write_stream(chunks())
+    response_content = streamed if isinstance(streamed, str) else ''.join(str(part) for part in streamed)
     
-    # Add assistant response to chat history
-    st.session_state.messages.append({
-      "role": "assistant", 
-      "content": response_content,
-      "timing": response_data.get("timing"),
-      "request_time": time.time()
-    })
-
-def main():
+    if result["error"]:
+      st.error(result["error"])
+      response_content = f"Sorry, I encountered an error: {result['error']}"
+    elif not response_content:
+      response_content = "I'm sorry, I didn't understand that."
+      st.markdown(response_content)
+    
+    # The newest answer gets the full panel, wherever it was asked from
+    if result["timing"] and "latency" in result["timing"]:
+      render_timing(result["timing"], detailed=True)
   
-  # Initialize session state
-  if "messages" not in st.session_state:
-    st.session_state.messages = []
+  return response_content, result["timing"]
+
+# Only the most recent messages are rendered on each run; older ones are
+# paged in on request so a run costs the same however long the session is
+RECENT_MESSAGES = 20
+HISTORY_PAGE_SIZE = 20
+
+EXAMPLE_PROMPTS = [
+  "what do I need for a loan?",
+  "can I apply?",
+  "what's voluntary contributions",
+  "what if I resigned in 5 years?",
+  "how long should I stay to get maximum benefit?",
+  "how much should I contribute so that I can leave in 15 years and have 1M pesos.",
+  "Which document should I have if I can't pay?",
+  "what note?",
+  "how I see the deductions and the details?",
+  "How do I enroll in health insurance benefits?",
+]
+
+def process_prompt(prompt):
+  """Add a user turn, stream the answer and store both in the chat history"""
+  # Add user message to chat history
+  st.session_state.messages.append({
+    "role": "user", 
+    "content": prompt,
+    "request_time": time.time(),
+    "timing": None
+  })
   
-  # Header
-  st.markdown("""
-  <div style="text-align: center; padding: 1rem 0; background: linear-gradient(90deg, #1f4e79, #2d5a87); color: white; border-radius: 10px; margin-bottom: 2rem;">
-    <h3>🏢 Optum's HR Specialist</h3>
-  </div>
-  """, unsafe_allow_html=True)
+  # Display user message
+  with st.chat_message("user"):
+    st.markdown(prompt)
   
-  # Render the chat interface
-  render_chat_interface()
+  # Get AI response, rendered as it streams
+  response_content, timing = render_assistant_response(prompt)
   
-  # Chat input
-  render_chat_input()
-
-
-def render_chat_interface():
-  """Render the chat interface"""
-  
-  # Display chat messages
-  for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-      st.markdown(message["content"])
-      
-      # Show timing information if available
-      if ("timing" in message and 
-          message["timing"] is not None and
-          "latency" in message["timing"]):
-        with st.expander("⏱️ Performance Metrics"):
-          timing = message["timing"]
-          
-          col1, col2, col3, col4 = st.columns(4)
-          
-          with col1:
-            st.metric("Input Tokens", timing.get("input_tokens", 0))
-          
-          with col2:
-            st.metric("Output Tokens", timing.get("output_tokens", 0))
-          
-          with col3:
-            st.metric("Total Tokens", timing.get("total_tokens", 0))
-          
-          with col4:
-            st.metric("Latency", f"{timing.get('latency', 0):.2f}s")
+  # Add assistant response to chat history
+  st.session_state.messages.append({
+    "role": "assistant", 
+    "content": response_content,
+    "timing": timing,
+    "request_time": time.time()
+  })
 
-  # Example prompts
-  st.markdown("---")
-  st.markdown("#### 💡 HR Questions Ideas")
-  col1, col2, col3, col4, col5 = st.columns(5)
+def render_timing(timing, detailed):
+  """Performance metrics of an answer: full panel for the latest, one line for older ones"""
+  ttft = timing.get("ttft")
+  ttft_text = f"{ttft:.2f}s" if ttft is not None else "n/a"
+  
+  if not detailed:
+    st.caption(
+      f"⏱️ Latency {timing.get('latency', 0):.2f}s · Time to first token {ttft_text} · "
+      f"Tokens {timing.get('input_tokens', 0)} in / {timing.get('output_tokens', 0)} out"
+    )
+    return
   
-  def process_example_prompt(prompt_text):
-    """Process an example prompt by sending it to the backend"""
+  with st.expander("⏱️ Performance Metrics"):
+    col1, col2, col3, col4, col5 = st.columns(5)
     
-    # Add user message to chat history
-    st.session_state.messages.append({
-      "role": "user", 
-      "content": prompt_text,
-      "request_time": time.time(),
-      "timing": None
-    })
+    with col1:
+      st.metric("Input Tokens", timing.get("input_tokens", 0))
     
-    # Display user message
-    with st.chat_message("user"):
-      st.markdown(prompt_text)
+    with col2:
+      st.metric("Output Tokens", timing.get("output_tokens", 0))
     
-    # Get AI response
-    with st.chat_message("assistant"):
-      with st.spinner("Thinking..."):
-        response_data = send_message_to_backend(prompt_text, st.session_state.messages)
-        
-        if "error" in response_data:
-          st.error(response_data["error"])
-          response_content = f"Sorry, I encountered an error: {response_data['error']}"
-        else:
-          response_content = response_data.get("response", "I'm sorry, I didn't understand that.")
-          st.markdown(response_content)
+    with col3:
+      st.metric("Total Tokens", timing.get("total_tokens", 0))
     
-    # Add assistant response to chat history
-    st.session_state.messages.append({
-      "role": "assistant", 
-      "content": response_content,
-      "timing": response_data.get("timing"),
-      "request_time": time.time()
-    })
+    with col4:
+      st.metric("Time to First Token", ttft_text)
     
-    st.rerun()
+    with col5:
+      st.metric("Latency", f"{timing.get('latency', 0):.2f}s")
+
+def render_message(message, detailed=False):
+  with st.chat_message(message["role"]):
+    st.markdown(message["content"])
+    
+    # Show timing information if available
+    if message.get("timing") and "latency" in message["timing"]:
+      render_timing(message["timing"], detailed)
+
+def show_earlier_messages():
+  st.session_state.history_shown = st.session_state.get("history_shown", RECENT_MESSAGES) + HISTORY_PAGE_SIZE
+
+@st.fragment
+def render_transcript():
+  """Render the chat history up to the last full run; paging in older messages reruns only this fragment"""
+  messages = st.session_state.messages
+  # Turns asked from the grid since the last full run belong to its fragment
+  end = st.session_state.get("transcript_rendered", len(messages))
+  shown = st.session_state.get("history_shown", RECENT_MESSAGES)
+  start = max(0, end - shown)
   
-  with col1:
-    if st.button("what do I need for a loan?"):
-      process_example_prompt("what do I need for a loan?")
+  if start:
+    st.button(f"Show earlier messages ({start} hidden)", on_click=show_earlier_messages)
   
-  with col2:
-    if st.button("can I apply?"):
-      process_example_prompt("can I apply?")
+  last = len(messages) - 1
+  for i in range(start, end):
+    render_message(messages[i], detailed=i == last)
+
+def queue_prompt(prompt_text):
+  st.session_state.pending_prompt = prompt_text
+
+@st.fragment
+def render_example_prompts():
+  """Example prompt grid; a click reruns only this fragment, which streams the answer"""
+  messages = st.session_state.messages
+  asked_here = messages[st.session_state.get("transcript_rendered", len(messages)):]
   
-  with col3:
-    if st.button("what's voluntary contributions"):
-      process_example_prompt("what's voluntary contributions")
+  # The fragment shows at most the latest turn asked from the grid: a second
+  # question first reruns the whole app, moving earlier turns to the transcript
+  if asked_here and "pending_prompt" in st.session_state:
+    st.rerun()
   
-  with col4:
-    if st.button("what if I resigned in 5 years?"):
-      process_example_prompt("what if I resigned in 5 years?")
+  last = len(messages) - 1
+  for i, message in enumerate(asked_here, start=len(messages) - len(asked_here)):
+    render_message(message, detailed=i == last)
   
-  with col5:
-    if st.button("how long should I stay to get maximum benefit?"):
-      process_example_prompt("how long should I stay to get maximum benefit?")
-
-  # Additional example prompts row
-  col1, col2, col3, col4, col5 = st.columns(5)
+  prompt_text = st.session_state.pop("pending_prompt", None)
+  if prompt_text:
+    process_prompt(prompt_text)
+  
+  # Example prompts
+  st.markdown("---")
+  st.markdown("#### 💡 HR Questions Ideas")
+  for row in range(0, len(EXAMPLE_PROMPTS), 5):
+    for col, example in zip(st.columns(5), EXAMPLE_PROMPTS[row:row + 5]):
+      with col:
+        st.button(example, on_click=queue_prompt, args=(example,))
 
-  with col1:
-    if st.button("how much should I contribute so that I can leave in 15 years and have 1M pesos."):
-      process_example_prompt("how much should I contribute so that I can leave in 15 years and have 1M pesos.")
+def main():
+  
+  # Initialize session state
+  if "messages" not in st.session_state:
+    st.session_state.messages = []
   
-  with col2:
-    if st.button("Which document should I have if I can't pay?"):
-      process_example_prompt("Which document should I have if I can't pay?")
+  # Header
+  st.markdown("""
+  <div style="text-align: center; padding: 1rem 0; background: linear-gradient(90deg, #1f4e79, #2d5a87); color: white; border-radius: 10px; margin-bottom: 2rem;">
+    <h3>🏢 Optum's HR Specialist</h3>
+  </div>
+  """, unsafe_allow_html=True)
   
-  with col3:
-    if st.button("what note?"):
-      process_example_prompt("what note?")
+  # Render the chat history; every full run moves all turns into it
+  st.session_state.transcript_rendered = len(st.session_state.messages)
+  render_transcript()
   
-  with col4:
-    if st.button("how I see the deductions and the details?"):
-      process_example_prompt("how I see the deductions and the details?")
+  # Chat input
+  prompt = st.chat_input("Ask me anything about HR policies, benefits, or procedures!")
+  if prompt:
+    process_prompt(prompt)
+    st.session_state.transcript_rendered = len(st.session_state.messages)
   
-  with col5:
-    if st.button("How do I enroll in health insurance benefits?"):
-      process_example_prompt("How do I enroll in health insurance benefits?")
+  render_example_prompts()
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
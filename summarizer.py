@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+  "You maintain a running summary of a conversation between an employee and "
+  "Optum's HR Specialist chatbot about the retirement fund. Update the summary "
+  "with the new turns. Keep the facts the employee shared (status, amounts, "
+  "dates, choices), the questions already answered and anything still open. "
+  "Write at most {max_words} words of plain text, no preamble."
+)
+
+# Prefix of the message that carries the summary into the conversation window
+SUMMARY_PREFIX = "Summary of our earlier conversation: "
+
+def prefix_hashes(messages):
+  """Chained hash of every prefix of messages; item i identifies messages[:i + 1]"""
+  hashes = []
+  digest = b''
+  for msg in messages:
+    digest = hashlib.sha256(
+      digest + msg.get('role', '').encode('utf-8') + b'\0' + msg.get('content', '').encode('utf-8')
+    ).digest()
+    hashes.append(digest)
+  return hashes
+
+class Summary:
+  """A rolling summary of the first `covered` messages of a conversation"""
+
+  def __init__(self, text, covered, created_at):
+    self.text = text
+    self.covered = covered
+    self.created_at = created_at
+
+class ConversationSummarizer:
+  """Rolling summaries of the turns that fell out of the conversation window.
+
+  Summaries are keyed on a hash of the exact message prefix they cover, so
+  each conversation finds its own without an id. `lookup` returns the
+  longest cached summary of the dropped turns; `schedule` updates it in the
+  background once a response has completed, folding the newly dropped turns
+  into the previous summary. A summary therefore lags the window by at most
+  one request, and never blocks one.
+  """
+
+  def __init__(self, client, model, max_tokens=200, max_entries=1024, workers=2, on_usage=None):
+    self.client = client
+    self.model = model
+    self.max_tokens = max_tokens
+    self.max_entries = max_entries
+    self.on_usage = on_usage
+    self.config = types.GenerateContentConfig(
+      system_instruction=SUMMARY_INSTRUCTIONS.format(max_words=int(max_tokens * 0.6)),
+      temperature=0.2,
+      max_output_tokens=max_tokens,
+    )
+    self.entries = OrderedDict()
+    self.pending = set()
+    self.lock = threading.Lock()
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='summarizer')
+
+  def lookup(self, dropped):
+    """Longest cached summary covering a prefix of `dropped`, or None"""
+    hashes = prefix_hashes(dropped)
+    with self.lock:
+      for digest in reversed(hashes):
+        summary = self.entries.get(digest)
+        if summary is not None:
+          self.entries.move_to_end(digest)
+          return summary
+    return None
+
+  def schedule(self, dropped):
+    """Summarize `dropped` in the background unless it is cached or in progress"""
+    if not dropped:
+      return
+    key = prefix_hashes(dropped)[-1]
+    with self.lock:
+      if key in self.entries or key in self.pending:
+        return
+      self.pending.add(key)
+    self.executor.submit(self._update, list(dropped), key)
+
+  def _update(self, dropped, key):
+    try:
+      previous = self.lookup(dropped)
+      covered = previous.covered if previous else 0
+      start_time = time.time()
+      response = self.client.models.generate_content(
+        model=self.model,
+        contents=self.build_prompt(previous, dropped[covered:]),
+        config=self.config,
+      )
+      text = (response.text or '').strip()
+      if not text:
+        return
+      with self.lock:
+        self.entries[key] = Summary(text, len(dropped), time.time())
+        while len(self.entries) > self.max_entries:
+          self.entries.popitem(last=False)
+      logger.info(
+        "Summarized %d new turns (%d total) into %d characters in %.2fs",
+        len(dropped) - covered, len(dropped), len(text), time.time() - start_time,
+      )
+      if self.on_usage and response.usage_metadata:
+        self.on_usage(response.usage_metadata)
+    except Exception as e:
+      logger.warning("Conversation summary failed: %s", e)
+    finally:
+      with self.lock:
+        self.pending.discard(key)
+
+  def build_prompt(self, previous, new_messages):
+    turns = '\n'.join(
+      f"{'Employee' if msg.get('role') == 'user' else 'HR Specialist'}: {msg.get('content', '')}"
+      for msg in new_messages
+    )
+    text = f"Current summary:\n{previous.text if previous else '(none)'}\n\nNew turns:\n{turns}"
+    return [types.Content(role='user', parts=[types.Part.from_text(text=text)])]
+
+  @staticmethod
+  def as_message(summary):
+    """The summary as one compact user message for the conversation window"""
+    return {'role': 'user', 'content': SUMMARY_PREFIX + summary.text}
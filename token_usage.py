@@ -0,0 +1,137 @@
+import functools
+import logging
+import math
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The SDK's local tokenizer only knows concrete model names
+TOKENIZER_MODEL_ALIASES = {
+  'gemini-flash-lite-latest': 'gemini-2.5-flash-lite',
+  'gemini-flash-latest': 'gemini-2.5-flash',
+  'gemini-pro-latest': 'gemini-2.5-pro',
+}
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+def estimate_tokens(text):
+  """Heuristic token count for when no tokenizer is available.
+
+  SentencePiece vocabularies split long words into ~4 character pieces and
+  punctuation into its own tokens; this tracks real counts far better than
+  whitespace splitting.
+  """
+  return sum(max(1, math.ceil(len(piece) / 4)) for piece in WORD_PATTERN.findall(text))
+
+class TokenUsage:
+  """Token counts for one generation.
+
+  prompt_tokens includes cached_tokens; output_tokens counts candidate and
+  thinking tokens, which are both billed at the output rate.
+  """
+
+  def __init__(self, prompt_tokens=0, cached_tokens=0, candidate_tokens=0, thinking_tokens=0, source='usage_metadata'):
+    self.prompt_tokens = prompt_tokens
+    self.cached_tokens = min(cached_tokens, prompt_tokens)
+    self.candidate_tokens = candidate_tokens
+    self.thinking_tokens = thinking_tokens
+    self.source = source
+
+  @property
+  def uncached_prompt_tokens(self):
+    return self.prompt_tokens - self.cached_tokens
+
+  @property
+  def output_tokens(self):
+    return self.candidate_tokens + self.thinking_tokens
+
+  @property
+  def total_tokens(self):
+    return self.prompt_tokens + self.output_tokens
+
+def usage_from_metadata(usage_metadata):
+  """Build TokenUsage from a stream's usage_metadata, or None if it has no counts"""
+  if usage_metadata is None or usage_metadata.prompt_token_count is None:
+    return None
+  return TokenUsage(
+    prompt_tokens=usage_metadata.prompt_token_count or 0,
+    cached_tokens=usage_metadata.cached_content_token_count or 0,
+    candidate_tokens=usage_metadata.candidates_token_count or 0,
+    thinking_tokens=usage_metadata.thoughts_token_count or 0,
+  )
+
+class TokenCounter:
+  """Offline token counter used when a stream reports no usage_metadata.
+
+  Uses the google-genai LocalTokenizer (needs `sentencepiece`). Building it
+  may download the tokenizer model, with no timeout, so it is loaded on a
+  background thread (`warm`, also started by the first count) and counts
+  are `estimate_tokens` until it is ready. A failed load is retried after
+  `retry_seconds`.
+  """
+
+  def __init__(self, model, retry_seconds=300):
+    self.model = TOKENIZER_MODEL_ALIASES.get(model, model)
+    self.retry_seconds = retry_seconds
+    self.tokenizer = None
+    self.loading = False
+    self.failed_at = None
+    self.lock = threading.Lock()
+    self.count = functools.lru_cache(maxsize=1024)(self._count)
+
+  @property
+  def source(self):
+    return 'tokenizer' if self.tokenizer else 'estimate'
+
+  def warm(self):
+    """Start loading the tokenizer unless it is loaded, loading or failed recently"""
+    with self.lock:
+      if self.tokenizer or self.loading:
+        return
+      if self.failed_at is not None and time.monotonic() - self.failed_at < self.retry_seconds:
+        return
+      self.loading = True
+    threading.Thread(target=self._load, daemon=True, name='tokenizer-load').start()
+
+  def _load(self):
+    try:
+      from google.genai.local_tokenizer import LocalTokenizer
+      tokenizer = LocalTokenizer(model_name=self.model)
+    except Exception as e:
+      logger.warning(f"Local tokenizer unavailable for {self.model}, using heuristic token estimates: {str(e)}")
+      with self.lock:
+        self.failed_at = time.monotonic()
+        self.loading = False
+      return
+    with self.lock:
+      self.tokenizer = tokenizer
+      self.loading = False
+    # Drop the estimates counted while loading
+    self.count.cache_clear()
+    logger.info(f"Local tokenizer loaded for {self.model}")
+
+  def _count(self, text):
+    if not text:
+      return 0
+    if self.tokenizer is None:
+      self.warm()
+      return estimate_tokens(text)
+    try:
+      return self.tokenizer.count_tokens(text).total_tokens
+    except Exception as e:
+      logger.debug(f"Local tokenizer failed, estimating: {str(e)}")
+    return estimate_tokens(text)
+
+  def usage(self, prompt_texts, response_text, cached_text=None):
+    """Estimate TokenUsage from the prompt pieces and the response text"""
+    source = self.source
+    prompt_tokens = sum(self.count(text) for text in prompt_texts)
+    cached_tokens = self.count(cached_text) if cached_text else 0
+    return TokenUsage(
+      prompt_tokens=prompt_tokens,
+      cached_tokens=cached_tokens,
+      candidate_tokens=self.count(response_text),
+      source=source,
+    )
@@ -0,0 +1,64 @@
+import logging
+import os
+from collections import namedtuple
+
+from context_cache import GenaiCacheBackend, InMemoryCacheBackend
+
+logger = logging.getLogger(__name__)
+
+# The model API the app streams from. `client` is anything exposing the parts
+# of genai.Client the app uses (models.generate_content_stream and
+# aio.models.generate_content_stream); `cache_backend` registers cached
+# prompt prefixes for it.
+Upstream = namedtuple('Upstream', ['name', 'client', 'cache_backend'])
+
+UPSTREAM_BACKENDS = ('gemini', 'fake', 'replay')
+
+# HTTP timeout of every Gemini API call, per connect and per read, so a hung
+# stream eventually fails. Attempts abandoned at the first-chunk deadline
+# (resilience.py) keep waiting on their call until then, so keep it well
+# above UPSTREAM_FIRST_CHUNK_TIMEOUT_SECONDS. 0 leaves the SDK default (none).
+UPSTREAM_HTTP_TIMEOUT_SECONDS = float(os.getenv('UPSTREAM_HTTP_TIMEOUT_SECONDS', '60'))
+
+def create_upstream(name='gemini', api_key=None, record=False):
+  """Build the upstream named by GEMINI_BACKEND: the Gemini API, the offline fake or recorded streams.
+
+  With `record`, every completed stream of the gemini or fake upstream is
+  also saved to the cassette file at CASSETTE_PATH, for later replay.
+  """
+  name = (name or 'gemini').lower()
+  upstream = _create_upstream(name, api_key)
+  if record and name != 'replay':
+    from cassettes import DEFAULT_CASSETTE_PATH, CassetteStore, RecordingClient
+    store = CassetteStore(os.getenv('CASSETTE_PATH', DEFAULT_CASSETTE_PATH))
+    logger.warning("Recording upstream streams to %s (%d already recorded)", store.path, len(store))
+    upstream = upstream._replace(client=RecordingClient(upstream.client, store))
+  return upstream
+
+def _create_upstream(name, api_key):
+  if name == 'gemini':
+    from google import genai
+    from google.genai import types
+    http_options = types.HttpOptions(timeout=int(UPSTREAM_HTTP_TIMEOUT_SECONDS * 1000)) if UPSTREAM_HTTP_TIMEOUT_SECONDS else None
+    client = genai.Client(api_key=api_key, http_options=http_options)
+    return Upstream(name, client, GenaiCacheBackend(client))
+
+  if name == 'fake':
+    from fake_gemini import FakeClient, FakeStreamProfile
+    profile = FakeStreamProfile.from_env()
+    cache_backend = InMemoryCacheBackend()
+    logger.warning(
+      "Using the offline fake upstream (TTFT %r, error rate %.2f); responses are canned",
+      profile.ttft, profile.error_rate,
+    )
+    return Upstream(name, FakeClient(profile, cache_backend), cache_backend)
+
+  if name == 'replay':
+    from cassettes import DEFAULT_CASSETTE_PATH, CassetteStore, ReplayClient
+    store = CassetteStore(os.getenv('CASSETTE_PATH', DEFAULT_CASSETTE_PATH))
+    time_scale = float(os.getenv('CASSETTE_TIME_SCALE', '1'))
+    cache_backend = InMemoryCacheBackend()
+    logger.warning("Replaying %d recorded streams from %s (time scale %.2f)", len(store), store.path, time_scale)
+    return Upstream(name, ReplayClient(store, time_scale, cache_backend), cache_backend)
+
+  raise ValueError(f"Unknown GEMINI_BACKEND {name!r}, expected one of {', '.join(UPSTREAM_BACKENDS)}")